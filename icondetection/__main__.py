@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import sys
+
+from typing import List
+
+from icondetection import benchmark as benchmarks
+from icondetection.engines import ENGINES
+from icondetection.batch import export_rects, find_images, run_batch
+from icondetection.cache import DetectionCache
+from icondetection.service import DetectionService
+
+
+def add_detection_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the detection parameters shared by every subcommand.
+    """
+    parser.add_argument("--min-threshold", type=int, default=100, help="lower Canny hysteresis threshold")
+    parser.add_argument("--multiplier", type=float, default=2, help="ratio of the upper to the lower threshold")
+    parser.add_argument("--contour-accuracy", type=int, default=3, help="polygon approximation accuracy in pixels")
+
+
+def batch(args: argparse.Namespace) -> int:
+    paths = find_images(args.inputs)
+    written = run_batch(
+        paths,
+        args.output,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        resume=not args.no_resume,
+        min_threshold=args.min_threshold,
+        multiplier=args.multiplier,
+        contour_accuracy=args.contour_accuracy,
+    )
+    print("{0} images found, {1} processed".format(len(paths), written), file=sys.stderr)
+    if args.rects is not None:
+        export_rects(args.output, args.rects)
+
+    return 0
+
+
+def benchmark(args: argparse.Namespace) -> int:
+    rect_counts = [count for count in benchmarks.DEFAULT_RECT_COUNTS if count <= args.max_rects]
+    cases = benchmarks.build_cases(args.images, rect_counts, args.seed, args.filter)
+    results = benchmarks.run_benchmarks(cases, args.repeat, args.warmup, args.max_seconds, report=print)
+
+    if args.save is not None:
+        benchmarks.save_baseline(results, args.save)
+    if args.baseline is None:
+        return 0
+
+    found = benchmarks.regressions(results, benchmarks.load_baseline(args.baseline), args.tolerance)
+    for regression in found:
+        print("regression: {0}".format(regression), file=sys.stderr)
+
+    return 1 if found else 0
+
+
+def engines(args: argparse.Namespace) -> int:
+    comparison = benchmarks.compare_engines(
+        args.images, args.engines, args.reference, args.min_iou, args.repeat, report=print
+    )
+    fastest = benchmarks.fastest_engine(comparison, args.min_recall)
+    if fastest is None:
+        print("no engine reaches a recall of {0:.1%}".format(args.min_recall), file=sys.stderr)
+        return 1
+
+    print("fastest engine with a recall of at least {0:.1%}: {1}".format(args.min_recall, fastest))
+    return 0
+
+
+def serve(args: argparse.Namespace) -> int:
+    service = DetectionService(
+        DetectionCache(args.cache_entries, args.cache_dir), max_batch=args.max_batch, batch_window=args.batch_window
+    )
+
+    async def run() -> None:
+        server = await service.start(path=args.socket, host=args.host, port=args.port)
+        print("listening on {0}".format(args.socket or server.sockets[0].getsockname()), file=sys.stderr)
+        try:
+            await server.serve_forever()
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="icondetection", description="Detect icons on screenshots.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    batch_parser = subparsers.add_parser("batch", help="detect rects over many images, writing JSONL records")
+    batch_parser.add_argument("inputs", nargs="+", help="image directories or glob patterns")
+    batch_parser.add_argument("-o", "--output", required=True, help="JSONL file the records are appended to")
+    batch_parser.add_argument("--rects", help="also gather the rects of every record into this binary rect file")
+    batch_parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes, all CPUs by default")
+    batch_parser.add_argument("--chunksize", type=int, default=16, help="images handed to a worker at a time")
+    batch_parser.add_argument(
+        "--no-resume", action="store_true", help="overwrite the output instead of skipping images already in it"
+    )
+    add_detection_arguments(batch_parser)
+    batch_parser.set_defaults(handler=batch)
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="time the pipeline stages and compare to a baseline")
+    benchmark_parser.add_argument("-k", "--filter", help="only run cases whose name matches this fnmatch pattern")
+    benchmark_parser.add_argument("--images", default=benchmarks.DEFAULT_IMAGES, help="directory of images to time")
+    benchmark_parser.add_argument(
+        "--max-rects", type=int, default=max(benchmarks.DEFAULT_RECT_COUNTS), help="largest synthetic rect set"
+    )
+    benchmark_parser.add_argument("--repeat", type=int, default=20, help="timed runs per case")
+    benchmark_parser.add_argument("--warmup", type=int, default=1, help="untimed runs per case")
+    benchmark_parser.add_argument("--max-seconds", type=float, default=10, help="time budget per case")
+    benchmark_parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic rect sets")
+    benchmark_parser.add_argument("--save", help="write the results to this JSON baseline")
+    benchmark_parser.add_argument("--baseline", help="JSON baseline to compare the results to")
+    benchmark_parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="largest slowdown of the median allowed, as a fraction"
+    )
+    benchmark_parser.set_defaults(handler=benchmark)
+
+    engines_parser = subparsers.add_parser(
+        "engines", help="pick the fastest detection engine recalling enough of the reference engine's rects"
+    )
+    engines_parser.add_argument("--images", default=benchmarks.DEFAULT_IMAGES, help="directory of images to compare on")
+    engines_parser.add_argument(
+        "--engines", nargs="+", choices=list(ENGINES), help="engines to compare, all by default"
+    )
+    engines_parser.add_argument("--reference", default="canny", choices=list(ENGINES), help="engine taken as truth")
+    engines_parser.add_argument("--min-recall", type=float, default=0.95, help="smallest recall accepted")
+    engines_parser.add_argument("--min-iou", type=float, default=0.5, help="smallest IoU counting as a match")
+    engines_parser.add_argument("--repeat", type=int, default=5, help="timed runs per engine and image")
+    engines_parser.set_defaults(handler=engines)
+
+    serve_parser = subparsers.add_parser("serve", help="run a detection service on a Unix socket or localhost port")
+    serve_parser.add_argument("--socket", help="path of the Unix socket to listen on")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="address to listen on when no socket is given")
+    serve_parser.add_argument("--port", type=int, default=8765, help="port to listen on when no socket is given")
+    serve_parser.add_argument("--max-batch", type=int, default=16, help="most requests handled as one batch")
+    serve_parser.add_argument(
+        "--batch-window", type=float, default=0.002, help="seconds to wait for more requests to batch"
+    )
+    serve_parser.add_argument("--cache-entries", type=int, default=256, help="results kept in memory")
+    serve_parser.add_argument("--cache-dir", help="directory results are also kept in")
+    serve_parser.set_defaults(handler=serve)
+
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
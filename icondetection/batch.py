@@ -0,0 +1,161 @@
+import glob
+import json
+import os
+import tempfile
+import time
+from functools import partial
+from multiprocessing import Pool
+
+import cv2 as cv
+from typing import Iterable, List
+
+from icondetection.pipeline import DetectionPipeline
+from icondetection.rect_format import index_from_counts, write_rects
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+# pipeline stages timed for every image, in the order they run
+_STAGES = ("gray", "edges", "contours", "polygons_and_rects", "grouped")
+
+
+def find_images(inputs: Iterable[str]) -> List[str]:
+    """
+    Expand directories (walked recursively) and glob patterns into a sorted list of image paths, without duplicates.
+    """
+    paths = set()
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for directory, _, files in os.walk(entry):
+                paths.update(
+                    os.path.join(directory, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS)
+                )
+        else:
+            paths.update(path for path in glob.glob(entry, recursive=True) if os.path.isfile(path))
+
+    return sorted(paths)
+
+
+def detect_file(path: str, min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3) -> dict:
+    """
+    Run the detection pipeline over one image file and return its JSONL record: the path, the image size, the grouped
+    rects in CV representation and the time in seconds spent in each stage. Unreadable files, and files any stage
+    fails on, give a record with an error instead, so that one bad file does not stop the whole run.
+    """
+    try:
+        start = time.perf_counter()
+        image = cv.imread(path)
+        timings = {"read": time.perf_counter() - start}
+        if image is None:
+            return {"path": path, "error": "unreadable image"}
+
+        pipeline = DetectionPipeline(image, min_threshold, multiplier, contour_accuracy)
+        for stage in _STAGES:
+            start = time.perf_counter()
+            getattr(pipeline, stage)()
+            timings[stage] = time.perf_counter() - start
+    except Exception as exception:
+        return {"path": path, "error": "{0}: {1}".format(type(exception).__name__, exception)}
+
+    return {
+        "path": path,
+        "width": image.shape[1],
+        "height": image.shape[0],
+        "rects": [list(rect) for rect in pipeline.grouped()],
+        "timings": timings,
+    }
+
+
+def completed_paths(output: str) -> set:
+    """
+    Return the paths already detected successfully in a JSONL output file. A last line cut short by an interrupted
+    run is dropped from the file, so appending can resume right after the last complete record. Records of errors,
+    which may well have been transient, are dropped too, so that their images are tried again.
+    """
+    if not os.path.exists(output):
+        return set()
+
+    with open(output, "rb+") as output_file:
+        content = output_file.read()
+        complete = content.rfind(b"\n") + 1
+        if complete < len(content):
+            output_file.truncate(complete)
+
+    lines = [line for line in content[:complete].splitlines(keepends=True) if line.strip()]
+    records = [json.loads(line) for line in lines]
+    if any("error" in record for record in records):
+        # the file is replaced whole, so an interruption leaves either the old records or the kept ones
+        with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(os.path.abspath(output)), suffix=".tmp", delete=False
+        ) as kept:
+            kept.writelines(line for line, record in zip(lines, records) if "error" not in record)
+        os.replace(kept.name, output)
+
+    return {record["path"] for record in records if "error" not in record}
+
+
+def _initialize_worker() -> None:
+    # the pool provides the parallelism, so OpenCV's own threads would only compete with it
+    cv.setNumThreads(1)
+
+
+def run_batch(paths: Iterable[str], output: str, workers: int = None, chunksize: int = 16, resume: bool = True,
+              min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3) -> int:
+    """
+    Detect the grouped rects of every image in paths using a pool of worker processes, appending one JSON record per
+    image to output as results come in. Records arrive in completion order, not in the order of paths.
+
+    With resume, images already detected in output are skipped, so an interrupted run can be started again with the
+    same arguments, and images that failed are tried again; otherwise output is overwritten. workers defaults to the
+    number of CPUs, and 1 runs in this process. Returns the number of records written.
+    """
+    if chunksize < 1:
+        raise ValueError("chunksize must be positive, got {0}".format(chunksize))
+
+    done = completed_paths(output) if resume else set()
+    pending = [path for path in paths if path not in done]
+    detect = partial(
+        detect_file, min_threshold=min_threshold, multiplier=multiplier, contour_accuracy=contour_accuracy
+    )
+
+    written = 0
+    with open(output, "a" if resume else "w") as output_file:
+        if workers == 1:
+            records = map(detect, pending)
+            pool = None
+        else:
+            pool = Pool(workers, initializer=_initialize_worker)
+            records = pool.imap_unordered(detect, pending, chunksize)
+
+        try:
+            for record in records:
+                # one write per record, so an interruption loses at most the line being written
+                output_file.write(json.dumps(record) + "\n")
+                output_file.flush()
+                written += 1
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    return written
+
+
+def export_rects(output: str, rects_path: str) -> int:
+    """
+    Gather the rects of every record of a JSONL output file into one rect file, whose index holds the rects of the
+    n-th record as its n-th image; records with an error count as images without rects. Returns the number of
+    images.
+    """
+    counts = []
+    rects = []
+    with open(output) as output_file:
+        for line in output_file:
+            if not line.strip():
+                continue
+            record_rects = json.loads(line).get("rects", [])
+            counts.append(len(record_rects))
+            rects.extend(record_rects)
+
+    write_rects(rects_path, rects, index=index_from_counts(counts))
+
+    return len(counts)
@@ -0,0 +1,376 @@
+import fnmatch
+import json
+import os
+import time
+from functools import cached_property
+
+import cv2 as cv
+import numpy as np
+from typing import Callable, List, NamedTuple
+
+from icondetection import box, engines
+from icondetection.batch import IMAGE_EXTENSIONS
+from icondetection.rect_array import RectArray
+from icondetection.rect_index import RectIndex
+from icondetection.rectangle import Rectangle
+from icondetection.weighted_quick_unionUF import QuickUnionArrayUF, WeightedQuickUnionUF
+
+# the images shipped with the repository's tests
+DEFAULT_IMAGES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test", "test-images")
+
+DEFAULT_RECT_COUNTS = (10, 100, 1000, 10000, 100000, 1000000)
+
+# number of points asked for by one run of the batched candidate benchmarks
+_QUERY_POINTS = 1000
+
+# cases whose cost grows too fast with the number of rects stop there, as one run would take minutes
+_MAX_RECTS = {
+    "group_rects": 100000,
+    "WeightedQuickUnionUF": 1000000,
+    "candidate_rectangle": 100000,
+    "candidate_rectangles": 100000,
+}
+
+
+class Case(NamedTuple):
+    """
+    One benchmark: run is the timed function, and items returns the amount of work one run does, counted in unit
+    (pixels, rects, ...), for throughput. Inputs are built by the first run, which is never timed.
+    """
+
+    name: str
+    unit: str
+    run: Callable[[], object]
+    items: Callable[[], int]
+
+
+def synthetic_cv_rects(count: int, seed: int = 0) -> np.ndarray:
+    """
+    Return count random rects in CV representation, as an (N, 4) array. The canvas grows with count so that the
+    density, and so the share of overlapping rects, stays about the same as on a busy screenshot.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.sqrt(count) * 40) + 100
+    sizes = rng.integers(4, 40, size=(count, 2))
+    corners = rng.integers(0, side - 40, size=(count, 2))
+
+    return np.hstack((corners, sizes)).astype(np.int32)
+
+
+class _ImageInputs:
+    """
+    The inputs of every stage for one image, read on first use.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # engine name -> grouped rects
+        self._engine_groups = {}
+
+    @cached_property
+    def image(self):
+        image = cv.imread(self.path)
+        if image is None:
+            raise ValueError("cannot read image {0}".format(self.path))
+        return image
+
+    @cached_property
+    def pixels(self) -> int:
+        return self.image.shape[0] * self.image.shape[1]
+
+    @cached_property
+    def gray(self):
+        return box.grayscale_blur(self.image)
+
+    @cached_property
+    def bound_rect(self) -> list:
+        return box.canny_detection(self.gray)[1]
+
+    def engine_groups(self, engine: str) -> List[tuple]:
+        """
+        The grouped rects found by the named engine.
+        """
+        if engine not in self._engine_groups:
+            self._engine_groups[engine] = box.group_rects(engines.detect_rects(self.gray, engine))
+        return self._engine_groups[engine]
+
+
+class _RectInputs:
+    """
+    A synthetic rect set in every representation the cases need, along with query points and union pairs, built on
+    first use.
+    """
+
+    def __init__(self, count: int, seed: int):
+        self.count = count
+        self.seed = seed
+
+    @cached_property
+    def cv_rects(self) -> np.ndarray:
+        return synthetic_cv_rects(self.count, self.seed)
+
+    @cached_property
+    def rect_list(self) -> List[tuple]:
+        return [tuple(rect) for rect in self.cv_rects.tolist()]
+
+    @cached_property
+    def rectangles(self) -> List[Rectangle]:
+        return [Rectangle.rect_cv_to_cartesian(rect) for rect in self.rect_list]
+
+    @cached_property
+    def rect_array(self) -> RectArray:
+        return RectArray.from_cv(self.cv_rects)
+
+    @cached_property
+    def index(self) -> RectIndex:
+        return RectIndex(self.rectangles)
+
+    @cached_property
+    def points(self) -> np.ndarray:
+        side = int(self.cv_rects[:, :2].max()) + 40
+        return np.random.default_rng(self.seed + 1).integers(0, side, size=(_QUERY_POINTS, 2))
+
+    @cached_property
+    def point_list(self) -> List[tuple]:
+        return [tuple(point) for point in self.points.tolist()]
+
+    @cached_property
+    def pairs(self) -> np.ndarray:
+        return np.random.default_rng(self.seed + 2).integers(0, self.count, size=(self.count, 2))
+
+    @cached_property
+    def pair_list(self) -> List[list]:
+        return self.pairs.tolist()
+
+
+def _stem(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _engine_case(engine: str, inputs: _ImageInputs) -> Case:
+    return Case(
+        "engine.{0}[{1}]".format(engine, _stem(inputs.path)), "px",
+        lambda: engines.detect_rects(inputs.gray, engine), lambda: inputs.pixels,
+    )
+
+
+def _image_cases(path: str) -> List[Case]:
+    stem = _stem(path)
+    inputs = _ImageInputs(path)
+
+    cases = [
+        Case(
+            "grayscale_blur[{0}]".format(stem), "px",
+            lambda: box.grayscale_blur(inputs.image), lambda: inputs.pixels,
+        ),
+        Case(
+            "canny_detection[{0}]".format(stem), "px",
+            lambda: box.canny_detection(inputs.gray), lambda: inputs.pixels,
+        ),
+        Case(
+            "group_rects[{0}]".format(stem), "rects",
+            lambda: box.group_rects(inputs.bound_rect), lambda: len(inputs.bound_rect),
+        ),
+    ]
+
+    return cases + [_engine_case(engine, inputs) for engine in engines.ENGINES]
+
+
+def _rect_cases(count: int, seed: int) -> List[Case]:
+    inputs = _RectInputs(count, seed)
+
+    def weighted_quick_union() -> None:
+        union_find = WeightedQuickUnionUF(count, inputs.rectangles)
+        for p, q in inputs.pair_list:
+            union_find.union(p, q)
+
+    def array_quick_union() -> None:
+        union_find = QuickUnionArrayUF(count)
+        union_find.union_many(inputs.pairs)
+        union_find.labels()
+
+    def candidate_index() -> None:
+        for point in inputs.point_list:
+            inputs.index.candidate_index(point)
+
+    cases = [
+        Case("group_rects[{0}]".format(count), "rects", lambda: box.group_rects(inputs.rect_list), lambda: count),
+        Case("WeightedQuickUnionUF[{0}]".format(count), "unions", weighted_quick_union, lambda: count),
+        Case("QuickUnionArrayUF[{0}]".format(count), "unions", array_quick_union, lambda: count),
+        Case(
+            "candidate_rectangle[{0}]".format(count), "queries",
+            lambda: box.candidate_rectangle(inputs.rectangles, inputs.point_list[0]), lambda: 1,
+        ),
+        Case(
+            "candidate_rectangles[{0}]".format(count), "queries",
+            lambda: box.candidate_rectangles(inputs.rect_array, inputs.points), lambda: _QUERY_POINTS,
+        ),
+        Case("RectIndex.candidate_index[{0}]".format(count), "queries", candidate_index, lambda: _QUERY_POINTS),
+    ]
+
+    return [case for case in cases if count <= _MAX_RECTS.get(case.name.split("[")[0], count)]
+
+
+def build_cases(images: str = DEFAULT_IMAGES, rect_counts=DEFAULT_RECT_COUNTS, seed: int = 0,
+                pattern: str = None) -> List[Case]:
+    """
+    List the benchmark cases: blur, Canny, grouping and every detection engine on every image in the images directory,
+    then grouping, union find and candidate queries on synthetic rect sets of each size in rect_counts. pattern keeps
+    only the cases whose name matches it, as an fnmatch pattern. Inputs are only built once a case using them runs.
+    """
+    cases = []
+    for path in _image_paths(images):
+        cases.extend(_image_cases(path))
+    for count in rect_counts:
+        cases.extend(_rect_cases(count, seed))
+
+    return [case for case in cases if pattern is None or fnmatch.fnmatch(case.name, pattern)]
+
+
+def _image_paths(images: str) -> List[str]:
+    if not os.path.isdir(images):
+        return []
+
+    return [
+        os.path.join(images, name) for name in sorted(os.listdir(images)) if name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def time_case(case: Case, repeat: int = 20, warmup: int = 1, max_seconds: float = 10) -> List[float]:
+    """
+    Time repeat runs of a case after warmup untimed ones (at least one, which builds the inputs), returning every
+    run's duration in seconds. Runs stop early once max_seconds have been spent, keeping at least three.
+    """
+    for _ in range(max(warmup, 1)):
+        case.run()
+
+    samples = []
+    start = time.perf_counter()
+    while len(samples) < repeat:
+        begin = time.perf_counter()
+        case.run()
+        samples.append(time.perf_counter() - begin)
+        if len(samples) >= 3 and time.perf_counter() - start > max_seconds:
+            break
+
+    return samples
+
+
+def summarize(samples: List[float], items: int) -> dict:
+    """
+    Return the percentiles of a case's durations in seconds, along with its throughput at the median in items per
+    second.
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    p50, p90, p99 = np.percentile(samples, (50, 90, 99))
+
+    return {
+        "runs": len(samples),
+        "min": float(samples.min()),
+        "mean": float(samples.mean()),
+        "p50": float(p50),
+        "p90": float(p90),
+        "p99": float(p99),
+        "throughput": items / p50 if p50 > 0 else float("inf"),
+    }
+
+
+def run_benchmarks(cases: List[Case], repeat: int = 20, warmup: int = 1, max_seconds: float = 10,
+                   report: Callable[[str], None] = None) -> dict:
+    """
+    Time every case, returning their summaries by name. report, when given, is called with a line per case.
+    """
+    results = {}
+    for case in cases:
+        results[case.name] = summarize(time_case(case, repeat, warmup, max_seconds), case.items())
+        results[case.name]["unit"] = case.unit
+        if report is not None:
+            report(format_result(case.name, results[case.name]))
+
+    return results
+
+
+def compare_engines(images: str = DEFAULT_IMAGES, names: List[str] = None, reference: str = "canny",
+                    min_iou: float = 0.5, repeat: int = 5, warmup: int = 1, max_seconds: float = 10,
+                    report: Callable[[str], None] = None) -> dict:
+    """
+    Time every named engine, all registered ones by default, on the images in the images directory, and measure how
+    many of the grouped rects of the reference engine its own grouped rects recall, see engines.recall. Returns for
+    every engine the sum of its median times over the images as p50, its throughput in pixels per second and its
+    mean recall. report, when given, is called with a line per engine.
+    """
+    inputs = [_ImageInputs(path) for path in _image_paths(images)]
+    if not inputs:
+        raise ValueError("no images found in {0}".format(images))
+
+    comparison = {}
+    for engine in (list(engines.ENGINES) if names is None else names):
+        engines.get_engine(engine)
+
+        seconds = 0.0
+        recalls = []
+        for image in inputs:
+            case = _engine_case(engine, image)
+            seconds += summarize(time_case(case, repeat, warmup, max_seconds), case.items())["p50"]
+            recalls.append(engines.recall(image.engine_groups(engine), image.engine_groups(reference), min_iou))
+
+        pixels = sum(image.pixels for image in inputs)
+        comparison[engine] = {
+            "p50": seconds,
+            "throughput": pixels / seconds if seconds > 0 else float("inf"),
+            "recall": float(np.mean(recalls)),
+        }
+        if report is not None:
+            report("{0:<40} p50 {1:>10.3f} ms  recall {2:>6.1%}  {3:>14,.0f} px/s".format(
+                engine, seconds * 1e3, comparison[engine]["recall"], comparison[engine]["throughput"]
+            ))
+
+    return comparison
+
+
+def fastest_engine(comparison: dict, min_recall: float) -> str:
+    """
+    Return the name of the fastest engine of a compare_engines result whose recall reaches min_recall, or None when
+    there is none.
+    """
+    eligible = [engine for engine, result in comparison.items() if result["recall"] >= min_recall]
+    if not eligible:
+        return None
+
+    return min(eligible, key=lambda engine: comparison[engine]["p50"])
+
+
+def format_result(name: str, result: dict) -> str:
+    return "{0:<40} p50 {1:>10.3f} ms  p90 {2:>10.3f} ms  p99 {3:>10.3f} ms  {4:>14,.0f} {5}/s".format(
+        name, result["p50"] * 1e3, result["p90"] * 1e3, result["p99"] * 1e3, result["throughput"], result["unit"]
+    )
+
+
+def save_baseline(results: dict, path: str) -> None:
+    """
+    Save benchmark results as a JSON baseline.
+    """
+    with open(path, "w") as baseline_file:
+        json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+
+def load_baseline(path: str) -> dict:
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def regressions(results: dict, baseline: dict, tolerance: float = 0.1) -> List[str]:
+    """
+    Compare results to a baseline, returning a description of every case whose median time grew by more than
+    tolerance, as a fraction of the baseline. Cases missing from either side are ignored.
+    """
+    found = []
+    for name in sorted(set(results) & set(baseline)):
+        before = baseline[name]["p50"]
+        after = results[name]["p50"]
+        if after > before * (1 + tolerance):
+            found.append("{0}: p50 {1:.3f} ms -> {2:.3f} ms ({3:+.0%})".format(
+                name, before * 1e3, after * 1e3, after / before - 1
+            ))
+
+    return found
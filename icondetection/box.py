@@ -1,10 +1,27 @@
-import heapq
-
 import cv2 as cv
-from typing import List
+import numpy as np
+from typing import List, Tuple
 
+from icondetection import instrumentation
+from icondetection.interval_tree import IntervalTree
+from icondetection.rect_array import RectArray
 from icondetection.rectangle import Rectangle
-from icondetection.weighted_quick_unionUF import WeightedQuickUnionUF as uf
+from icondetection.weighted_quick_unionUF import QuickUnionArrayUF as uf
+
+# upper bound on the number of point to rectangle distances held in memory by candidate_rectangles
+_CANDIDATE_CHUNK_ELEMENTS = 1 << 20
+
+# supported channel orders: number of channels and the conversion to gray (None when already gray)
+CHANNEL_ORDERS = {
+    "gray": (1, None),
+    "bgr": (3, cv.COLOR_BGR2GRAY),
+    "rgb": (3, cv.COLOR_RGB2GRAY),
+    "bgra": (4, cv.COLOR_BGRA2GRAY),
+    "rgba": (4, cv.COLOR_RGBA2GRAY),
+}
+
+# channel order assumed for each number of channels when none is given
+_DEFAULT_CHANNEL_ORDERS = {1: "gray", 3: "bgr", 4: "bgra"}
 
 
 def containing_rectangle(rects: List[Rectangle], query_point: tuple) -> Rectangle or None:
@@ -56,87 +73,238 @@ def candidate_rectangle(rects: List[Rectangle], query_point: tuple) -> Rectangle
     return potential_rect
 
 
-def grayscale_blur(image):
+def candidate_rectangles(rects, query_points) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Convert image to gray and blur it.
+    Vectorized candidate_rectangle for many query points at once. rects is a list of Rectangles or a RectArray,
+    query_points an (N, 2) array of (x, y) points. Returns the index of the candidate rectangle for every point, along
+    with its distance to the point (zero when the point is contained). Ties resolve to the first rectangle, exactly as
+    in candidate_rectangle.
     """
-    image_gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
-    image_gray = cv.blur(image_gray, (3, 3))
+
+    if not isinstance(rects, RectArray):
+        rects = RectArray.from_rectangles(rects)
+    if len(rects) == 0:
+        raise ValueError("cannot find a candidate rectangle among zero rectangles")
+
+    query_points = np.asarray(query_points, dtype=np.int64).reshape(-1, 2)
+    indices = np.empty(len(query_points), dtype=np.intp)
+    distances = np.empty(len(query_points), dtype=np.float64)
+
+    # a containing rectangle is at distance zero, so the first minimum is also the first containing rectangle.
+    # points are processed in chunks to bound the size of the distance matrix
+    chunk = max(1, _CANDIDATE_CHUNK_ELEMENTS // len(rects))
+    for start in range(0, len(query_points), chunk):
+        chunk_distances = rects.distance_to_points(query_points[start:start + chunk])
+        chunk_indices = np.argmin(chunk_distances, axis=1)
+        indices[start:start + chunk] = chunk_indices
+        distances[start:start + chunk] = chunk_distances[np.arange(len(chunk_indices)), chunk_indices]
+
+    return indices, distances
+
+
+def channel_order_of(image, channel_order: str = None) -> str:
+    """
+    Check that channel_order fits the shape of image, or infer it from the number of channels when None: gray for
+    two dimensional images, BGR for three channels and BGRA for four.
+    """
+    channels = image.shape[2] if image.ndim == 3 else 1
+    if channel_order is None:
+        if channels not in _DEFAULT_CHANNEL_ORDERS:
+            raise ValueError("cannot infer the channel order of an image with {0} channels".format(channels))
+        return _DEFAULT_CHANNEL_ORDERS[channels]
+
+    if channel_order not in CHANNEL_ORDERS:
+        raise ValueError("unknown channel order {0!r}".format(channel_order))
+    if CHANNEL_ORDERS[channel_order][0] != channels:
+        raise ValueError("{0} images have {1} channels, got {2}".format(
+            channel_order, CHANNEL_ORDERS[channel_order][0], channels
+        ))
+
+    return channel_order
+
+
+def grayscale_blur(image, channel_order: str = None):
+    """
+    Convert image to gray and blur it. channel_order is one of CHANNEL_ORDERS, inferred from the shape of image when
+    None; gray images are blurred without any conversion.
+    """
+    conversion = CHANNEL_ORDERS[channel_order_of(image, channel_order)][1]
+    with instrumentation.stage("grayscale_blur"):
+        if conversion is None:
+            return cv.blur(image, (3, 3))
+
+        # the converted image is fresh, so it is blurred in place rather than into yet another full frame
+        image_gray = cv.cvtColor(image, conversion)
+        cv.blur(image_gray, (3, 3), dst=image_gray)
 
     return image_gray
 
 
-def rect_list_to_dict(rects):
+def overlapping_pairs(rects: RectArray):
     """
-    Take a list of cv rects and returns their dictionary representation for simple filtering.
+    Find every pair of intersecting rectangles with an event based sweep over the left and right edges. Active
+    rectangles are kept in an interval tree on the y-axis, so the cost is O((n + k) log n) for n rectangles and k
+    intersecting pairs, independent of the width of the image.
+    Returns two lists, such that rects[first[i]] intersects rects[second[i]].
     """
-    # POTENTIALLY PROBLEMATIC: necessarily has to be a list of (index, rects)
-    rect_dict = {}
-    rect_list = [None] * len(rects)
 
-    for rect_index in range(len(rects)):
-        temp_rect = Rectangle.rect_cv_to_cartesian(rects[rect_index])
+    tops = rects.top.tolist()
+    lefts = rects.left.tolist()
+    bottoms = rects.bottom.tolist()
+    rights = rects.right.tolist()
 
-        # step to modify dictionary
-        if temp_rect.left in rect_dict:
-            tmp_list = rect_dict[temp_rect.left]
-            tmp_list.append((rect_index, temp_rect))
-            rect_dict[temp_rect.left] = tmp_list
-        else:
-            rect_dict[temp_rect.left] = [(rect_index, temp_rect)]
+    active = IntervalTree(tops, bottoms)
+    by_left = sorted(range(len(lefts)), key=lambda i: (lefts[i], i))
+    by_right = sorted(range(len(rights)), key=lambda i: (rights[i], i))
+    next_removal = 0
 
-        # step to modify list
-        rect_list[rect_index] = temp_rect
+    first = []
+    second = []
+    for rect_b in by_left:
+        x = lefts[rect_b]
 
-    return rect_dict, rect_list
+        # retire rects that end at or before this edge, they can no longer overlap anything
+        while next_removal < len(by_right) and rights[by_right[next_removal]] <= x:
+            active.remove(by_right[next_removal])
+            next_removal += 1
 
+        # every active rect starts at or before x and ends after it, so only the y-axis and degenerate widths remain
+        for rect_a in active.overlapping(tops[rect_b], bottoms[rect_b]):
+            if lefts[rect_a] < rights[rect_b]:
+                first.append(rect_a)
+                second.append(rect_b)
 
-def group_rects(cv_rects, min_x, max_x):
+        # zero width rects are never crossed by a later left edge, so they need not be tracked
+        if rights[rect_b] > x:
+            active.insert(rect_b)
+
+    return first, second
+
+
+def group_rects(cv_rects, min_x=None, max_x=None):
     """
     Accepts a list of rects in openCV format, and groups them according to their
-    overlapping locations.
+    overlapping locations. When a scanning range is given, only rects whose left edge lies within
+    [min_x, max_x) take part in the grouping; the others are returned on their own.
+    """
+
+    rects = RectArray.from_cv(cv_rects)
+    unified_rects = uf(len(rects))
+
+    scanned = np.arange(len(rects))
+    if min_x is not None:
+        scanned = scanned[rects.left[scanned] >= min_x]
+    if max_x is not None:
+        scanned = scanned[rects.left[scanned] < max_x]
+
+    with instrumentation.stage("group_rects"):
+        with instrumentation.stage("overlap_sweep"):
+            first, second = overlapping_pairs(rects[scanned])
+        with instrumentation.stage("union_find"):
+            unified_rects.union_many(np.stack((scanned[first], scanned[second]), axis=1))
+
+            # perform groupings
+            grouped_rects = unified_rects.component_bounds(rects).to_cv()
+
+    instrumentation.count("rects_grouped", len(rects))
+    instrumentation.count("groups", len(grouped_rects))
+
+    return [tuple(rect) for rect in grouped_rects.tolist()]
+
+
+def group_rect_array(rects: RectArray) -> Tuple[np.ndarray, RectArray]:
+    """
+    Group overlapping rectangles held in a RectArray. Returns the group label of every rectangle, and the merged
+    rectangle of every group in label order.
+    """
+
+    unified_rects = uf(len(rects))
+    with instrumentation.stage("group_rects"):
+        with instrumentation.stage("overlap_sweep"):
+            first, second = overlapping_pairs(rects)
+        with instrumentation.stage("union_find"):
+            unified_rects.union_many(np.stack((first, second), axis=1))
+            labels, groups = unified_rects.labels(), unified_rects.component_bounds(rects)
+
+    instrumentation.count("rects_grouped", len(rects))
+    instrumentation.count("groups", len(groups))
+
+    return labels, groups
+
+
+def find_contours(image, mode, method):
+    """
+    Call cv.findContours, which returns (image, contours, hierarchy) in OpenCV 3 but (contours, hierarchy) later on.
     """
+    with instrumentation.stage("find_contours"):
+        result = cv.findContours(image, mode, method)
 
-    rect_dict, rect_list = rect_list_to_dict(cv_rects)
-    rect_heap = []
-    unified_rects = uf(len(rect_list), rect_list)
+    instrumentation.count("contours", len(result[-2]))
+    return result[-2], result[-1]
 
-    for x in range(min_x, max_x):
 
-        # prune any outdated rects from the current_rects
-        while True:
-            if len(rect_heap) == 0:
-                break
-            if rect_heap[0][0] == x - 1:  # means we are at the edge
-                heapq.heappop(rect_heap)
-            else:
-                break
+def canny_edges(gray_scale_image, min_threshold: int = 100, multiplier: float = 2):
+    """
+    Run openCV Canny edge detection, with the upper hysteresis threshold set to min_threshold * multiplier.
+    """
+    with instrumentation.stage("canny"):
+        return cv.Canny(gray_scale_image, min_threshold, int(min_threshold * multiplier))
 
-        # get rectangles in this index
-        if x in rect_dict:
-            temp_rects = rect_dict[x]
-        else:
-            continue
 
-        # perform intersection
-        for rectA in rect_heap:
-            for rectB in temp_rects:
-                if Rectangle.intersect(rectA[1], rectB[1]):
-                    unified_rects.union(rectA[2], rectB[0])
+def approximate_bounding_rects(contours, contour_accuracy: int = 3):
+    """
+    Approximate every contour by a polygon and return the polygons along with their bounding rectangles.
+    """
 
-        # push new elements onto heap
-        for rectB in temp_rects:
-            heapq.heappush(rect_heap, (rectB[1].right, rectB[1], rectB[0]))
+    contours_poly = [None] * len(contours)
+    bound_rect = [None] * len(contours)
 
-    # perform groupings
-    grouped_rects = []
-    unions = unified_rects.get_unions()
-    for group in unions.values():
-        grouped_rects.append(
-            Rectangle.rect_cartesian_to_cv(Rectangle.merge_rects(group))
-        )
+    with instrumentation.stage("approx_poly"):
+        for index, contour in enumerate(contours):
+            contours_poly[index] = cv.approxPolyDP(contour, contour_accuracy, True)
+            bound_rect[index] = cv.boundingRect(contours_poly[index])
 
-    return grouped_rects
+    instrumentation.count("rects", len(bound_rect))
+    return contours_poly, bound_rect
+
+
+def contour_bounding_rects(contours) -> np.ndarray:
+    """
+    Return the bounding rectangle of every contour as an (N, 4) int32 array in CV representation, the same as calling
+    cv.boundingRect on each, but computed for all contours at once.
+    """
+    if len(contours) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+
+    lengths = np.fromiter((len(contour) for contour in contours), dtype=np.intp, count=len(contours))
+    starts = np.zeros(len(contours), dtype=np.intp)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    points = np.concatenate(contours).reshape(-1, 2)
+
+    lowest = np.minimum.reduceat(points, starts)
+    highest = np.maximum.reduceat(points, starts)
+
+    return np.hstack((lowest, highest - lowest + 1)).astype(np.int32)
+
+
+def canny_rects(gray_scale_image, min_threshold: int = 100, multiplier: float = 2, external: bool = False):
+    """
+    Rects only counterpart of canny_detection, for callers that have no use for the polygons: returns the bounding
+    rectangles of the Canny contours as an (N, 4) int32 array in CV representation.
+
+    Contours are retrieved without building their hierarchy and are not approximated by polygons, so each rectangle
+    bounds its raw contour and may be a few pixels larger than the matching one from canny_detection. With external,
+    only outermost contours are kept, leaving out every contour nested in another.
+    """
+
+    canny_output = canny_edges(gray_scale_image, min_threshold, multiplier)
+    contours, _ = find_contours(canny_output, cv.RETR_EXTERNAL if external else cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
+
+    with instrumentation.stage("bounding_rects"):
+        bound_rect = contour_bounding_rects(contours)
+
+    instrumentation.count("rects", len(bound_rect))
+    return bound_rect
 
 
 def canny_detection(gray_scale_image=None, **kwargs):
@@ -147,19 +315,38 @@ def canny_detection(gray_scale_image=None, **kwargs):
     """
 
     multiplier = kwargs['multiplier'] if 'multiplier' in kwargs else 2
-    contour_accuracy = kwargs['contour_accuracy'] if 'multiplier' in kwargs else 3
+    contour_accuracy = kwargs['contour_accuracy'] if 'contour_accuracy' in kwargs else 3
     min_threshold = kwargs['min_threshold'] if 'min_threshold' in kwargs else 100
-    max_threshold = int(min_threshold * multiplier)
 
-    canny_output = cv.Canny(gray_scale_image, min_threshold, max_threshold)
+    contours_poly, bound_rect, _ = canny_hierarchy(gray_scale_image, min_threshold, multiplier, contour_accuracy)
 
-    _, contours, _ = cv.findContours(canny_output, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+    return contours_poly, bound_rect
 
-    contours_poly = [None] * len(contours)
-    bound_rect = [None] * len(contours)
 
-    for index, contour in enumerate(contours):
-        contours_poly[index] = cv.approxPolyDP(contour, contour_accuracy, True)
-        bound_rect[index] = cv.boundingRect(contours_poly[index])
+def canny_hierarchy(gray_scale_image, min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3):
+    """
+    canny_detection keeping the contour hierarchy: returns the polygons, their bounding rectangles and an (N, 4)
+    int32 array holding the next, previous, first child and parent contour of every contour, -1 where there is none.
+    """
+    canny_output = canny_edges(gray_scale_image, min_threshold, multiplier)
+
+    contours, hierarchy = find_contours(canny_output, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+    hierarchy = np.empty((0, 4), dtype=np.int32) if hierarchy is None else hierarchy.reshape(-1, 4)
 
-    return contours_poly, bound_rect
+    contours_poly, bound_rect = approximate_bounding_rects(contours, contour_accuracy)
+    return contours_poly, bound_rect, hierarchy
+
+
+def detect_rects(image, min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3,
+                 channel_order: str = None) -> List[tuple]:
+    """
+    Run the whole pipeline over an image: grayscale_blur, canny_detection and group_rects. Returns the grouped rects
+    in CV representation. channel_order is passed on to grayscale_blur.
+    """
+
+    gray_scale_image = grayscale_blur(image, channel_order)
+    _, bound_rect = canny_detection(
+        gray_scale_image, min_threshold=min_threshold, multiplier=multiplier, contour_accuracy=contour_accuracy
+    )
+
+    return group_rects(bound_rect)
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from typing import List
+
+from icondetection.box import channel_order_of, detect_rects
+from icondetection.rect_format import load_rects, to_bytes
+
+
+def update_digest(digest, image) -> None:
+    """
+    Feed the pixels of image to a hashlib digest, in row major order. A strided view, such as a crop, is fed row by
+    row rather than copied whole, so the digest is the same as that of a contiguous copy.
+    """
+    image = np.asarray(image)
+    if image.ndim < 2 or image.flags.c_contiguous:
+        digest.update(memoryview(np.ascontiguousarray(image)).cast("B"))
+        return
+
+    for row in image:
+        # a row of a crop is contiguous, so only views strided within rows copy anything, and one row at a time
+        digest.update(memoryview(np.ascontiguousarray(row)).cast("B"))
+
+
+class DetectionCache:
+    """
+    Content addressed cache in front of the detection pipeline (canny_detection followed by group_rects).
+
+    Results are keyed by a hash of the pixel buffer together with the detection parameters, so byte identical
+    screenshots are only ever processed once. The most recently used results are held in memory up to max_entries;
+    when a directory is given every result is also written there as a rect file (see rect_format), which lets the
+    cache survive restarts. Counters for hits, misses and evictions are kept on the instance.
+    """
+
+    def __init__(self, max_entries: int = 256, directory: str = None, hash_name: str = "sha1"):
+        """
+        Create a cache holding up to max_entries results in memory, optionally backed by files in directory.
+        hash_name is any algorithm known to hashlib.
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1, got {0}".format(max_entries))
+
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hash_name = hash_name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, image, min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3,
+            channel_order: str = None) -> str:
+        """
+        Return the cache key of an image and a set of detection parameters.
+        """
+        image = np.asarray(image)
+        digest = hashlib.new(self.hash_name)
+        digest.update("{0}|{1}|{2}|{3}|{4}|".format(
+            image.shape, image.dtype.str, min_threshold, multiplier, contour_accuracy
+        ).encode())
+        channel_order = channel_order_of(image, channel_order)
+        if channel_order != channel_order_of(image):
+            # only added when not the default, so keys of images in the default order stay the same
+            digest.update("{0}|".format(channel_order).encode())
+        update_digest(digest, image)
+
+        return digest.hexdigest()
+
+    def detect(self, image, min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3,
+               channel_order: str = None) -> List[tuple]:
+        """
+        Return the grouped rects of an image, as box.detect_rects would, running detection only on a cache miss.
+        """
+        key = self.key(image, min_threshold, multiplier, contour_accuracy, channel_order)
+        grouped_rects = self.get(key)
+        if grouped_rects is None:
+            grouped_rects = detect_rects(
+                image,
+                min_threshold=min_threshold,
+                multiplier=multiplier,
+                contour_accuracy=contour_accuracy,
+                channel_order=channel_order,
+            )
+            self.put(key, grouped_rects)
+
+        return grouped_rects
+
+    def get(self, key: str) -> List[tuple] or None:
+        """
+        Return the cached grouped rects for key, or None if they are not cached.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(self._entries[key])
+
+        grouped_rects = self._read(key)
+        with self._lock:
+            if grouped_rects is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, grouped_rects)
+
+        return list(grouped_rects)
+
+    def put(self, key: str, grouped_rects: List[tuple]) -> None:
+        """
+        Store the grouped rects for key, in memory and on disk when a directory is configured.
+        """
+        grouped_rects = [tuple(rect) for rect in grouped_rects]
+        with self._lock:
+            self._remember(key, grouped_rects)
+        self._write(key, grouped_rects)
+
+    def _remember(self, key: str, grouped_rects: List[tuple]) -> None:
+        self._entries[key] = grouped_rects
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".rects")
+
+    def _read(self, key: str) -> List[tuple] or None:
+        if self.directory is None or not os.path.exists(self._path(key)):
+            return None
+
+        return load_rects(self._path(key), mmap=False).to_list()
+
+    def _write(self, key: str, grouped_rects: List[tuple]) -> None:
+        if self.directory is None:
+            return
+
+        # write next to the final file and rename, so readers never see a partial result; every write gets a file of
+        # its own, as threads of one process may write the same key at once
+        with tempfile.NamedTemporaryFile(
+                dir=self.directory, prefix=key + ".", suffix=".tmp", delete=False
+        ) as temporary:
+            temporary.write(to_bytes(grouped_rects))
+        os.replace(temporary.name, self._path(key))
+
+    def clear(self) -> None:
+        """
+        Drop every in memory entry. Files on disk are left in place.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Return the counters and current size of the cache.
+        """
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_hits": self.disk_hits,
+        }
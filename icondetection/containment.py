@@ -0,0 +1,187 @@
+import numpy as np
+
+from typing import List
+
+from icondetection.box import canny_hierarchy, grayscale_blur
+from icondetection.rect_array import RectArray
+from icondetection.rect_index import RectIndex
+from icondetection.rectangle import Rectangle
+
+# sibling sets larger than this are searched through a RectIndex rather than scanned
+_INDEXED_SIBLINGS = 32
+
+
+def contour_depths(parents) -> np.ndarray:
+    """
+    Return the number of ancestors of every contour, given the parent of every contour (-1 for a root). All depths
+    are found together by pointer jumping, in O(log depth) vectorized rounds.
+    """
+    parents = np.asarray(parents, dtype=np.int64).reshape(-1)
+    jump = parents.copy()
+    depths = (jump >= 0).astype(np.int64)
+
+    while True:
+        linked = np.flatnonzero(jump >= 0)
+        if len(linked) == 0:
+            return depths
+
+        # both updates read the values of the previous round, so every step doubles the distance jumped
+        targets = jump[linked]
+        depths[linked] += depths[targets]
+        jump[linked] = jump[targets]
+
+
+class ContainmentTree:
+    """
+    The rects of a Canny detection arranged by containment, as found by the RETR_TREE contour hierarchy.
+
+    Canny edges are lines, so every closed edge yields an outer contour and a hole contour inside it. Only the outer
+    contours, which lie at even depths of the hierarchy, become nodes; the parent of a node is the outer contour
+    owning the hole it lies in. The children of every node are stored together, so a point query walks down from the
+    roots and only ever looks at the children of the node it is in. The roots, and any node with many children, get
+    a RectIndex over those, so every step costs O(log siblings) and a query O(depth log n) rather than a scan over
+    every rect.
+    """
+
+    def __init__(self, rects: RectArray, parents):
+        """
+        Create a tree from the rects of its nodes and the parent node of every rect, -1 for a root.
+        """
+        parents = np.asarray(parents, dtype=np.int64).reshape(-1)
+        if len(parents) != len(rects):
+            raise ValueError("got {0} parents for {1} rects".format(len(parents), len(rects)))
+        if len(parents) > 0 and (parents.min() < -1 or parents.max() >= len(parents)):
+            raise ValueError("parents must be -1 or the index of a rect")
+
+        self.rects = rects
+        self.parents = parents
+        self.depths = contour_depths(parents)
+        self.areas = rects.get_area()
+
+        # children of node k are order[offsets[k + 1]:offsets[k + 2]], and the roots order[offsets[0]:offsets[1]]
+        self._order = np.argsort(parents, kind="stable")
+        self._offsets = np.zeros(len(parents) + 2, dtype=np.int64)
+        np.cumsum(np.bincount(parents + 1, minlength=len(parents) + 1), out=self._offsets[1:])
+
+        # parent node, -1 for the roots -> RectIndex over its children, in the order of _siblings
+        self._indices = {}
+        for parent in (np.flatnonzero(np.diff(self._offsets) > _INDEXED_SIBLINGS) - 1).tolist():
+            self._indices[parent] = RectIndex(rects[self._siblings(parent)].to_rectangles())
+
+    @classmethod
+    def from_hierarchy(cls, bound_rect, hierarchy) -> 'ContainmentTree':
+        """
+        Create a tree from the bounding rects of a contour tree in CV representation and its hierarchy, as returned by
+        canny_hierarchy.
+        """
+        hierarchy = np.asarray(hierarchy, dtype=np.int64).reshape(-1, 4)
+        rects = RectArray.from_cv(bound_rect)
+        if len(hierarchy) != len(rects):
+            raise ValueError("got a hierarchy of {0} contours for {1} rects".format(len(hierarchy), len(rects)))
+
+        contour_parents = hierarchy[:, 3]
+        outer = contour_depths(contour_parents) % 2 == 0
+
+        # the parent of an outer contour is a hole, whose own parent is the outer contour the node belongs to
+        holes = contour_parents[outer]
+        owners = np.where(holes >= 0, contour_parents[np.maximum(holes, 0)], -1)
+        nodes = np.cumsum(outer) - 1
+        parents = np.where(owners >= 0, nodes[np.maximum(owners, 0)], -1)
+
+        return cls(rects[outer], parents)
+
+    @classmethod
+    def from_image(cls, image, min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3,
+                   channel_order: str = None) -> 'ContainmentTree':
+        """
+        Detect the rects of an image, as grayscale_blur followed by canny_detection would, and arrange them.
+        """
+        _, bound_rect, hierarchy = canny_hierarchy(
+            grayscale_blur(image, channel_order), min_threshold, multiplier, contour_accuracy
+        )
+
+        return cls.from_hierarchy(bound_rect, hierarchy)
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def roots(self) -> np.ndarray:
+        """
+        The nodes contained in no other node.
+        """
+        return self._siblings(-1)
+
+    def children(self, node: int) -> np.ndarray:
+        """
+        The nodes directly contained in node.
+        """
+        return self._siblings(node)
+
+    def _siblings(self, parent: int) -> np.ndarray:
+        return self._order[self._offsets[parent + 1]:self._offsets[parent + 2]]
+
+    def _containing(self, parent: int, point: tuple) -> np.ndarray:
+        """
+        The children of parent, or the roots for -1, containing an (x, y) point, in node order.
+        """
+        siblings = self._siblings(parent)
+        index = self._indices.get(parent)
+        if index is not None:
+            return siblings[np.asarray(index.within_distance_indices(point, 0), dtype=np.int64)]
+
+        x, y = point
+        return siblings[
+            (self.rects.left[siblings] <= x)
+            & (x <= self.rects.right[siblings])
+            & (self.rects.top[siblings] <= y)
+            & (y <= self.rects.bottom[siblings])
+        ]
+
+    def rect(self, node: int) -> Rectangle:
+        return self.rects[int(node)]
+
+    def path(self, point: tuple) -> List[int]:
+        """
+        Return a chain of nested nodes containing an (x, y) point, from a root down. Where several siblings contain the
+        point, which happens as bounding rects overlap while their contours do not, the smallest one is followed, the
+        lowest node among equal areas, so the chain leads to the most specific rect; its first node is then not
+        necessarily the largest rect containing the point, see outermost.
+        """
+        path = []
+        parent = -1
+        while True:
+            inside = self._containing(parent, point)
+            if len(inside) == 0:
+                return path
+
+            parent = int(inside[np.argmin(self.areas[inside])])
+            path.append(parent)
+
+    def outermost(self, point: tuple) -> Rectangle or None:
+        """
+        Return the largest rect containing an (x, y) point, the lowest node among equal areas, or None when no rect
+        contains it. Nodes lie within their parents, so it is always a root.
+        """
+        roots = self._containing(-1, point)
+        if len(roots) == 0:
+            return None
+
+        return self.rect(roots[np.argmax(self.areas[roots])])
+
+    def innermost(self, point: tuple) -> Rectangle or None:
+        """
+        Return the most deeply nested rect containing an (x, y) point, or None when no rect contains it.
+        """
+        return self.at_level(point, -1)
+
+    def at_level(self, point: tuple, level: int) -> Rectangle or None:
+        """
+        Return the rect at the given nesting level of the path of an (x, y) point, 0 being its root and negative levels
+        counting up from the innermost, or None when the point is not nested that deep. Siblings are chosen as in
+        path, smallest first.
+        """
+        path = self.path(point)
+        if not -len(path) <= level < len(path):
+            return None
+
+        return self.rect(path[level])
@@ -2,32 +2,30 @@ import argparse
 import random as rng
 import cv2 as cv
 
-from icondetection.box import grayscale_blur, canny_detection, group_rects, candidate_rectangle
-from icondetection.rectangle import Rectangle
+from icondetection.pipeline import DetectionPipeline
 
 
 def closest_rectangle_handler(event: int, x: int, y: int, flags, params) -> None:
     """
     Determine the closest rectangle to mouse click.
     https://divyanshushekhar.com/mouse-events-opencv/
-    TODO: The ordering of x and y appears to be inconsistent. Check highlighted line
     """
 
     # globals necessary for access in callback function
-    global src, src2, candidate_rect, grouped_rects, excluded_rects
+    global src, src2, candidate_rect, grouped_rects, rect_index, excluded_rects
 
     if event == cv.EVENT_LBUTTONDOWN:
         print("x coordinate:{}, y coordinate: {}".format(x, y))
         color = (rng.randint(0, 256), rng.randint(0, 256), rng.randint(0, 256))
 
         src2 = src.copy()
-        candidate_rect = candidate_rectangle([Rectangle.rect_cv_to_cartesian(t) for t in grouped_rects], (y, x))  # TODO
+        candidate_rect = rect_index.candidate_rectangle((x, y))
         excluded_rects = filter(lambda rect: rect is not candidate_rect, grouped_rects)
 
         cv.rectangle(
             src2,
-            (candidate_rect.bottom, candidate_rect.left),
-            (candidate_rect.top, candidate_rect.right),
+            (candidate_rect.left, candidate_rect.top),
+            (candidate_rect.right, candidate_rect.bottom),
             color,
             2,
         )
@@ -80,15 +78,16 @@ def threshold_callback(val: int) -> None:
     within an image.
     """
 
-    # accept an input image and convert it to grayscale, and blur it
-    gray_scale_image = grayscale_blur(src)
+    # only the stages after the blur rerun when the threshold moves
+    pipeline.min_threshold = val
 
     # determine the bounding rectangles from canny detection
-    _, bound_rect = canny_detection(gray_scale_image, min_threshold=val)
+    bound_rect = pipeline.rects()
 
     # group the rectangles from this step
-    global grouped_rects
-    grouped_rects = group_rects(bound_rect, 0, src.shape[1])
+    global grouped_rects, rect_index
+    grouped_rects = pipeline.grouped()
+    rect_index = pipeline.index()
 
     # (for display purposes) use the provided rectangles to display in your program
     render_rectangles(grouped_rects, src.copy(), "Grouped Rectangles", desired_color=(36, 9, 14))
@@ -112,7 +111,7 @@ if __name__ == "__main__":
         print("Could not open or find the image:", args.input)
         exit(0)
 
-    src_gray = grayscale_blur(src)
+    pipeline = DetectionPipeline(src)
 
     source_window = "Source"
     cv.namedWindow(source_window)
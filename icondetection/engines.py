@@ -0,0 +1,153 @@
+import cv2 as cv
+import numpy as np
+
+from typing import Callable, NamedTuple
+
+from icondetection import box, instrumentation
+from icondetection.pyramid import pyramid_canny_detection
+from icondetection.rect_array import RectArray
+
+
+class Engine(NamedTuple):
+    """
+    A way of turning a blurred gray scale image into rects. detect takes the image, min_threshold, multiplier and any
+    engine specific keyword parameters, and returns the rects in CV representation as an (N, 4) int32 array.
+    """
+
+    name: str
+    detect: Callable[..., np.ndarray]
+    description: str
+
+
+# engine name -> Engine, in registration order
+ENGINES = {}
+
+
+def register_engine(name: str, detect: Callable[..., np.ndarray], description: str = "") -> Engine:
+    """
+    Register a detection engine under name, replacing any engine already registered under it.
+    """
+    engine = ENGINES[name] = Engine(name, detect, description)
+    return engine
+
+
+def get_engine(name: str) -> Engine:
+    if name not in ENGINES:
+        raise ValueError("unknown engine {0!r}, expected one of {1}".format(name, ", ".join(ENGINES)))
+
+    return ENGINES[name]
+
+
+def detect_rects(gray_scale_image, engine: str = "canny", min_threshold: int = 100, multiplier: float = 2,
+                 **params) -> np.ndarray:
+    """
+    Run the named engine on a blurred gray scale image, returning its rects as an (N, 4) int32 array in CV
+    representation. Its cost is reported to instrumentation as the stage "engine.<name>".
+    """
+    detect = get_engine(engine).detect
+
+    with instrumentation.stage("engine.{0}".format(engine)):
+        rects = detect(gray_scale_image, min_threshold, multiplier, **params)
+
+    instrumentation.count("rects", len(rects))
+    return rects
+
+
+def _components(binary_image) -> np.ndarray:
+    # label 0 is the background
+    _, _, stats, _ = cv.connectedComponentsWithStats(binary_image, connectivity=8)
+    return np.ascontiguousarray(stats[1:, :4], dtype=np.int32)
+
+
+def canny_engine(gray_scale_image, min_threshold: int = 100, multiplier: float = 2,
+                 contour_accuracy: int = 3) -> np.ndarray:
+    """
+    The bounding rectangles of canny_detection.
+    """
+    _, bound_rect = box.canny_detection(
+        gray_scale_image, min_threshold=min_threshold, multiplier=multiplier, contour_accuracy=contour_accuracy
+    )
+    return np.asarray(bound_rect, dtype=np.int32).reshape(-1, 4)
+
+
+def canny_rects_engine(gray_scale_image, min_threshold: int = 100, multiplier: float = 2,
+                       external: bool = False) -> np.ndarray:
+    """
+    The bounding rectangles of the raw Canny contours, see canny_rects.
+    """
+    return box.canny_rects(gray_scale_image, min_threshold, multiplier, external)
+
+
+def pyramid_engine(gray_scale_image, min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3,
+                   scale: float = 0.5, margin: int = 8, full_frame_ratio: float = 0.5) -> np.ndarray:
+    """
+    The bounding rectangles of pyramid_canny_detection, which only runs full resolution Canny where a downscaled
+    copy of the image has edges.
+    """
+    _, bound_rect = pyramid_canny_detection(
+        gray_scale_image, scale, margin, full_frame_ratio,
+        min_threshold=min_threshold, multiplier=multiplier, contour_accuracy=contour_accuracy,
+    )
+    return np.asarray(bound_rect, dtype=np.int32).reshape(-1, 4)
+
+
+def components_engine(gray_scale_image, min_threshold: int = 100, multiplier: float = 2) -> np.ndarray:
+    """
+    The bounding rectangles of the 8-connected components of the Canny edge map, computed by OpenCV along with the
+    labels, so no contour is ever traced.
+    """
+    return _components(box.canny_edges(gray_scale_image, min_threshold, multiplier))
+
+
+def gradient_engine(gray_scale_image, min_threshold: int = 100, multiplier: float = 2,
+                    kernel_size: int = 3) -> np.ndarray:
+    """
+    The bounding rectangles of the 8-connected components of the morphological gradient, thresholded at half
+    min_threshold. Cheaper than Canny but blind to faint edges; multiplier is unused.
+    """
+    kernel = cv.getStructuringElement(cv.MORPH_RECT, (kernel_size, kernel_size))
+    gradient = cv.morphologyEx(gray_scale_image, cv.MORPH_GRADIENT, kernel)
+    _, binary_image = cv.threshold(gradient, min_threshold / 2, 255, cv.THRESH_BINARY)
+
+    return _components(binary_image)
+
+
+def mser_engine(gray_scale_image, min_threshold: int = 100, multiplier: float = 2, delta: int = 5,
+                min_area: int = 60, max_area: int = 14400) -> np.ndarray:
+    """
+    The bounding rectangles of the maximally stable extremal regions, which find blobs of uniform intensity rather
+    than edges; min_threshold and multiplier are unused.
+    """
+    mser = cv.MSER_create(delta, min_area, max_area)
+    _, bound_rect = mser.detectRegions(gray_scale_image)
+
+    return np.asarray(bound_rect, dtype=np.int32).reshape(-1, 4)
+
+
+register_engine("canny", canny_engine, "Canny, contour tree and polygon approximation")
+register_engine("canny_rects", canny_rects_engine, "Canny and raw contour bounding boxes")
+register_engine("pyramid", pyramid_engine, "Canny at full resolution where a half resolution copy has edges")
+register_engine("components", components_engine, "connected components of the Canny edge map")
+register_engine("gradient", gradient_engine, "connected components of the thresholded morphological gradient")
+register_engine("mser", mser_engine, "maximally stable extremal regions")
+
+
+def recall(found, reference, min_iou: float = 0.5, chunk_size: int = 1024) -> float:
+    """
+    Return the share of reference rects matched by some found rect with an intersection over union of at least
+    min_iou. Both are in CV representation; the IoU matrix is built chunk_size reference rects at a time.
+    """
+    reference = RectArray.from_cv(reference)
+    found = RectArray.from_cv(found)
+    if len(reference) == 0:
+        return 1.0
+    if len(found) == 0:
+        return 0.0
+
+    matched = 0
+    for start in range(0, len(reference), chunk_size):
+        chunk = reference[start:start + chunk_size]
+        matched += int(np.count_nonzero(chunk.iou_matrix(found).max(axis=1) >= min_iou))
+
+    return matched / len(reference)
+
@@ -0,0 +1,200 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2 as cv
+import numpy as np
+
+from typing import List, NamedTuple
+
+from icondetection.box import CHANNEL_ORDERS, channel_order_of
+
+# method -> name of the factory of its OpenCV detector and extractor
+FEATURE_METHODS = {"sift": "SIFT_create", "orb": "ORB_create", "akaze": "AKAZE_create"}
+
+# method -> width of the band along the image border its detector finds no keypoints in: SIFT's image border, ORB's
+# edge threshold and, measured, the reach of AKAZE's descriptor patch
+DETECTOR_BORDERS = {"sift": 5, "orb": 31, "akaze": 32}
+
+
+def create_detector(method: str):
+    """
+    Create the OpenCV detector of a feature method. SIFT lives in the contrib module xfeatures2d before OpenCV 4.4,
+    and AKAZE moved there in OpenCV 5, so both places are looked in.
+    """
+    if method not in FEATURE_METHODS:
+        raise ValueError("unknown feature method {0!r}, expected one of {1}".format(method, ", ".join(FEATURE_METHODS)))
+
+    for module in (cv, getattr(cv, "xfeatures2d", None)):
+        factory = getattr(module, FEATURE_METHODS[method], None)
+        if factory is not None:
+            return factory()
+
+    raise ValueError("this OpenCV build has no {0} detector".format(method))
+
+
+class FeatureSet(NamedTuple):
+    """
+    Keypoints and descriptors found in an image. keypoints is an (N, 4) float32 array of the x, y, size and angle of
+    every keypoint in image coordinates, descriptors an (N, D) array, float32 for SIFT and uint8 for the binary
+    descriptors of ORB and AKAZE, and rect_indices the index of the rect every keypoint was found in.
+    """
+
+    keypoints: np.ndarray
+    descriptors: np.ndarray
+    rect_indices: np.ndarray
+
+    def to_cv_keypoints(self) -> List[cv.KeyPoint]:
+        """
+        The keypoints as OpenCV KeyPoint objects, as taken by cv.drawKeypoints. Only their position, size and angle
+        are kept; FeatureExtractor.detect returns the keypoints of OpenCV in full.
+        """
+        return [cv.KeyPoint(x, y, size, angle) for x, y, size, angle in self.keypoints.tolist()]
+
+
+class _Features(NamedTuple):
+    keypoints: np.ndarray
+    descriptors: np.ndarray
+
+
+class FeatureExtractor:
+    """
+    Extracts SIFT, ORB or AKAZE features, only inside the given rects when there are any.
+
+    One detector is created per extractor and reused across calls. Features of a rect are cached under a hash of its
+    gray pixels, so an icon that did not change since an earlier call, wherever it moved to, is never described
+    again; the most recently used max_entries crops are kept. Crops are widened by margin pixels of context, by
+    default the border the detector skips keypoints in (see DETECTOR_BORDERS), and only the keypoints lying inside
+    the rect are kept. Crops too small to hold a keypoint once that border is left out, which ORB and AKAZE fail on,
+    are skipped, as are empty rects.
+    """
+
+    def __init__(self, method: str = "sift", max_entries: int = 1024, margin: int = None, hash_name: str = "sha1"):
+        if max_entries < 0:
+            raise ValueError("max_entries must not be negative, got {0}".format(max_entries))
+
+        self.method = method
+        self.max_entries = max_entries
+        self._detector = create_detector(method)
+        self.margin = DETECTOR_BORDERS[method] if margin is None else margin
+        self._min_size = 2 * DETECTOR_BORDERS[method] + 1
+        self.hash_name = hash_name
+        # OpenCV detectors are not safe to call from several threads at once
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _describe(self, gray_crop) -> _Features:
+        with self._lock:
+            keypoints, descriptors = self._detector.detectAndCompute(gray_crop, None)
+
+        points = np.array([(*keypoint.pt, keypoint.size, keypoint.angle) for keypoint in keypoints], dtype=np.float32)
+        if descriptors is None:
+            descriptors = np.empty((0, self._detector.descriptorSize()), dtype=self._descriptor_dtype())
+
+        return _Features(points.reshape(-1, 4), descriptors)
+
+    def _descriptor_dtype(self):
+        return np.float32 if self._detector.descriptorType() == cv.CV_32F else np.uint8
+
+    def _key(self, gray_crop) -> str:
+        gray_crop = np.ascontiguousarray(gray_crop)
+        digest = hashlib.new(self.hash_name)
+        digest.update("{0}|{1}|".format(self.method, gray_crop.shape).encode())
+        digest.update(memoryview(gray_crop).cast("B"))
+
+        return digest.hexdigest()
+
+    def _cached(self, gray_crop) -> _Features:
+        if self.max_entries == 0:
+            self.misses += 1
+            return self._describe(gray_crop)
+
+        key = self._key(gray_crop)
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return features
+
+        features = self._describe(gray_crop)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = features
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return features
+
+    @staticmethod
+    def gray(image, channel_order: str = None):
+        """
+        Convert image to gray, without a copy when it already is.
+        """
+        conversion = CHANNEL_ORDERS[channel_order_of(image, channel_order)][1]
+        return image if conversion is None else cv.cvtColor(image, conversion)
+
+    def detect(self, image, channel_order: str = None) -> List[cv.KeyPoint]:
+        """
+        Return the keypoints of the whole image as OpenCV KeyPoint objects, with every field the detector fills in,
+        without computing descriptors or going through the cache.
+        """
+        gray = self.gray(image, channel_order)
+        with self._lock:
+            return list(self._detector.detect(gray, None))
+
+    def extract(self, image, rects=None, channel_order: str = None) -> FeatureSet:
+        """
+        Return the features of image, inside every rect in CV representation when rects are given, or of the whole
+        image otherwise.
+        """
+        gray = self.gray(image, channel_order)
+        height, width = gray.shape[:2]
+        if rects is None:
+            rects = [(0, 0, width, height)]
+
+        keypoints, descriptors, rect_indices = [], [], []
+        for index, (x, y, rect_width, rect_height) in enumerate(np.asarray(rects).reshape(-1, 4).tolist()):
+            if rect_width <= 0 or rect_height <= 0:
+                continue
+
+            top, left = max(y - self.margin, 0), max(x - self.margin, 0)
+            bottom = min(y + rect_height + self.margin, height)
+            right = min(x + rect_width + self.margin, width)
+            if bottom - top < self._min_size or right - left < self._min_size:
+                continue
+
+            features = self._cached(gray[top:bottom, left:right])
+            points = features.keypoints + np.array([left, top, 0, 0], dtype=np.float32)
+            inside = (
+                    (points[:, 0] >= x) & (points[:, 0] < x + rect_width)
+                    & (points[:, 1] >= y) & (points[:, 1] < y + rect_height)
+            )
+            keypoints.append(points[inside])
+            descriptors.append(features.descriptors[inside])
+            rect_indices.append(np.full(int(inside.sum()), index, dtype=np.int64))
+
+        if len(keypoints) == 0:
+            return FeatureSet(
+                np.empty((0, 4), dtype=np.float32),
+                np.empty((0, self._detector.descriptorSize()), dtype=self._descriptor_dtype()),
+                np.empty(0, dtype=np.int64),
+            )
+
+        return FeatureSet(np.concatenate(keypoints), np.concatenate(descriptors), np.concatenate(rect_indices))
+
+    def clear(self) -> None:
+        """
+        Drop every cached crop.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Return the cache counters and size.
+        """
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
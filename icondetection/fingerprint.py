@@ -0,0 +1,266 @@
+import functools
+import itertools
+import math
+
+import cv2 as cv
+import numpy as np
+
+from typing import List, Tuple
+
+from icondetection.box import CHANNEL_ORDERS, channel_order_of
+
+HASH_METHODS = ("dhash", "phash")
+
+# number of set bits of every byte value, for Hamming distances without relying on np.bitwise_count
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+# furthest a single 64 bit part is searched from a query, as the probes grow as 64 choose max_distance
+_MAX_WHOLE_DISTANCE = 2
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """
+    The orthonormal DCT-II matrix, so that D @ X @ D.T is the two dimensional DCT of a size by size block X.
+    """
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+
+    return matrix
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def pack_bits(bits: np.ndarray) -> np.ndarray:
+    """
+    Pack an (N, 64) boolean array into N unsigned 64 bit hashes, first bit most significant.
+    """
+    return np.packbits(np.asarray(bits, dtype=bool).reshape(-1, 64), axis=1).view(">u8").reshape(-1).astype(np.uint64)
+
+
+def hamming_distances(hashes, query: int) -> np.ndarray:
+    """
+    Return the number of bits every hash differs from query in.
+    """
+    difference = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64).reshape(-1), np.uint64(query))
+    return _POPCOUNT[difference.view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.int64)
+
+
+def _resized_crops(image, rects, size: Tuple[int, int], channel_order: str = None) -> np.ndarray:
+    """
+    Cut every rect, in CV representation, out of image, convert it to gray and shrink it to size (width, height).
+    Returns an (N, height, width) float32 array.
+    """
+    conversion = CHANNEL_ORDERS[channel_order_of(image, channel_order)][1]
+    gray = image if conversion is None else cv.cvtColor(image, conversion)
+
+    rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+    crops = np.empty((len(rects), size[1], size[0]), dtype=np.float32)
+    for crop, (x, y, width, height) in zip(crops, rects.tolist()):
+        if width <= 0 or height <= 0:
+            raise ValueError("cannot fingerprint the empty rect {0}".format((x, y, width, height)))
+        crop[:] = cv.resize(gray[y:y + height, x:x + width], size, interpolation=cv.INTER_AREA)
+
+    return crops
+
+
+def dhash(image, rects, channel_order: str = None) -> np.ndarray:
+    """
+    Return the difference hash of every rect of image: the crop is shrunk to 9 by 8 gray pixels, and every bit tells
+    whether a pixel is brighter than its left neighbour.
+    """
+    crops = _resized_crops(image, rects, (9, 8), channel_order)
+    return pack_bits(crops[:, :, 1:] > crops[:, :, :-1])
+
+
+def phash(image, rects, channel_order: str = None) -> np.ndarray:
+    """
+    Return the perceptual hash of every rect of image: the crop is shrunk to 32 by 32 gray pixels, and every bit
+    tells whether one of the 8 by 8 lowest frequencies of its DCT lies above their median, the constant term left out.
+    The DCTs of all crops are computed together, as two batched matrix products.
+    """
+    crops = _resized_crops(image, rects, (32, 32), channel_order).astype(np.float64)
+    low = (_DCT_32[:8] @ crops @ _DCT_32[:8].T).reshape(-1, 64)
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+
+    return pack_bits(low > median)
+
+
+def fingerprint_rects(image, rects, method: str = "dhash", channel_order: str = None) -> np.ndarray:
+    """
+    Return the hash of every rect of image, in CV representation such as the output of box.group_rects, as an array
+    of unsigned 64 bit integers. method is one of HASH_METHODS.
+    """
+    if method not in HASH_METHODS:
+        raise ValueError("unknown hash method {0!r}, expected one of {1}".format(method, ", ".join(HASH_METHODS)))
+
+    return (dhash if method == "dhash" else phash)(image, rects, channel_order)
+
+
+@functools.lru_cache(maxsize=None)
+def _flip_masks(bits: int, radius: int) -> np.ndarray:
+    """
+    Every mask of at most radius set bits among the lowest bits, which a part is flipped by to stay that close.
+    """
+    masks = [0]
+    for flipped in range(1, radius + 1):
+        for positions in itertools.combinations(range(bits), flipped):
+            masks.append(sum(1 << position for position in positions))
+
+    return np.asarray(masks, dtype=np.uint64)
+
+
+class FingerprintIndex:
+    """
+    A library of labelled 64 bit hashes, searched by Hamming distance with multi-index hashing.
+
+    Every hash is cut into parts of 64 / parts bits, and each part is kept sorted. Two hashes at most max_distance
+    apart must agree within max_distance // parts bits on at least one part, so a query only looks up the values
+    that close to each of its parts, and checks the full distance of the few hashes found that way, rather than of
+    the whole library. When that would take more lookups than the library holds hashes, as for a wide max_distance
+    over few parts, the whole library is scanned instead. Hashes are computed with method, one of HASH_METHODS, and
+    the library can be saved to and loaded from an npz file.
+    """
+
+    def __init__(self, hashes=(), labels=(), method: str = "dhash", parts: int = 4):
+        if method not in HASH_METHODS:
+            raise ValueError("unknown hash method {0!r}, expected one of {1}".format(method, ", ".join(HASH_METHODS)))
+        if parts not in (1, 2, 4, 8):
+            raise ValueError("parts must be 1, 2, 4 or 8, got {0}".format(parts))
+
+        self.method = method
+        self.parts = parts
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.labels = np.empty(0, dtype=str)
+        self.add(hashes, labels)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def fingerprint(self, image, rects, channel_order: str = None) -> np.ndarray:
+        """
+        Hash every rect of image with the method of the library, see fingerprint_rects.
+        """
+        return fingerprint_rects(image, rects, self.method, channel_order)
+
+    def add_rects(self, image, rects, labels, channel_order: str = None) -> None:
+        """
+        Add the icons at rects of image to the library, one label each.
+        """
+        self.add(self.fingerprint(image, rects, channel_order), labels)
+
+    def _split(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Return the (N, parts) values of the parts of every hash, most significant first.
+        """
+        bits = 64 // self.parts
+        shifts = np.arange(self.parts - 1, -1, -1, dtype=np.uint64) * np.uint64(bits)
+        mask = np.uint64((1 << bits) - 1)
+
+        return (hashes[:, None] >> shifts[None, :]) & mask
+
+    def add(self, hashes, labels) -> None:
+        """
+        Add hashes to the library, along with one label each.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64).reshape(-1)
+        labels = np.asarray(labels, dtype=str).reshape(-1)
+        if len(hashes) != len(labels):
+            raise ValueError("got {0} labels for {1} hashes".format(len(labels), len(hashes)))
+
+        self.hashes = np.concatenate([self.hashes, hashes])
+        self.labels = np.concatenate([self.labels, labels]) if len(self.labels) else labels
+
+        split = self._split(self.hashes)
+        self._orders = np.argsort(split, axis=0, kind="stable")
+        self._sorted_parts = np.take_along_axis(split, self._orders, axis=0)
+
+    def query(self, query: int, max_distance: int = 8) -> List[Tuple[str, int]]:
+        """
+        Return the (label, distance) of every hash at most max_distance bits away from query, closest first. A library
+        of a single part only answers a max_distance of up to 2.
+        """
+        if self.parts == 1 and max_distance > _MAX_WHOLE_DISTANCE:
+            raise ValueError("a single part is searched at most {0} bits away, got a max_distance of {1}".format(
+                _MAX_WHOLE_DISTANCE, max_distance
+            ))
+        if len(self.hashes) == 0:
+            return []
+
+        bits = 64 // self.parts
+        radius = max_distance // self.parts
+        # every probe costs a lookup in each part, so past one per hash scanning the whole library is cheaper
+        if self.parts * sum(math.comb(bits, flipped) for flipped in range(radius + 1)) > len(self.hashes):
+            candidates = np.arange(len(self.hashes))
+        else:
+            candidates = self._probe(query, radius)
+
+        if len(candidates) == 0:
+            return []
+
+        distances = hamming_distances(self.hashes[candidates], query)
+        close = distances <= max_distance
+        candidates, distances = candidates[close], distances[close]
+        order = np.lexsort((candidates, distances))
+
+        return [
+            (str(self.labels[index]), int(distance)) for index, distance in zip(candidates[order], distances[order])
+        ]
+
+    def _probe(self, query: int, radius: int) -> np.ndarray:
+        """
+        Return the indices of the hashes with at least one part at most radius bits away from that part of query.
+        """
+        query_parts = self._split(np.asarray([query], dtype=np.uint64))[0]
+        probes = _flip_masks(64 // self.parts, radius)
+
+        candidates = []
+        for part in range(self.parts):
+            values = query_parts[part] ^ probes
+            column = self._sorted_parts[:, part]
+            starts = np.searchsorted(column, values, side="left")
+            stops = np.searchsorted(column, values, side="right")
+            found = starts < stops
+            for start, stop in zip(starts[found].tolist(), stops[found].tolist()):
+                candidates.append(self._orders[start:stop, part])
+
+        if len(candidates) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        return np.unique(np.concatenate(candidates))
+
+    def match(self, hashes, max_distance: int = 8) -> List[Tuple[str, int] or None]:
+        """
+        Return the closest (label, distance) within max_distance of every hash, or None where there is none.
+        """
+        matches = []
+        for query in np.asarray(hashes, dtype=np.uint64).reshape(-1).tolist():
+            found = self.query(query, max_distance)
+            matches.append(found[0] if found else None)
+
+        return matches
+
+    def match_rects(self, image, rects, max_distance: int = 8,
+                    channel_order: str = None) -> List[Tuple[str, int] or None]:
+        """
+        Return the closest known icon of every rect of image, as in match.
+        """
+        return self.match(self.fingerprint(image, rects, channel_order), max_distance)
+
+    def save(self, path: str) -> None:
+        """
+        Store the library as an npz file, see load.
+        """
+        np.savez(
+            path, hashes=self.hashes, labels=self.labels, method=np.str_(self.method), parts=np.int64(self.parts)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'FingerprintIndex':
+        """
+        Read a library written by save.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["hashes"], data["labels"], str(data["method"]), int(data["parts"]))
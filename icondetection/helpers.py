@@ -2,16 +2,40 @@ from PIL import Image
 import numpy as np
 import cv2
 
+from icondetection.box import channel_order_of
+from icondetection.features import FeatureExtractor
+
+
+# channel order of the pixels of each PIL image mode that can be read without conversion
+_PIL_CHANNEL_ORDERS = {"L": "gray", "RGB": "rgb", "RGBA": "rgba"}
+
+# shared by every call to run_sift, so the detector is only created once
+_sift = None
+
 
 def run_sift(img):
-    img = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    """
+    Detect SIFT keypoints on a PIL image or a BGR array, and return the gray image with the keypoints drawn on it.
+    Use a FeatureExtractor directly to get the keypoints and descriptors as arrays, or to look inside rects only.
+    """
+    global _sift
+    if isinstance(img, Image.Image):
+        if img.mode not in _PIL_CHANNEL_ORDERS:
+            img = img.convert("RGB")
+        channel_order = _PIL_CHANNEL_ORDERS[img.mode]
+        img = np.asarray(img)
+    else:
+        channel_order = channel_order_of(img)
+
+    if _sift is None:
+        # only keypoints are drawn, so nothing is described or cached
+        _sift = FeatureExtractor("sift", max_entries=0)
 
-    sift = cv2.SIFT_create()
-    kp = sift.detect(gray, None)
+    # straight to gray, rather than through a BGR copy that is only ever drawn over
+    gray = _sift.gray(img, channel_order)
+    kp = _sift.detect(gray, channel_order="gray")
 
-    cv2.drawKeypoints(image=gray, keypoints=kp, outImage=img)
-    return img
+    return cv2.drawKeypoints(image=gray, keypoints=kp, outImage=None)
 
 
 def save_img(img, name):
@@ -0,0 +1,82 @@
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from icondetection.box import CHANNEL_ORDERS
+
+
+def from_buffer(buffer, width: int, height: int, channel_order: str = "bgr", stride: int = None,
+                offset: int = 0) -> np.ndarray:
+    """
+    View raw 8 bit pixels held in any object supporting the buffer protocol (bytes, memoryview, mmap, numpy arrays,
+    shared memory) as an image, without copying them. stride is the number of bytes from the start of one row to the
+    start of the next, which may include padding; it defaults to tightly packed rows. offset is the position of the
+    first pixel in the buffer.
+
+    The result is a (height, width) array for gray pixels and (height, width, channels) otherwise, ready for
+    grayscale_blur or detect_rects with the same channel_order. It shares memory with buffer, so it must not outlive
+    it.
+    """
+    if channel_order not in CHANNEL_ORDERS:
+        raise ValueError("unknown channel order {0!r}".format(channel_order))
+    if width < 1 or height < 1:
+        raise ValueError("width and height must be positive, got {0}x{1}".format(width, height))
+
+    channels = CHANNEL_ORDERS[channel_order][0]
+    row_bytes = width * channels
+    if stride is None:
+        stride = row_bytes
+    if stride < row_bytes:
+        raise ValueError("stride {0} is shorter than a row of {1} bytes".format(stride, row_bytes))
+
+    size = memoryview(buffer).nbytes
+    needed = offset + (height - 1) * stride + row_bytes
+    if offset < 0 or needed > size:
+        raise ValueError("a {0}x{1} {2} image needs {3} bytes, the buffer holds {4}".format(
+            width, height, channel_order, needed, size
+        ))
+
+    if channels == 1:
+        return np.ndarray((height, width), dtype=np.uint8, buffer=buffer, offset=offset, strides=(stride, 1))
+
+    return np.ndarray(
+        (height, width, channels), dtype=np.uint8, buffer=buffer, offset=offset, strides=(stride, channels, 1)
+    )
+
+
+def from_mmap(path: str, width: int, height: int, channel_order: str = "bgr", stride: int = None,
+              offset: int = 0) -> np.ndarray:
+    """
+    Map a file of raw pixels read only and view it as an image, see from_buffer. Pages are only read from disk as the
+    pipeline touches them.
+    """
+    return from_buffer(np.memmap(path, dtype=np.uint8, mode="r"), width, height, channel_order, stride, offset)
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to a shared memory block created by another process, which remains its owner and is responsible for
+    unlinking it.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        # before Python 3.13 attaching also registers the block with this process's resource tracker, which would
+        # unlink it when this process exits. It is only registered on POSIX, under the name with its leading slash
+        from multiprocessing import resource_tracker
+
+        if os.name == "posix":
+            resource_tracker.unregister("/" + block.name, "shared_memory")
+    except (ImportError, AttributeError):
+        pass
+
+    return block
+
+
+def from_shared_memory(block: shared_memory.SharedMemory, width: int, height: int, channel_order: str = "bgr",
+                       stride: int = None, offset: int = 0) -> np.ndarray:
+    """
+    View pixels held in a shared memory block as an image, see from_buffer. The block cannot be closed while the
+    image, or anything viewing it, is still referenced.
+    """
+    return from_buffer(block.buf, width, height, channel_order, stride, offset)
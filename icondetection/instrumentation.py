@@ -0,0 +1,212 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from typing import Callable, NamedTuple
+
+# True while at least one sink is registered. Instrumented code checks it before doing any work, so disabled
+# instrumentation costs a single attribute lookup.
+active = False
+
+# registered sinks; replaced rather than mutated, so emitting never needs the lock
+_sinks = ()
+_sinks_lock = threading.Lock()
+
+# upper bounds, in seconds, of the buckets of HistogramSink
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Event(NamedTuple):
+    """
+    One measurement, as handed to sinks. A "stage" event holds the wall time of a stage in value and its CPU time in
+    cpu, both in seconds; a "count" event holds the amount a counter grew by in value.
+    """
+
+    kind: str
+    name: str
+    value: float
+    cpu: float = None
+
+
+def add_sink(sink: Callable[[Event], None]) -> None:
+    """
+    Register a sink, any callable taking an Event, enabling instrumentation.
+    """
+    global active, _sinks
+    with _sinks_lock:
+        _sinks = _sinks + (sink,)
+        active = True
+
+
+def remove_sink(sink: Callable[[Event], None]) -> None:
+    """
+    Unregister a sink, disabling instrumentation once no sink is left.
+    """
+    global active, _sinks
+    with _sinks_lock:
+        _sinks = tuple(registered for registered in _sinks if registered is not sink)
+        active = len(_sinks) > 0
+
+
+@contextmanager
+def instrumented(*sinks: Callable[[Event], None]):
+    """
+    Register sinks for the duration of a with block.
+    """
+    for sink in sinks:
+        add_sink(sink)
+    try:
+        yield
+    finally:
+        for sink in sinks:
+            remove_sink(sink)
+
+
+def _emit(event: Event) -> None:
+    for sink in _sinks:
+        sink(event)
+
+
+class _Stage:
+    """
+    Times the with block it guards, in wall and CPU time of the calling thread.
+    """
+
+    __slots__ = ("name", "_wall", "_cpu")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        cpu = time.thread_time() - self._cpu
+        wall = time.perf_counter() - self._wall
+        _emit(Event("stage", self.name, wall, cpu))
+        return False
+
+
+class _NullStage:
+    """
+    Stand-in for _Stage while instrumentation is disabled.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str):
+    """
+    Return a context manager timing its with block as the named stage, or one doing nothing when disabled.
+    """
+    if not active:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def count(name: str, value: float = 1) -> None:
+    """
+    Grow the named counter by value.
+    """
+    if active and value:
+        _emit(Event("count", name, value))
+
+
+class HistogramSink:
+    """
+    In memory sink keeping a histogram of the wall time of every stage, the total CPU time of every stage and the
+    total of every counter. It can be read as a dictionary with snapshot, or as a Prometheus text format dump.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget every measurement.
+        """
+        with self._lock:
+            # stage name -> [count per bucket (the last one unbounded), wall time sum, cpu time sum]
+            self._stages = {}
+            self._counters = {}
+
+    def __call__(self, event: Event) -> None:
+        with self._lock:
+            if event.kind == "count":
+                self._counters[event.name] = self._counters.get(event.name, 0) + event.value
+                return
+
+            stage_entry = self._stages.get(event.name)
+            if stage_entry is None:
+                stage_entry = self._stages[event.name] = [[0] * (len(self.buckets) + 1), 0.0, 0.0]
+            stage_entry[0][bisect_left(self.buckets, event.value)] += 1
+            stage_entry[1] += event.value
+            stage_entry[2] += event.cpu
+
+    def snapshot(self) -> dict:
+        """
+        Return the measurements so far: for every stage its number of runs, wall and CPU time sums and cumulative
+        bucket counts as (upper bound, count) pairs, and the total of every counter.
+        """
+        with self._lock:
+            stages = {}
+            for name, (counts, wall, cpu) in self._stages.items():
+                cumulative = []
+                total = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    total += bucket_count
+                    cumulative.append((bound, total))
+                stages[name] = {"count": total, "wall_seconds": wall, "cpu_seconds": cpu, "buckets": cumulative}
+
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def prometheus_text(self, prefix: str = "icondetection") -> str:
+        """
+        Dump the measurements in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        if snapshot["stages"]:
+            metric = "{0}_stage_wall_seconds".format(prefix)
+            lines.append("# HELP {0} Wall time spent in each stage.".format(metric))
+            lines.append("# TYPE {0} histogram".format(metric))
+            for name, stage_entry in sorted(snapshot["stages"].items()):
+                for bound, bucket_count in stage_entry["buckets"]:
+                    lines.append('{0}_bucket{{stage="{1}",le="{2}"}} {3}'.format(
+                        metric, _escape(name), "+Inf" if bound == float("inf") else repr(float(bound)), bucket_count
+                    ))
+                lines.append('{0}_sum{{stage="{1}"}} {2!r}'.format(metric, _escape(name), stage_entry["wall_seconds"]))
+                lines.append('{0}_count{{stage="{1}"}} {2}'.format(metric, _escape(name), stage_entry["count"]))
+
+            metric = "{0}_stage_cpu_seconds_total".format(prefix)
+            lines.append("# HELP {0} CPU time spent in each stage.".format(metric))
+            lines.append("# TYPE {0} counter".format(metric))
+            for name, stage_entry in sorted(snapshot["stages"].items()):
+                lines.append('{0}{{stage="{1}"}} {2!r}'.format(metric, _escape(name), stage_entry["cpu_seconds"]))
+
+        for name, total in sorted(snapshot["counters"].items()):
+            metric = "{0}_{1}_total".format(prefix, re.sub(r"[^a-zA-Z0-9_]", "_", name))
+            lines.append("# TYPE {0} counter".format(metric))
+            lines.append("{0} {1}".format(metric, total))
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
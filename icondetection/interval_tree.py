@@ -0,0 +1,89 @@
+from bisect import bisect_left
+from typing import Iterator, List
+
+
+class IntervalTree:
+    """
+    Interval tree over a fixed universe of intervals, each of which can be switched in and out of the tree.
+
+    The intervals are sorted by their low end and laid out on the leaves of an implicit, array backed binary tree.
+    Every node stores the largest high end among the active intervals beneath it, which lets overlap queries skip
+    whole subtrees. Insertion and removal cost O(log n), and reporting the k intervals overlapping a query costs
+    O((k + 1) log n).
+    """
+
+    def __init__(self, lows: List[int], highs: List[int]):
+        """
+        Create an empty tree that can hold the intervals (lows[i], highs[i]) for i in 0 through n-1.
+        """
+        if len(lows) != len(highs):
+            raise ValueError("lows and highs must have the same length")
+
+        n = len(lows)
+        self._highs = list(highs)
+        self._order = sorted(range(n), key=lambda i: (lows[i], i))
+        self._sorted_lows = [lows[i] for i in self._order]
+        self._position = [0] * n
+        for position, i in enumerate(self._order):
+            self._position[i] = position
+
+        self._leaves = 1
+        while self._leaves < n:
+            self._leaves *= 2
+
+        self._empty = float("-inf")
+        self._max_high = [self._empty] * (2 * self._leaves)
+
+    def insert(self, i: int) -> None:
+        """
+        Make interval i active.
+        """
+        self._set(i, self._highs[i])
+
+    def remove(self, i: int) -> None:
+        """
+        Make interval i inactive. Removing an inactive interval does nothing.
+        """
+        self._set(i, self._empty)
+
+    def _set(self, i: int, value) -> None:
+        max_high = self._max_high
+        node = self._leaves + self._position[i]
+        max_high[node] = value
+        node //= 2
+        while node > 0:
+            left_high = max_high[2 * node]
+            right_high = max_high[2 * node + 1]
+            new_value = left_high if left_high > right_high else right_high
+            if max_high[node] == new_value:
+                break
+            max_high[node] = new_value
+            node //= 2
+
+    def overlapping(self, low: int, high: int) -> Iterator[int]:
+        """
+        Yield every active interval j for which low_j < high and high_j > low, that is every interval overlapping
+        the open interval (low, high).
+        """
+        limit = bisect_left(self._sorted_lows, high)
+        if limit == 0:
+            return
+
+        max_high = self._max_high
+        leaves = self._leaves
+        if max_high[1] <= low:
+            return
+
+        # children are only pushed once they are known to hold at least one reportable interval
+        stack = [(1, 0, leaves)]
+        while stack:
+            node, start, end = stack.pop()
+            if node >= leaves:
+                yield self._order[start]
+                continue
+
+            middle = (start + end) // 2
+            if middle < limit and max_high[2 * node + 1] > low:
+                stack.append((2 * node + 1, middle, end))
+            if max_high[2 * node] > low:
+                stack.append((2 * node, start, middle))
@@ -0,0 +1,141 @@
+import numpy as np
+
+from typing import List, Tuple
+
+from icondetection.rect_array import RectArray
+from icondetection.rect_index import RectIndex
+from icondetection.rectangle import Rectangle
+
+DIRECTIONS = ("left", "right", "up", "down")
+
+# weight of the distance along the direction of travel over the offset across it, as in Android's FocusFinder
+_MAJOR_WEIGHT = 13
+# added to the score of candidates not overlapping the source across the direction of travel, so any overlapping
+# candidate wins over them
+_OUT_OF_BEAM = 1e15
+
+
+def _as_right(rects: RectArray, direction: str):
+    """
+    Return the near and far edges along direction and the low and high edges across it, mirrored and transposed so
+    that every direction can be scored as if it were right.
+    """
+    if direction == "right":
+        return rects.left, rects.right, rects.top, rects.bottom
+    if direction == "left":
+        return -rects.right.astype(np.int64), -rects.left.astype(np.int64), rects.top, rects.bottom
+    if direction == "down":
+        return rects.top, rects.bottom, rects.left, rects.right
+    if direction == "up":
+        return -rects.bottom.astype(np.int64), -rects.top.astype(np.int64), rects.left, rects.right
+
+    raise ValueError("unknown direction {0!r}, expected one of {1}".format(direction, ", ".join(DIRECTIONS)))
+
+
+def directional_neighbours(rects: RectArray, direction: str, chunk_size: int = 512) -> np.ndarray:
+    """
+    Return, for every rect, the index of the rect a move in direction lands on, or -1 when there is none.
+
+    A candidate has to lie beyond the rect in that direction. Candidates overlapping the rect across the direction of
+    travel win over those that do not; among either, the one minimising 13 * major ** 2 + minor ** 2 wins, major
+    being the gap along the direction and minor the offset between the centres across it, and the first one in
+    rects among equal scores. The score matrix is built chunk_size rects at a time.
+    """
+    near, far, low, high = (np.asarray(edge, dtype=np.float64) for edge in _as_right(rects, direction))
+    middle = (low + high) / 2
+    neighbours = np.full(len(rects), -1, dtype=np.int64)
+
+    for start in range(0, len(rects), chunk_size):
+        stop = min(start + chunk_size, len(rects))
+        source_near, source_far = near[start:stop, None], far[start:stop, None]
+        source_low, source_high = low[start:stop, None], high[start:stop, None]
+
+        candidate = ((source_near < near) | (source_far <= near)) & (source_far < far)
+        major = np.maximum(near - source_far, 0)
+        minor = middle - middle[start:stop, None]
+        in_beam = (low < source_high) & (high > source_low)
+
+        score = _MAJOR_WEIGHT * major * major + minor * minor + np.where(in_beam, 0, _OUT_OF_BEAM)
+        score[~candidate] = np.inf
+        best = np.argmin(score, axis=1)
+
+        found = np.isfinite(score[np.arange(stop - start), best])
+        neighbours[start:stop][found] = best[found]
+
+    return neighbours
+
+
+class NavigationGraph:
+    """
+    Neighbour queries over the rects of one detection result, typically the output of box.group_rects, for keyboard
+    or voice navigation through icons.
+
+    The left, right, up and down neighbour of every rect is found once when the graph is built (see
+    directional_neighbours), so every hop afterwards is a table lookup. Nearest and radius queries around a point go
+    through a RectIndex built over the same rects.
+    """
+
+    def __init__(self, rects: List[Rectangle], chunk_size: int = 512):
+        """
+        Build the graph over rects, in Cartesian notation.
+        """
+        self.index = RectIndex(rects)
+        rect_array = RectArray.from_rectangles(self.index.rects)
+
+        # rect index -> neighbour index in every direction, in the order of DIRECTIONS
+        self.neighbours = np.stack(
+            [directional_neighbours(rect_array, direction, chunk_size) for direction in DIRECTIONS], axis=1
+        )
+
+    @classmethod
+    def from_cv(cls, cv_rects, chunk_size: int = 512) -> 'NavigationGraph':
+        """
+        Build the graph from rectangles in CV representation, such as the output of box.group_rects.
+        """
+        return cls([Rectangle.rect_cv_to_cartesian(rect) for rect in cv_rects], chunk_size)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def rects(self) -> List[Rectangle]:
+        return self.index.rects
+
+    def neighbour(self, index: int, direction: str) -> int or None:
+        """
+        Return the index of the rect a move in direction from rect index lands on, or None when there is none.
+        """
+        if direction not in DIRECTIONS:
+            raise ValueError("unknown direction {0!r}, expected one of {1}".format(direction, ", ".join(DIRECTIONS)))
+
+        neighbour = int(self.neighbours[index, DIRECTIONS.index(direction)])
+        return None if neighbour < 0 else neighbour
+
+    def walk(self, index: int, directions: List[str]) -> int:
+        """
+        Follow a sequence of moves from rect index and return where they end. A move with no neighbour is skipped.
+        """
+        for direction in directions:
+            neighbour = self.neighbour(index, direction)
+            if neighbour is not None:
+                index = neighbour
+
+        return index
+
+    def start(self, query_point: Tuple[int, int]) -> int:
+        """
+        Return the index of the rect navigation starts from for a point, the candidate rectangle of the point.
+        """
+        return self.index.candidate_index(query_point)
+
+    def nearest(self, query_point: Tuple[int, int], k: int) -> List[int]:
+        """
+        Return the indices of the k rects closest to a point, closest first.
+        """
+        return self.index.nearest_indices(query_point, k)
+
+    def within(self, query_point: Tuple[int, int], radius: float) -> List[int]:
+        """
+        Return the indices of the rects at most radius away from a point, closest first.
+        """
+        return self.index.within_distance_indices(query_point, radius)
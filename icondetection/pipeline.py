@@ -0,0 +1,173 @@
+import cv2 as cv
+import numpy as np
+
+from typing import List
+
+from icondetection.box import (
+    approximate_bounding_rects,
+    canny_edges,
+    contour_bounding_rects,
+    find_contours,
+    grayscale_blur,
+    group_rects,
+)
+from icondetection.containment import ContainmentTree
+from icondetection.rect_index import RectIndex
+
+
+class DetectionPipeline:
+    """
+    The detection pipeline as a chain of memoized stages: grayscale and blur, Canny, contours, rect extraction,
+    grouping and finally the RectIndex used for point queries. The contour hierarchy is kept alongside the contours,
+    so the ContainmentTree of the rects comes without another detection.
+
+    Every stage remembers the key it was computed for, made of its own parameters and the key of the stage before
+    it. Asking for a stage only recomputes it, and whatever it depends on, when that key changed; for example moving
+    the Canny threshold reruns Canny and everything after it, but never the blur.
+
+    With rects_only, rects are taken straight from the contours as in canny_rects, skipping the hierarchy and the
+    polygons; external then keeps only the outermost contours.
+    """
+
+    def __init__(self, image=None, min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3,
+                 channel_order: str = None, rects_only: bool = False, external: bool = False):
+        self._image = image
+        self._image_version = 0
+        self.channel_order = channel_order
+        self.min_threshold = min_threshold
+        self.multiplier = multiplier
+        self.contour_accuracy = contour_accuracy
+        self.rects_only = rects_only
+        self.external = external
+
+        # stage name -> (key, value)
+        self._memo = {}
+        # stage name -> number of times the stage actually ran
+        self.runs = {}
+
+    @property
+    def image(self):
+        return self._image
+
+    @image.setter
+    def image(self, image) -> None:
+        """
+        Replace the source image, invalidating every stage.
+        """
+        self._image = image
+        self._image_version += 1
+
+    def _stage(self, name: str, key: tuple, compute):
+        memo = self._memo.get(name)
+        if memo is not None and memo[0] == key:
+            return memo[1]
+
+        value = compute()
+        self._memo[name] = (key, value)
+        self.runs[name] = self.runs.get(name, 0) + 1
+
+        return value
+
+    def _gray_key(self) -> tuple:
+        return self._image_version, self.channel_order
+
+    def _edges_key(self) -> tuple:
+        return self._gray_key() + (self.min_threshold, self.multiplier)
+
+    def _retrieval_mode(self) -> int:
+        if not self.rects_only:
+            return cv.RETR_TREE
+        return cv.RETR_EXTERNAL if self.external else cv.RETR_LIST
+
+    def _contours_key(self) -> tuple:
+        return self._edges_key() + (self._retrieval_mode(),)
+
+    def _polygons_key(self) -> tuple:
+        return self._contours_key() + (self.contour_accuracy,)
+
+    def _rects_key(self) -> tuple:
+        return self._contours_key() if self.rects_only else self._polygons_key()
+
+    def gray(self):
+        """
+        The blurred gray scale image.
+        """
+        if self._image is None:
+            raise ValueError("the pipeline has no image")
+
+        return self._stage("gray", self._gray_key(), lambda: grayscale_blur(self._image, self.channel_order))
+
+    def edges(self):
+        """
+        The Canny edge map.
+        """
+        return self._stage(
+            "edges", self._edges_key(), lambda: canny_edges(self.gray(), self.min_threshold, self.multiplier)
+        )
+
+    def _contours_and_hierarchy(self):
+        return self._stage(
+            "contours",
+            self._contours_key(),
+            lambda: find_contours(self.edges(), self._retrieval_mode(), cv.CHAIN_APPROX_SIMPLE),
+        )
+
+    def contours(self) -> list:
+        """
+        The contours of the edge map.
+        """
+        return self._contours_and_hierarchy()[0]
+
+    def hierarchy(self):
+        """
+        The hierarchy of the contours, as returned by cv.findContours, or None when there are no contours.
+        """
+        return self._contours_and_hierarchy()[1]
+
+    def polygons_and_rects(self):
+        """
+        The approximated polygons of the contours and their bounding rectangles.
+        """
+        if self.rects_only:
+            raise ValueError("polygons are not computed in rects only mode")
+
+        return self._stage(
+            "rects", self._polygons_key(), lambda: approximate_bounding_rects(self.contours(), self.contour_accuracy)
+        )
+
+    def rects(self):
+        """
+        The bounding rectangles of the contours, in CV representation: a list of tuples, or an (N, 4) array in rects
+        only mode.
+        """
+        if self.rects_only:
+            return self._stage("bounding_rects", self._rects_key(), lambda: contour_bounding_rects(self.contours()))
+
+        return self.polygons_and_rects()[1]
+
+    def containment(self) -> ContainmentTree:
+        """
+        The ContainmentTree of the rects, for innermost, outermost or Nth level queries.
+        """
+        if self.rects_only:
+            raise ValueError("the containment tree is not computed in rects only mode")
+
+        return self._stage(
+            "containment",
+            self._polygons_key(),
+            lambda: ContainmentTree.from_hierarchy(
+                self.rects(), np.empty((0, 4)) if self.hierarchy() is None else self.hierarchy()
+            ),
+        )
+
+    def grouped(self) -> List[tuple]:
+        """
+        The grouped rects, as returned by group_rects.
+        """
+        return self._stage("grouped", self._rects_key(), lambda: group_rects(self.rects()))
+
+    def index(self) -> RectIndex:
+        """
+        A RectIndex over the grouped rects, for candidate rectangle queries.
+        """
+        return self._stage("index", self._rects_key(), lambda: RectIndex.from_cv(self.grouped()))
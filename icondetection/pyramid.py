@@ -0,0 +1,123 @@
+import math
+
+import cv2 as cv
+import numpy as np
+
+from typing import List
+
+from icondetection import instrumentation
+from icondetection.box import (
+    approximate_bounding_rects,
+    canny_edges,
+    contour_bounding_rects,
+    find_contours,
+    grayscale_blur,
+    group_rects,
+)
+from icondetection.rect_array import RectArray
+from icondetection.roi import clip, merge_touching
+
+# pixels of context read around a refined region, enough for the Sobel and non-maximum suppression kernels
+_CONTEXT = 4
+
+
+def coarse_regions(gray_scale_image, scale: float = 0.5, margin: int = 8, min_threshold: int = 100,
+                   multiplier: float = 2) -> RectArray:
+    """
+    Find the regions of a blurred gray scale image worth detecting at full resolution. Canny runs on a copy
+    downscaled by scale, its edges are dilated by margin full resolution pixels, which also joins edges closer than
+    that, and the bounding boxes of the connected areas are mapped back to full resolution.
+    """
+    if not 0 < scale <= 1:
+        raise ValueError("scale must be in (0, 1], got {0}".format(scale))
+
+    height, width = gray_scale_image.shape[:2]
+    small_width = max(int(round(width * scale)), 1)
+    small_height = max(int(round(height * scale)), 1)
+    small = cv.resize(gray_scale_image, (small_width, small_height), interpolation=cv.INTER_AREA)
+
+    radius = math.ceil(margin * scale)
+    kernel = cv.getStructuringElement(cv.MORPH_RECT, (2 * radius + 1, 2 * radius + 1))
+    grown = cv.dilate(canny_edges(small, min_threshold, multiplier), kernel)
+
+    # outer contours bound the same areas as connected components, but labelling every pixel costs far more
+    contours, _ = find_contours(grown, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    boxes = contour_bounding_rects(contours).astype(np.float64)
+    x_ratio = width / small_width
+    y_ratio = height / small_height
+
+    return clip(RectArray(
+        np.floor(boxes[:, 1] * y_ratio),
+        np.floor(boxes[:, 0] * x_ratio),
+        np.ceil((boxes[:, 1] + boxes[:, 3]) * y_ratio),
+        np.ceil((boxes[:, 0] + boxes[:, 2]) * x_ratio),
+    ), gray_scale_image.shape)
+
+
+def pyramid_canny_detection(gray_scale_image, scale: float = 0.5, margin: int = 8, full_frame_ratio: float = 0.5,
+                            min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3):
+    """
+    Coarse to fine equivalent of canny_detection, returning the approximated polygons and their bounding rects.
+
+    The regions holding edges are found on a copy of the image downscaled by scale (see coarse_regions), and Canny
+    runs at full resolution inside those regions only. Regions that overlap or touch are merged first, so every
+    pixel is refined exactly once and the result does not depend on the order of the regions. Their edges are laid
+    back onto an otherwise empty edge map, from which contours are extracted once, so the rects inside the regions
+    match a full detection. Whatever is
+    missing at the coarse scale is missing from the result: a smaller scale is faster but loses faint or tiny
+    icons, while a larger margin keeps more of their surroundings. Once the regions cover more than
+    full_frame_ratio of the image, Canny runs on the whole image instead.
+    """
+    height, width = gray_scale_image.shape[:2]
+
+    with instrumentation.stage("pyramid_coarse"):
+        regions = merge_touching(coarse_regions(gray_scale_image, scale, margin, min_threshold, multiplier))
+    instrumentation.count("pyramid_regions", len(regions))
+
+    if int(regions.get_area().sum()) > full_frame_ratio * height * width:
+        edges = canny_edges(gray_scale_image, min_threshold, multiplier)
+    else:
+        edges = np.zeros((height, width), dtype=np.uint8)
+        with instrumentation.stage("pyramid_refine"):
+            for region in regions:
+                top = max(region.top - _CONTEXT, 0)
+                left = max(region.left - _CONTEXT, 0)
+                bottom = min(region.bottom + _CONTEXT, height)
+                right = min(region.right + _CONTEXT, width)
+
+                crop_edges = canny_edges(gray_scale_image[top:bottom, left:right], min_threshold, multiplier)
+                edges[region.top:region.bottom, region.left:region.right] = crop_edges[
+                    region.top - top:region.bottom - top, region.left - left:region.right - left
+                ]
+
+    contours, _ = find_contours(edges, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+
+    return approximate_bounding_rects(contours, contour_accuracy)
+
+
+def pyramid_bounding_rects(image, scale: float = 0.5, margin: int = 8, full_frame_ratio: float = 0.5,
+                           min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3,
+                           channel_order: str = None) -> List[tuple]:
+    """
+    Coarse to fine equivalent of grayscale_blur followed by canny_detection, see pyramid_canny_detection. Returns the
+    bounding rects in full resolution coordinates.
+    """
+    _, bound_rect = pyramid_canny_detection(
+        grayscale_blur(image, channel_order), scale, margin, full_frame_ratio,
+        min_threshold=min_threshold, multiplier=multiplier, contour_accuracy=contour_accuracy,
+    )
+
+    return bound_rect
+
+
+def pyramid_detect_rects(image, scale: float = 0.5, margin: int = 8, full_frame_ratio: float = 0.5,
+                         min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3,
+                         channel_order: str = None) -> List[tuple]:
+    """
+    Coarse to fine equivalent of box.detect_rects: pyramid_bounding_rects followed by group_rects.
+    """
+    return group_rects(pyramid_bounding_rects(
+        image, scale, margin, full_frame_ratio,
+        min_threshold=min_threshold, multiplier=multiplier, contour_accuracy=contour_accuracy,
+        channel_order=channel_order,
+    ))
@@ -0,0 +1,201 @@
+import numpy as np
+
+from typing import List
+
+from icondetection.rectangle import Rectangle
+
+
+class RectArray:
+    """
+    Struct of arrays representation of many rectangles in Cartesian notation.
+
+    Instead of one Python object per rectangle, top, left, bottom and right are each held in a contiguous int32
+    array. All operations are vectorized, so hot paths can work on thousands of rectangles without allocating a
+    Rectangle per entry. Semantics follow Rectangle exactly (strict overlap in intersect, inclusive containment and
+    the same point to rectangle distance), and conversion in both directions is available so callers can move over
+    one at a time.
+    """
+
+    def __init__(self, top, left, bottom, right):
+        """
+        Create a rectangle array from four equally sized sequences in Cartesian notation.
+        """
+        self.top = np.ascontiguousarray(top, dtype=np.int32).reshape(-1)
+        self.left = np.ascontiguousarray(left, dtype=np.int32).reshape(-1)
+        self.bottom = np.ascontiguousarray(bottom, dtype=np.int32).reshape(-1)
+        self.right = np.ascontiguousarray(right, dtype=np.int32).reshape(-1)
+
+        n = len(self.top)
+        if len(self.left) != n or len(self.bottom) != n or len(self.right) != n:
+            raise ValueError("top, left, bottom and right must have the same length")
+
+    @classmethod
+    def empty(cls) -> 'RectArray':
+        """
+        Create an array holding no rectangles.
+        """
+        return cls([], [], [], [])
+
+    @classmethod
+    def from_rectangles(cls, rects: List[Rectangle]) -> 'RectArray':
+        """
+        Convert a list of Rectangle objects.
+        """
+        return cls(
+            [rect.top for rect in rects],
+            [rect.left for rect in rects],
+            [rect.bottom for rect in rects],
+            [rect.right for rect in rects],
+        )
+
+    @classmethod
+    def from_cv(cls, cv_rects) -> 'RectArray':
+        """
+        Convert rectangles in CV representation, given as a list of tuples or an (N, 4) array. Mirrors
+        Rectangle.rect_cv_to_cartesian.
+        """
+        cv_rects = np.asarray(cv_rects, dtype=np.int32).reshape(-1, 4)
+        return cls(
+            cv_rects[:, 1],
+            cv_rects[:, 0],
+            cv_rects[:, 1] + cv_rects[:, 3],
+            cv_rects[:, 0] + cv_rects[:, 2],
+        )
+
+    @staticmethod
+    def concatenate(arrays: List['RectArray']) -> 'RectArray':
+        """
+        Join several rectangle arrays end to end.
+        """
+        if len(arrays) == 0:
+            return RectArray.empty()
+
+        return RectArray(
+            np.concatenate([array.top for array in arrays]),
+            np.concatenate([array.left for array in arrays]),
+            np.concatenate([array.bottom for array in arrays]),
+            np.concatenate([array.right for array in arrays]),
+        )
+
+    def to_cv(self) -> np.ndarray:
+        """
+        Convert back to an (N, 4) int32 array in CV representation. Mirrors Rectangle.rect_cartesian_to_cv.
+        """
+        return np.stack(
+            (self.left, self.top, self.right - self.left, self.bottom - self.top), axis=1
+        ).astype(np.int32, copy=False)
+
+    def to_rectangles(self) -> List[Rectangle]:
+        """
+        Convert to a list of Rectangle objects.
+        """
+        return [
+            Rectangle(int(top), int(left), int(bottom), int(right))
+            for top, left, bottom, right in zip(self.top, self.left, self.bottom, self.right)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.top)
+
+    def __getitem__(self, item):
+        """
+        An integer returns a single Rectangle; a slice, index array or boolean mask returns a new RectArray.
+        """
+        if isinstance(item, (int, np.integer)):
+            return Rectangle(int(self.top[item]), int(self.left[item]), int(self.bottom[item]), int(self.right[item]))
+
+        return RectArray(self.top[item], self.left[item], self.bottom[item], self.right[item])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def get_area(self) -> np.ndarray:
+        """
+        Return the area taken up by every rectangle, as int64 so large rectangles do not overflow.
+        """
+        return (self.right.astype(np.int64) - self.left) * (self.bottom.astype(np.int64) - self.top)
+
+    def merge(self) -> Rectangle:
+        """
+        Merge all rectangles into one conglomerate rect, the vectorized counterpart of Rectangle.merge_rects.
+        """
+        if len(self) == 0:
+            raise ValueError("cannot merge an empty rectangle array")
+
+        return Rectangle(int(self.top.min()), int(self.left.min()), int(self.bottom.max()), int(self.right.max()))
+
+    def intersect_matrix(self, other: 'RectArray' = None) -> np.ndarray:
+        """
+        Return an (N, M) boolean matrix where entry (i, j) tells whether rectangle i of this array intersects
+        rectangle j of other, using the same strict overlap test as Rectangle.intersect. Without other, the array
+        is compared against itself.
+        """
+        if other is None:
+            other = self
+
+        return (
+                (self.left[:, None] < other.right[None, :])
+                & (self.right[:, None] > other.left[None, :])
+                & (self.top[:, None] < other.bottom[None, :])
+                & (self.bottom[:, None] > other.top[None, :])
+        )
+
+    def iou_matrix(self, other: 'RectArray' = None) -> np.ndarray:
+        """
+        Return an (N, M) float matrix holding the intersection over union of rectangle i of this array and rectangle j
+        of other, 0 where they do not overlap. Without other, the array is compared against itself.
+        """
+        if other is None:
+            other = self
+
+        height = np.minimum(self.bottom[:, None], other.bottom[None, :]) - np.maximum(self.top[:, None], other.top)
+        width = np.minimum(self.right[:, None], other.right[None, :]) - np.maximum(self.left[:, None], other.left)
+        intersection = np.clip(height, 0, None).astype(np.int64) * np.clip(width, 0, None)
+        union = self.get_area()[:, None] + other.get_area()[None, :] - intersection
+
+        return intersection / np.maximum(union, 1)
+
+    def distance_to_points(self, points) -> np.ndarray:
+        """
+        Return a (P, N) float64 matrix of distances from each of the P points, given as a (P, 2) array, to each
+        rectangle. Points inside a rectangle, or on its edge, are at distance zero.
+        """
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        point_0 = points[:, 0:1]
+        point_1 = points[:, 1:2]
+
+        dx = np.maximum(np.maximum(self.left[None, :] - point_0, 0), point_0 - self.right[None, :])
+        dy = np.maximum(np.maximum(self.top[None, :] - point_1, 0), point_1 - self.bottom[None, :])
+
+        return np.sqrt((dx * dx + dy * dy).astype(np.float64))
+
+    def distance_to_point(self, point: tuple) -> np.ndarray:
+        """
+        Return the distance from the point to every rectangle, as in Rectangle.distance_to_point.
+        """
+        return self.distance_to_points([point])[0]
+
+    def contains_points(self, points) -> np.ndarray:
+        """
+        Return a (P, N) boolean matrix telling whether each point lies within each rectangle.
+        """
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        point_0 = points[:, 0:1]
+        point_1 = points[:, 1:2]
+
+        return (
+                (self.left[None, :] <= point_0)
+                & (point_0 <= self.right[None, :])
+                & (self.top[None, :] <= point_1)
+                & (point_1 <= self.bottom[None, :])
+        )
+
+    def contains_point(self, point: tuple) -> np.ndarray:
+        """
+        Return whether the point lies within each rectangle, as in Rectangle.contains_point.
+        """
+        return self.contains_points([point])[0]
+
+    def __str__(self):
+        return "RectArray({0} rects)".format(len(self))
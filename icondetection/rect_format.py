@@ -0,0 +1,190 @@
+import struct
+
+import numpy as np
+from typing import List, NamedTuple
+
+from icondetection.rect_array import RectArray
+from icondetection.rectangle import Rectangle
+
+# A rect file is this header followed by its sections, each a little endian int32 array:
+#
+#   rects       (rect_count, 4)   x, y, width and height of every rect, in CV representation
+#   labels      (rect_count,)     component label of every rect, when FLAG_LABELS is set
+#   hierarchy   (rect_count, 4)   next, previous, first child and parent, as from cv.findContours, when FLAG_HIERARCHY
+#   index       (image_count + 1) offsets of the rects of every image, when FLAG_INDEX is set
+#
+# The header holds the magic, the format version, the flags and the rect and image counts. Although the counts are
+# 64 bit, the index and hierarchy refer to rects as int32, so a file holds at most MAX_RECTS rects.
+HEADER = struct.Struct("<4sHHQQ")
+MAGIC = b"ICRS"
+VERSION = 1
+
+FLAG_LABELS = 1
+FLAG_HIERARCHY = 2
+FLAG_INDEX = 4
+
+_DTYPE = np.dtype("<i4")
+
+MAX_RECTS = np.iinfo(_DTYPE).max
+
+
+class RectSet(NamedTuple):
+    """
+    The sections of a rect file. Arrays read from a file or buffer are views of it, so they are read only.
+    """
+
+    rects: np.ndarray
+    labels: np.ndarray = None
+    hierarchy: np.ndarray = None
+    index: np.ndarray = None
+
+    @property
+    def image_count(self) -> int:
+        """
+        The number of images, one when there is no index.
+        """
+        return 1 if self.index is None else len(self.index) - 1
+
+    def image_rects(self, image: int) -> np.ndarray:
+        """
+        The rects of one image of the index.
+        """
+        if self.index is None:
+            if image != 0:
+                raise IndexError("a rect set without index holds a single image")
+            return self.rects
+
+        return self.rects[self.index[image]:self.index[image + 1]]
+
+    def to_list(self, image: int = None) -> List[tuple]:
+        """
+        The rects, or those of one image, as a list of tuples in CV representation, as returned by group_rects.
+        """
+        rects = self.rects if image is None else self.image_rects(image)
+        return [tuple(rect) for rect in rects.tolist()]
+
+    def to_rect_array(self, image: int = None) -> RectArray:
+        """
+        The rects, or those of one image, as a RectArray.
+        """
+        return RectArray.from_cv(self.rects if image is None else self.image_rects(image))
+
+    def to_rectangles(self, image: int = None) -> List[Rectangle]:
+        """
+        The rects, or those of one image, converted with Rectangle.rect_cv_to_cartesian.
+        """
+        return [Rectangle.rect_cv_to_cartesian(rect) for rect in self.to_list(image)]
+
+
+def _section(values, shape: tuple, name: str) -> np.ndarray:
+    values = np.asarray(values)
+    if values.size > 0 and (values.min() < np.iinfo(np.int32).min or values.max() > np.iinfo(np.int32).max):
+        raise ValueError("{0} do not fit in int32".format(name))
+
+    values = np.ascontiguousarray(values, dtype=_DTYPE)
+    try:
+        return values.reshape(shape)
+    except ValueError:
+        raise ValueError("{0} hold {1} values, which do not fit the shape {2}".format(name, values.size, shape))
+
+
+def index_from_counts(counts) -> np.ndarray:
+    """
+    Build an index section from the number of rects of every image.
+    """
+    index = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=index[1:])
+
+    return index
+
+
+def to_bytes(rects, labels=None, hierarchy=None, index=None) -> bytes:
+    """
+    Encode rects, given in CV representation as an (N, 4) array, a list of tuples or a RectArray, along with the
+    optional sections, as a rect file of at most MAX_RECTS rects.
+    """
+    if isinstance(rects, RectArray):
+        rects = rects.to_cv()
+    rects = np.asarray(rects)
+    if rects.size // 4 > MAX_RECTS:
+        raise ValueError("a rect file holds at most {0} rects, got {1}".format(MAX_RECTS, rects.size // 4))
+    rects = _section(rects, (-1, 4), "rects")
+    count = len(rects)
+
+    flags = 0
+    sections = [rects]
+    if labels is not None:
+        flags |= FLAG_LABELS
+        sections.append(_section(labels, (count,), "labels"))
+    if hierarchy is not None:
+        flags |= FLAG_HIERARCHY
+        sections.append(_section(hierarchy, (count, 4), "hierarchy"))
+
+    image_count = 0
+    if index is not None:
+        index = _section(index, (-1,), "index")
+        if len(index) == 0 or index[0] != 0 or index[-1] != count or (np.diff(index) < 0).any():
+            raise ValueError("index must rise from 0 to the number of rects")
+        flags |= FLAG_INDEX
+        image_count = len(index) - 1
+        sections.append(index)
+
+    return HEADER.pack(MAGIC, VERSION, flags, count, image_count) + b"".join(
+        section.tobytes() for section in sections
+    )
+
+
+def from_bytes(buffer) -> RectSet:
+    """
+    Decode a rect file held in any object supporting the buffer protocol, without copying its sections.
+    """
+    size = memoryview(buffer).nbytes
+    if size < HEADER.size:
+        raise ValueError("a rect file needs at least {0} bytes, got {1}".format(HEADER.size, size))
+
+    magic, version, flags, count, image_count = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("not a rect file")
+    if version != VERSION:
+        raise ValueError("unsupported rect file version {0}".format(version))
+
+    shapes = [("rects", (count, 4))]
+    if flags & FLAG_LABELS:
+        shapes.append(("labels", (count,)))
+    if flags & FLAG_HIERARCHY:
+        shapes.append(("hierarchy", (count, 4)))
+    if flags & FLAG_INDEX:
+        shapes.append(("index", (image_count + 1,)))
+
+    needed = HEADER.size + sum(int(np.prod(shape)) for _, shape in shapes) * _DTYPE.itemsize
+    if size < needed:
+        raise ValueError("the rect file is truncated: {0} bytes, expected {1}".format(size, needed))
+
+    sections = {}
+    offset = HEADER.size
+    for name, shape in shapes:
+        length = int(np.prod(shape))
+        sections[name] = np.frombuffer(buffer, dtype=_DTYPE, count=length, offset=offset).reshape(shape)
+        offset += length * _DTYPE.itemsize
+
+    return RectSet(**sections)
+
+
+def write_rects(path: str, rects, labels=None, hierarchy=None, index=None) -> None:
+    """
+    Write rects and the optional sections to a rect file, see to_bytes.
+    """
+    with open(path, "wb") as rect_file:
+        rect_file.write(to_bytes(rects, labels, hierarchy, index))
+
+
+def load_rects(path: str, mmap: bool = True) -> RectSet:
+    """
+    Read a rect file. With mmap the file is mapped read only and its sections are views of the mapping, so pages are
+    only read as they are touched; otherwise it is read into memory.
+    """
+    if mmap:
+        return from_bytes(np.memmap(path, dtype=np.uint8, mode="r"))
+
+    with open(path, "rb") as rect_file:
+        return from_bytes(rect_file.read())
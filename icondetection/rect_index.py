@@ -0,0 +1,258 @@
+import heapq
+import math
+
+from typing import List, Tuple
+
+from icondetection.rectangle import Rectangle
+
+
+class _Node:
+    """
+    A node of the packed R-tree. Leaves hold (index, Rectangle) entries, inner nodes hold child nodes.
+    Every node remembers its bounding box and the smallest entry index found beneath it, which is
+    what makes tie-breaking deterministic.
+    """
+
+    __slots__ = ("top", "left", "bottom", "right", "min_index", "children", "entries")
+
+    def __init__(self, children=None, entries=None):
+        self.children = children
+        self.entries = entries
+
+        if entries is not None:
+            rects = [entry[1] for entry in entries]
+            self.min_index = min(entry[0] for entry in entries)
+        else:
+            rects = children
+            self.min_index = min(child.min_index for child in children)
+
+        self.top = min(rect.top for rect in rects)
+        self.left = min(rect.left for rect in rects)
+        self.bottom = max(rect.bottom for rect in rects)
+        self.right = max(rect.right for rect in rects)
+
+    def contains_point(self, point: Tuple[int, int]) -> bool:
+        return self.left <= point[0] <= self.right and self.top <= point[1] <= self.bottom
+
+    def distance_to_point(self, point: Tuple[int, int]) -> float:
+        """
+        Lower bound of the distance from any rectangle under this node to the point. Uses the same formula as
+        Rectangle.distance_to_point so that bounds and exact distances compare consistently.
+        """
+        dx = max(self.left - point[0], 0, point[0] - self.right)
+        dy = max(self.top - point[1], 0, point[1] - self.bottom)
+
+        if dx == 0 and dy == 0:
+            return 0.0
+
+        return math.sqrt(dx ** 2 + dy ** 2)
+
+
+class RectIndex:
+    """
+    Static spatial index over a list of rectangles, bulk loaded with the Sort-Tile-Recursive (STR) algorithm.
+
+    The index is meant to be built once per detection result (for example from the output of box.group_rects) and
+    then queried many times. Queries answer in O(log n) for typical screen layouts, and ties are always broken in
+    favour of the rectangle that appears first in the original list, so the answers match the brute force
+    box.containing_rectangle, box.closest_rectangle and box.candidate_rectangle exactly.
+    """
+
+    def __init__(self, rects: List[Rectangle], node_capacity: int = 16):
+        """
+        Build the index over rects, in Cartesian notation. node_capacity is the fan out of every node.
+        """
+        if node_capacity < 2:
+            raise ValueError("node_capacity must be at least 2, got {0}".format(node_capacity))
+
+        self._rects = list(rects)
+        self._capacity = node_capacity
+        self._root = self._build() if len(self._rects) > 0 else None
+
+    @classmethod
+    def from_cv(cls, cv_rects, node_capacity: int = 16) -> 'RectIndex':
+        """
+        Build the index from rectangles in CV representation, such as the output of box.group_rects.
+        """
+        return cls([Rectangle.rect_cv_to_cartesian(rect) for rect in cv_rects], node_capacity)
+
+    def __len__(self) -> int:
+        return len(self._rects)
+
+    @property
+    def rects(self) -> List[Rectangle]:
+        """
+        The indexed rectangles, in their original order.
+        """
+        return self._rects
+
+    def _build(self) -> _Node:
+        """
+        Pack the leaves by tiling the entries into vertical slices sorted on their centre, then repeat on the
+        resulting nodes until a single root remains.
+        """
+        entries = list(enumerate(self._rects))
+        level = self._pack(entries, lambda entry: entry[1], lambda group: _Node(entries=group))
+
+        while len(level) > 1:
+            level = self._pack(level, lambda node: node, lambda group: _Node(children=group))
+
+        return level[0]
+
+    def _pack(self, items, rect_of, make_node) -> list:
+        capacity = self._capacity
+        node_count = math.ceil(len(items) / capacity)
+        slice_count = math.ceil(math.sqrt(node_count))
+        slice_size = slice_count * capacity
+
+        items = sorted(items, key=lambda item: rect_of(item).left + rect_of(item).right)
+        nodes = []
+        for slice_start in range(0, len(items), slice_size):
+            vertical_slice = sorted(
+                items[slice_start:slice_start + slice_size],
+                key=lambda item: rect_of(item).top + rect_of(item).bottom,
+            )
+            for node_start in range(0, len(vertical_slice), capacity):
+                nodes.append(make_node(vertical_slice[node_start:node_start + capacity]))
+
+        return nodes
+
+    def containing_index(self, query_point: Tuple[int, int]) -> int or None:
+        """
+        Return the index of the first rectangle covering this query point, or None if there is no overlap.
+        """
+        if self._root is None:
+            return None
+
+        best = None
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if (best is not None and node.min_index >= best) or not node.contains_point(query_point):
+                continue
+
+            if node.entries is not None:
+                for index, rect in node.entries:
+                    if (best is None or index < best) and rect.contains_point(query_point):
+                        best = index
+            else:
+                stack.extend(node.children)
+
+        return best
+
+    def _nearest(self, query_point: Tuple[int, int]):
+        """
+        Yield the (distance, index) of every rectangle, closest first and by index among equal distances.
+        """
+        if self._root is None:
+            return
+
+        # best first search; the (distance, index) ordering guarantees entries are popped in the order they sort
+        heap = [(self._root.distance_to_point(query_point), self._root.min_index, 0, self._root)]
+        counter = 1
+        while heap:
+            distance, index, _, item = heapq.heappop(heap)
+            if isinstance(item, Rectangle):
+                yield distance, index
+                continue
+
+            if item.entries is not None:
+                for entry_index, rect in item.entries:
+                    heapq.heappush(heap, (rect.distance_to_point(query_point), entry_index, counter, rect))
+                    counter += 1
+            else:
+                for child in item.children:
+                    heapq.heappush(heap, (child.distance_to_point(query_point), child.min_index, counter, child))
+                    counter += 1
+
+    def closest_index(self, query_point: Tuple[int, int]) -> int:
+        """
+        Return the index of the rectangle closest to this query point. Among rectangles at the same distance the
+        first one in the original list wins.
+        """
+        if self._root is None:
+            raise ValueError("cannot query the closest rectangle of an empty index")
+
+        return next(self._nearest(query_point))[1]
+
+    def nearest_indices(self, query_point: Tuple[int, int], k: int) -> List[int]:
+        """
+        Return the indices of the k rectangles closest to this query point, closest first, or of all of them when
+        there are fewer. Ties are broken as in closest_index.
+        """
+        if k < 0:
+            raise ValueError("k must not be negative, got {0}".format(k))
+
+        indices = []
+        for _, index in self._nearest(query_point):
+            if len(indices) == k:
+                break
+            indices.append(index)
+
+        return indices
+
+    def within_distance_indices(self, query_point: Tuple[int, int], radius: float) -> List[int]:
+        """
+        Return the indices of the rectangles at most radius away from this query point, closest first and by index
+        among equal distances. Rectangles containing the point are at distance zero.
+        """
+        if self._root is None:
+            return []
+
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node.distance_to_point(query_point) > radius:
+                continue
+
+            if node.entries is not None:
+                for index, rect in node.entries:
+                    distance = rect.distance_to_point(query_point)
+                    if distance <= radius:
+                        found.append((distance, index))
+            else:
+                stack.extend(node.children)
+
+        return [index for _, index in sorted(found)]
+
+    def candidate_index(self, query_point: Tuple[int, int]) -> int:
+        """
+        Return the index of the containing rectangle if there is one, otherwise that of the closest rectangle.
+        """
+        index = self.containing_index(query_point)
+        if index is not None:
+            return index
+
+        return self.closest_index(query_point)
+
+    def containing_rectangle(self, query_point: Tuple[int, int]) -> Rectangle or None:
+        """
+        Provide the rectangle that covers this query point. Return None if there is no overlap.
+        """
+        index = self.containing_index(query_point)
+        return None if index is None else self._rects[index]
+
+    def closest_rectangle(self, query_point: Tuple[int, int]) -> Rectangle:
+        """
+        Determine the closest rectangle to this query point.
+        """
+        return self._rects[self.closest_index(query_point)]
+
+    def nearest_rectangles(self, query_point: Tuple[int, int], k: int) -> List[Rectangle]:
+        """
+        Provide the k rectangles closest to this query point, closest first.
+        """
+        return [self._rects[index] for index in self.nearest_indices(query_point, k)]
+
+    def rectangles_within(self, query_point: Tuple[int, int], radius: float) -> List[Rectangle]:
+        """
+        Provide the rectangles at most radius away from this query point, closest first.
+        """
+        return [self._rects[index] for index in self.within_distance_indices(query_point, radius)]
+
+    def candidate_rectangle(self, query_point: Tuple[int, int]) -> Rectangle:
+        """
+        Return the rectangle covering the query point, or the closest rectangle if none covers it.
+        """
+        return self._rects[self.candidate_index(query_point)]
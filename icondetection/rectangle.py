@@ -76,17 +76,17 @@ class Rectangle:
     @staticmethod
     def rect_cv_to_cartesian(rect: Tuple[int, int, int, int]) -> 'Rectangle':
         """
-        Convert a rectangle from CV representation to cartesian coordinates.
+        Convert a rectangle from CV representation, (x, y, width, height), to cartesian coordinates.
         """
-        new_rect = Rectangle(rect[0], rect[1], rect[0] + rect[2], rect[1] + rect[3])
+        new_rect = Rectangle(rect[1], rect[0], rect[1] + rect[3], rect[0] + rect[2])
         return new_rect
 
     @staticmethod
     def rect_cartesian_to_cv(rect: 'Rectangle') -> tuple:
         """
-        Convert rectangle from Cartesian representation back to CV tuple representation
+        Convert rectangle from Cartesian representation back to CV tuple representation, (x, y, width, height).
         """
-        new_rect = (rect.top, rect.left, rect.bottom - rect.top, rect.right - rect.left)
+        new_rect = (rect.left, rect.top, rect.right - rect.left, rect.bottom - rect.top)
         return new_rect
 
     def __eq__(self, other: 'Rectangle') -> bool:
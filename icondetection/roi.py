@@ -0,0 +1,183 @@
+import math
+
+import cv2 as cv
+import numpy as np
+
+from icondetection import instrumentation
+from icondetection.box import (
+    approximate_bounding_rects,
+    canny_edges,
+    contour_bounding_rects,
+    find_contours,
+    grayscale_blur,
+    group_rect_array,
+)
+from icondetection.rect_array import RectArray
+from icondetection.rectangle import Rectangle
+
+
+def touching(rects: RectArray, regions: RectArray) -> np.ndarray:
+    """
+    Return an (N, M) matrix telling whether each rect overlaps or borders each region.
+    """
+    return (
+            (rects.left[:, None] <= regions.right[None, :])
+            & (rects.right[:, None] >= regions.left[None, :])
+            & (rects.top[:, None] <= regions.bottom[None, :])
+            & (rects.bottom[:, None] >= regions.top[None, :])
+    )
+
+
+def merge_touching(regions: RectArray) -> RectArray:
+    """
+    Merge regions that overlap or border each other, until no two of the returned regions do.
+    """
+    while True:
+        grown = RectArray(regions.top - 1, regions.left - 1, regions.bottom + 1, regions.right + 1)
+        _, merged = group_rect_array(grown)
+        merged = RectArray(merged.top + 1, merged.left + 1, merged.bottom - 1, merged.right - 1)
+
+        # the bounds of two separate groups can still overlap, in which case another round is needed
+        if len(merged) == len(regions):
+            return merged
+        regions = merged
+
+
+def clip(regions: RectArray, shape) -> RectArray:
+    """
+    Clip regions to the bounds of an image of the given shape.
+    """
+    return RectArray(
+        np.clip(regions.top, 0, shape[0]),
+        np.clip(regions.left, 0, shape[1]),
+        np.clip(regions.bottom, 0, shape[0]),
+        np.clip(regions.right, 0, shape[1]),
+    )
+
+
+def translate(rects: RectArray, dx: int, dy: int) -> RectArray:
+    """
+    Move rects found in a crop back to the coordinates of the full image, where (dx, dy) is the crop's origin.
+    """
+    return RectArray(rects.top + dy, rects.left + dx, rects.bottom + dy, rects.right + dx)
+
+
+def _near_groups(image, top: int, left: int, bottom: int, right: int, min_threshold: int, multiplier: float,
+                 contour_accuracy: int, channel_order: str):
+    """
+    Detect and group rects inside a window of image, in image coordinates. Also returns which groups may differ from
+    the full detection: Canny hysteresis can turn any weak edge reaching a side of the window into an edge through
+    pixels beyond it, so the bounds of such weak edges join the grouping as stand ins and taint their groups.
+    """
+    height, width = image.shape[:2]
+    gray_scale_image = grayscale_blur(image[top:bottom, left:right], channel_order)
+    contours, _ = find_contours(
+        canny_edges(gray_scale_image, min_threshold, multiplier), cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE
+    )
+    _, bound_rect = approximate_bounding_rects(contours, contour_accuracy)
+
+    if top == 0 and left == 0 and bottom == height and right == width:
+        # every side is an image border, so nothing can reach beyond the window
+        _, groups = group_rect_array(RectArray.from_cv(bound_rect))
+        return groups, np.zeros(len(groups), dtype=bool)
+
+    weak_contours, _ = find_contours(
+        canny_edges(gray_scale_image, min_threshold, 1), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE
+    )
+    weak = RectArray.from_cv(contour_bounding_rects(weak_contours))
+    window_height, window_width = gray_scale_image.shape[:2]
+    open_sides = (
+            ((weak.top == 0) & (top > 0))
+            | ((weak.left == 0) & (left > 0))
+            | ((weak.bottom == window_height) & (bottom < height))
+            | ((weak.right == window_width) & (right < width))
+    )
+
+    rects = RectArray.concatenate([RectArray.from_cv(bound_rect), weak[open_sides]])
+    labels, groups = group_rect_array(translate(rects, left, top))
+    tainted = np.zeros(len(groups), dtype=bool)
+    tainted[labels[len(bound_rect):]] = True
+
+    return groups, tainted
+
+
+def _lowest_distances(groups: RectArray, point: tuple, near_top, near_left, near_bottom, near_right) -> np.ndarray:
+    """
+    Return, for every group, the lowest distance to point its full detection could have. A group near a side of the
+    window may go on beyond it, where it can spread along that side too, so its bounds are opened that way.
+    """
+    x, y = point
+    vertical = near_top | near_bottom
+    horizontal = near_left | near_right
+    top = np.where(near_top | horizontal, -np.inf, groups.top)
+    bottom = np.where(near_bottom | horizontal, np.inf, groups.bottom)
+    left = np.where(near_left | vertical, -np.inf, groups.left)
+    right = np.where(near_right | vertical, np.inf, groups.right)
+
+    dx = np.maximum(np.maximum(left - x, 0), x - right)
+    dy = np.maximum(np.maximum(top - y, 0), y - bottom)
+    return np.hypot(dx, dy)
+
+
+def detect_near(image, point: tuple, window: int = 96, growth: float = 2, margin: int = 16,
+                full_frame_ratio: float = 0.25, min_threshold: int = 100, multiplier: float = 2,
+                contour_accuracy: int = 3, channel_order: str = None) -> Rectangle or None:
+    """
+    Return the group that candidate_rectangle would pick for an (x, y) point among the grouped rects of the whole
+    image, or None when the image holds no rects, running detection only inside a window around the point.
+
+    The window starts window pixels wide and grows by growth until the answer is settled. Groups closer than margin
+    to a window side that is not an image border may be cut, or joined to rects beyond the window, so they are not
+    trusted, and neither are groups holding weak edges that reach a side. The answer is settled once the nearest
+    trusted group is closer to the point than the untrusted band along the sides is, and than every untrusted group
+    could be once extended beyond the window, so that nothing beyond the window can beat it. Once the window would
+    cover more than full_frame_ratio of the image, the whole image is detected instead.
+
+    The answer matches a full detection except for ties, which may resolve to another group, and for a group whose
+    rects all lie beyond the window while their chain of overlaps wraps around it, so that its bounds still come
+    close to the point.
+    """
+    height, width = image.shape[:2]
+    x, y = point
+    if not (0 <= x < width and 0 <= y < height):
+        raise ValueError("point {0} lies outside of the {1}x{2} image".format(point, width, height))
+    if growth <= 1:
+        raise ValueError("growth must be greater than 1, got {0}".format(growth))
+
+    half = max(window // 2, 1)
+    while True:
+        top, left = max(y - half, 0), max(x - half, 0)
+        bottom, right = min(y + half + 1, height), min(x + half + 1, width)
+        if (bottom - top) * (right - left) > full_frame_ratio * height * width:
+            top, left, bottom, right = 0, 0, height, width
+        instrumentation.count("detect_near_windows")
+
+        groups, tainted = _near_groups(
+            image, top, left, bottom, right, min_threshold, multiplier, contour_accuracy, channel_order
+        )
+        if top == 0 and left == 0 and bottom == height and right == width:
+            if len(groups) == 0:
+                return None
+            return groups[int(np.argmin(groups.distance_to_point(point)))]
+
+        # sides lying on an image border cannot cut anything, so they never make a group untrusted
+        near_top = (groups.top - top < margin) & (top > 0)
+        near_left = (groups.left - left < margin) & (left > 0)
+        near_bottom = (bottom - groups.bottom < margin) & (bottom < height)
+        near_right = (right - groups.right < margin) & (right < width)
+        untrusted = tainted | near_top | near_left | near_bottom | near_right
+        if not untrusted.all():
+            distances = groups.distance_to_point(point)
+            best = np.flatnonzero(~untrusted)[np.argmin(distances[~untrusted])]
+            reach = min(
+                y - top - margin if top > 0 else np.inf,
+                x - left - margin if left > 0 else np.inf,
+                bottom - 1 - y - margin if bottom < height else np.inf,
+                right - 1 - x - margin if right < width else np.inf,
+            )
+            if distances[best] < reach and (_lowest_distances(groups, point, near_top, near_left, near_bottom,
+                                                              near_right)[untrusted] > distances[best]).all():
+                return groups[int(best)]
+
+        # rounding down would keep a small window at the same size for growths close to 1
+        half = max(half + 1, math.ceil(half * growth))
@@ -0,0 +1,471 @@
+import asyncio
+import json
+import socket
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+from typing import List
+
+from icondetection.box import candidate_rectangles, channel_order_of, detect_rects
+from icondetection.cache import DetectionCache
+from icondetection.ingest import attach_shared_memory, from_buffer, from_shared_memory
+from icondetection.rect_array import RectArray
+from icondetection.rect_format import from_bytes, to_bytes
+
+# every message is this header, a JSON document and a binary payload: the lengths of the JSON and of the payload
+_HEADER = struct.Struct(">II")
+
+# number of recent requests the latency percentiles are computed over
+_LATENCY_WINDOW = 1024
+
+# largest JSON document a message may carry, in bytes
+_MAX_BODY = 1 << 24
+
+
+def _encode_message(document: dict, payload_length: int = 0) -> bytes:
+    """
+    Encode the header and JSON document of a message. The payload follows them on the stream.
+    """
+    body = json.dumps(document).encode()
+    return _HEADER.pack(len(body), payload_length) + body
+
+
+async def _read_message(reader: asyncio.StreamReader, max_payload: int):
+    """
+    Read one message from a stream, returning its JSON document and payload, or None at the end of the stream.
+    Raises asyncio.IncompleteReadError when the stream ends within a message, and ValueError for a message that is
+    too large or whose document is not a JSON object.
+    """
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+
+    body_length, payload_length = _HEADER.unpack(header)
+    if body_length > _MAX_BODY:
+        raise ValueError("a document of {0} bytes exceeds the limit of {1}".format(body_length, _MAX_BODY))
+    if payload_length > max_payload:
+        raise ValueError("a payload of {0} bytes exceeds the limit of {1}".format(payload_length, max_payload))
+
+    body = await reader.readexactly(body_length)
+    payload = await reader.readexactly(payload_length)
+    document = json.loads(body)
+    if not isinstance(document, dict):
+        raise ValueError("a message must hold a JSON object, got {0}".format(type(document).__name__))
+
+    return document, payload
+
+
+def _error_response(exception: Exception) -> dict:
+    return {"error": "{0}: {1}".format(type(exception).__name__, exception)}
+
+
+class _Request:
+    """
+    A detect request waiting in the batching queue.
+    """
+
+    def __init__(self, key: str, image, params: dict, future: asyncio.Future, released: asyncio.Future):
+        self.key = key
+        self.image = image
+        self.params = params
+        self.future = future
+        # done once no worker thread reads the image any more, which may be after the requester was cancelled
+        self.released = released
+
+
+class DetectionService:
+    """
+    Long running detection service, listening on a Unix socket or a localhost TCP port, which keeps OpenCV loaded and
+    a DetectionCache warm between requests.
+
+    Clients send messages made of a fixed header, a JSON document and a binary payload (see DetectionClient). A
+    detect request carries an image as encoded file bytes, as raw pixels, or as the name of a shared memory block the
+    pixels are read from in place, optionally with points to answer candidate rectangle queries for. Raw pixels are
+    described by width, height, channel_order, stride and offset, as taken by ingest.from_buffer. With format set to
+    "rects", the rects are sent back as a rect file in the payload (see rect_format) rather than in the JSON.
+    Requests arriving within batch_window seconds of each other are handled as one batch, in which byte identical
+    images are only detected once. A connection sending a payload over max_payload bytes, or a message that cannot be
+    parsed, gets an error and is closed.
+    """
+
+    def __init__(self, cache: DetectionCache = None, max_batch: int = 16, batch_window: float = 0.002,
+                 workers: int = None, max_payload: int = 1 << 30):
+        if max_batch < 1:
+            raise ValueError("max_batch must be positive, got {0}".format(max_batch))
+
+        self.cache = cache if cache is not None else DetectionCache()
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.max_payload = max_payload
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._queue = None
+        self._batcher = None
+        self._server = None
+        # the requests taken off the queue by the batcher and not answered yet
+        self._batch = []
+        self._closed = False
+
+        self.requests = 0
+        self.batches = 0
+        self.detections = 0
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)
+
+    async def start(self, path: str = None, host: str = "127.0.0.1", port: int = 0):
+        """
+        Start listening, on the Unix socket at path when given and on host and port otherwise. Port 0 picks a free
+        port, which can be read from the sockets of the returned server.
+        """
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self._run_batches())
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle_connection, path=path)
+        else:
+            self._server = await asyncio.start_server(self._handle_connection, host=host, port=port)
+
+        return self._server
+
+    async def close(self) -> None:
+        """
+        Stop listening and release the worker threads. Requests still waiting for detection fail, rather than leave
+        their clients waiting for an answer that never comes.
+        """
+        self._closed = True
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._batcher is not None:
+            self._batcher.cancel()
+
+        pending = list(self._batch)
+        while self._queue is not None and not self._queue.empty():
+            request = self._queue.get_nowait()
+            # never handed to a worker, so nothing reads its image
+            request.released.set_result(None)
+            pending.append(request)
+        for request in pending:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("the detection service closed"))
+
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        """
+        Return the request counters, the number of requests waiting to be batched, percentiles of the latency in
+        seconds over the most recent requests, and the cache counters.
+        """
+        latencies = np.asarray(self._latencies, dtype=np.float64)
+        percentiles = {}
+        if len(latencies) > 0:
+            percentiles = {
+                "p{0}".format(q): float(value)
+                for q, value in zip((50, 90, 99), np.percentile(latencies, (50, 90, 99)))
+            }
+            percentiles["mean"] = float(latencies.mean())
+
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "requests": self.requests,
+            "batches": self.batches,
+            "detections": self.detections,
+            "latency": percentiles,
+            "cache": self.cache.stats(),
+        }
+
+    async def detect(self, image, points=None, min_threshold: int = 100, multiplier: float = 2,
+                     contour_accuracy: int = 3, channel_order: str = None) -> dict:
+        """
+        Detect the grouped rects of an image through the batching queue. When points are given, also return for each
+        one the index of its candidate rectangle among the rects and the distance to it.
+        """
+        return await self._detect(image, points, [], min_threshold, multiplier, contour_accuracy, channel_order)
+
+    async def _detect(self, image, points, holds: list, min_threshold: int = 100, multiplier: float = 2,
+                      contour_accuracy: int = 3, channel_order: str = None) -> dict:
+        """
+        detect, appending to holds a future for every piece of work reading the image. They are only done once no
+        worker thread reads the image any more, which, should this coroutine be cancelled, may well be after it
+        returned.
+        """
+        loop = asyncio.get_running_loop()
+        params = {
+            "min_threshold": min_threshold,
+            "multiplier": multiplier,
+            "contour_accuracy": contour_accuracy,
+            "channel_order": channel_order,
+        }
+
+        keyed = loop.create_future()
+        holds.append(keyed)
+
+        def compute_key() -> str:
+            try:
+                return self.cache.key(image, **params)
+            finally:
+                loop.call_soon_threadsafe(keyed.set_result, None)
+
+        key = await loop.run_in_executor(self._executor, compute_key)
+
+        if self._closed:
+            raise RuntimeError("the detection service closed")
+
+        future = loop.create_future()
+        released = loop.create_future()
+        holds.append(released)
+        await self._queue.put(_Request(key, image, params, future, released))
+        grouped_rects = await future
+
+        response = {"rects": [list(rect) for rect in grouped_rects]}
+        if points is not None:
+            response["candidates"] = self._candidates(grouped_rects, points)
+
+        return response
+
+    @staticmethod
+    def _candidates(grouped_rects: List[tuple], points) -> list:
+        if len(grouped_rects) == 0:
+            return [None] * len(points)
+
+        indices, distances = candidate_rectangles(RectArray.from_cv(grouped_rects), points)
+        return [{"index": int(index), "distance": float(distance)} for index, distance in zip(indices, distances)]
+
+    async def _run_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self._batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.batches += 1
+            await self._run_batch(batch)
+            self._batch = []
+
+    async def _run_batch(self, batch: List[_Request]) -> None:
+        loop = asyncio.get_running_loop()
+
+        # requests for the same image and parameters share one detection
+        by_key = {}
+        for request in batch:
+            if request.future.done():
+                # cancelled while waiting, so there is no one left to detect for
+                request.image = None
+                request.released.set_result(None)
+                continue
+            by_key.setdefault(request.key, []).append(request)
+
+        def run(key: str, request: _Request):
+            grouped_rects = self.cache.get(key)
+            if grouped_rects is not None:
+                return grouped_rects, False
+
+            grouped_rects = detect_rects(request.image, **request.params)
+            self.cache.put(key, grouped_rects)
+            return grouped_rects, True
+
+        outcomes = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, run, key, requests[0]) for key, requests in by_key.items()),
+            return_exceptions=True,
+        )
+        for requests, outcome in zip(by_key.values(), outcomes):
+            if not isinstance(outcome, BaseException):
+                # counted here on the event loop, as worker threads would race on the counter
+                outcome, detected = outcome
+                self.detections += int(detected)
+
+            for request in requests:
+                # the image may be a view of a shared memory block, which cannot be released while it is referenced
+                request.image = None
+                request.released.set_result(None)
+                if request.future.done():
+                    continue
+                if isinstance(outcome, BaseException):
+                    request.future.set_exception(outcome)
+                else:
+                    request.future.set_result(outcome)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    message = await _read_message(reader, self.max_payload)
+                except asyncio.IncompleteReadError:
+                    # the client went away within a message
+                    break
+                except ValueError as exception:
+                    # an oversized message is left unread, so where the next one starts is unknown
+                    writer.write(_encode_message(_error_response(exception)))
+                    await writer.drain()
+                    break
+                if message is None:
+                    break
+
+                start = time.perf_counter()
+                payload = b""
+                try:
+                    response = await self._handle_request(*message)
+                    if message[0].get("format") == "rects" and "rects" in response:
+                        payload = to_bytes(response.pop("rects"))
+                except Exception as exception:
+                    response = _error_response(exception)
+                self._latencies.append(time.perf_counter() - start)
+
+                writer.write(_encode_message(response, len(payload)))
+                if payload:
+                    writer.write(payload)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, document: dict, payload: bytes) -> dict:
+        operation = document.get("op")
+        if operation == "stats":
+            return self.stats()
+        if operation != "detect":
+            raise ValueError("unknown operation {0!r}".format(operation))
+
+        self.requests += 1
+        params = {
+            name: document[name]
+            for name in ("min_threshold", "multiplier", "contour_accuracy", "channel_order")
+            if name in document
+        }
+        points = document.get("points")
+        layout = {name: document[name] for name in ("channel_order", "stride", "offset") if name in document}
+
+        if "shm" in document:
+            # the pixels are read in place, so the block stays attached until detection is done with them, even when
+            # this request is cancelled while a worker thread still reads them
+            block = attach_shared_memory(document["shm"])
+            holds = []
+            image = None
+            try:
+                image = from_shared_memory(block, document["width"], document["height"], **layout)
+                return await self._detect(image, points, holds, **params)
+            finally:
+                del image
+                self._close_when_released(block, holds)
+
+        if "width" in document:
+            image = from_buffer(payload, document["width"], document["height"], **layout)
+        else:
+            image = cv.imdecode(np.frombuffer(payload, dtype=np.uint8), cv.IMREAD_COLOR)
+            if image is None:
+                raise ValueError("payload could not be decoded as an image")
+
+        return await self.detect(image, points, **params)
+
+    @staticmethod
+    def _close_when_released(block, holds: list) -> None:
+        """
+        Close a shared memory block once every future in holds is done.
+        """
+        pending = [hold for hold in holds if not hold.done()]
+        if len(pending) == 0:
+            block.close()
+            return
+
+        asyncio.gather(*pending).add_done_callback(lambda _: block.close())
+
+
+class DetectionClient:
+    """
+    Blocking client for a DetectionService, connecting to its Unix socket at path or to host and port.
+    """
+
+    def __init__(self, path: str = None, host: str = "127.0.0.1", port: int = None, timeout: float = None):
+        if path is not None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(path)
+        else:
+            self._socket = socket.create_connection((host, port), timeout=timeout)
+
+    def close(self) -> None:
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _receive_exactly(self, size: int) -> bytes:
+        chunks = []
+        while size > 0:
+            chunk = self._socket.recv(size)
+            if not chunk:
+                raise ConnectionError("the service closed the connection")
+            chunks.append(chunk)
+            size -= len(chunk)
+
+        return b"".join(chunks)
+
+    def request(self, document: dict, payload=b"") -> dict:
+        """
+        Send one message and wait for the response. payload is any object supporting the buffer protocol. Errors
+        reported by the service are raised as RuntimeError. A rect file sent back in the response payload is decoded
+        into its "rects".
+        """
+        payload = memoryview(payload).cast("B")
+        self._socket.sendall(_encode_message(document, payload.nbytes))
+        if payload.nbytes > 0:
+            self._socket.sendall(payload)
+        body_length, payload_length = _HEADER.unpack(self._receive_exactly(_HEADER.size))
+        response = json.loads(self._receive_exactly(body_length))
+        response_payload = self._receive_exactly(payload_length)
+
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        if payload_length > 0:
+            response["rects"] = from_bytes(response_payload).rects
+
+        return response
+
+    def detect(self, image=None, encoded=None, shm: str = None, width: int = None, height: int = None,
+               channel_order: str = None, stride: int = None, offset: int = 0, points=None, binary: bool = False,
+               **params) -> dict:
+        """
+        Detect the grouped rects of an image, given either as an 8 bit array, as encoded file bytes, or as the name of
+        a shared memory block holding raw pixels laid out as described by width, height, channel_order, stride and
+        offset (see ingest.from_buffer). Returns the response, holding "rects" and, when points are given,
+        "candidates". With binary, the rects travel as a rect file and come back as an (N, 4) int32 array rather
+        than a list of lists.
+        """
+        document = {"op": "detect"}
+        if binary:
+            document["format"] = "rects"
+        document.update(params)
+        if points is not None:
+            document["points"] = [list(map(int, point)) for point in points]
+
+        if shm is not None:
+            document.update(shm=shm, width=width, height=height, channel_order=channel_order or "bgr", offset=offset)
+            if stride is not None:
+                document["stride"] = stride
+            return self.request(document)
+        if encoded is not None:
+            return self.request(document, encoded)
+
+        channel_order = channel_order_of(image, channel_order)
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        document.update(width=image.shape[1], height=image.shape[0], channel_order=channel_order)
+        return self.request(document, image)
+
+    def stats(self) -> dict:
+        """
+        Return the statistics of the service.
+        """
+        return self.request({"op": "stats"})
@@ -0,0 +1,272 @@
+import asyncio
+import os
+import queue
+import threading
+
+import cv2 as cv
+import numpy as np
+from typing import List, NamedTuple
+
+from icondetection.box import (
+    approximate_bounding_rects,
+    canny_edges,
+    find_contours,
+    grayscale_blur,
+    group_rects,
+)
+
+POLICIES = ("block", "drop", "latest")
+
+# how long a blocked stage waits before checking whether the stream was closed
+_POLL_SECONDS = 0.05
+
+# marks the end of the frames
+_END = object()
+
+
+class FrameResult(NamedTuple):
+    """
+    The grouped rects detected on one frame, along with the position of that frame in the input.
+    """
+
+    index: int
+    rects: List[tuple]
+
+
+class _Failure:
+    """
+    An exception raised while processing a frame, carried down the stages to the consumer.
+    """
+
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+def decode_frame(frame):
+    """
+    Turn a frame into a BGR image: arrays are passed through, bytes are decoded as an encoded image file and strings
+    are read as image paths.
+    """
+    if isinstance(frame, np.ndarray):
+        return frame
+
+    if isinstance(frame, (bytes, bytearray, memoryview)):
+        image = cv.imdecode(np.frombuffer(frame, dtype=np.uint8), cv.IMREAD_COLOR)
+    elif isinstance(frame, (str, os.PathLike)):
+        image = cv.imread(os.fspath(frame))
+    else:
+        raise ValueError("cannot decode a frame of type {0}".format(type(frame).__name__))
+
+    if image is None:
+        raise ValueError("frame could not be decoded")
+
+    return image
+
+
+class _StagePipeline:
+    """
+    Decode, grayscale_blur, edge and contour extraction, and group_rects, each running in its own thread and linked
+    by bounded queues. Every stage handles one frame at a time in arrival order, so results leave in input order.
+
+    Only the entrance applies the policy for a full pipeline; between stages a full queue simply blocks the stage
+    before it, which is how a slow consumer pushes back all the way to the source.
+    """
+
+    def __init__(self, policy: str, queue_size: int, decode, min_threshold: int, multiplier: float,
+                 contour_accuracy: int):
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of {0}, got {1!r}".format(", ".join(POLICIES), policy))
+        if queue_size < 1:
+            raise ValueError("queue_size must be positive, got {0}".format(queue_size))
+
+        def extract(gray_scale_image) -> list:
+            edges = canny_edges(gray_scale_image, min_threshold, multiplier)
+            contours, _ = find_contours(edges, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+            return approximate_bounding_rects(contours, contour_accuracy)[1]
+
+        stages = (decode, grayscale_blur, extract, group_rects)
+
+        self.policy = policy
+        self.dropped = 0
+        self._next_index = 0
+        self._stop = threading.Event()
+        self._queues = [queue.Queue(queue_size) for _ in range(len(stages) + 1)]
+        self._threads = [
+            threading.Thread(target=self._run, args=(stage, source, sink), daemon=True)
+            for stage, source, sink in zip(stages, self._queues, self._queues[1:])
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _put(self, sink: queue.Queue, item) -> None:
+        while not self._stop.is_set():
+            try:
+                sink.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, source: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                pass
+
+        return _END
+
+    def _run(self, stage, source: queue.Queue, sink: queue.Queue) -> None:
+        while True:
+            item = self._get(source)
+            if item is _END:
+                self._put(sink, _END)
+                return
+
+            index, payload = item
+            if not isinstance(payload, _Failure):
+                try:
+                    payload = stage(payload)
+                except Exception as exception:
+                    payload = _Failure(exception)
+            self._put(sink, (index, payload))
+
+    def submit(self, frame) -> None:
+        """
+        Hand a frame to the first stage, applying the policy when it is busy: block waits for room, drop discards this
+        frame and latest discards the oldest frame still waiting.
+        """
+        item = (self._next_index, frame)
+        self._next_index += 1
+        entrance = self._queues[0]
+
+        if self.policy == "block":
+            self._put(entrance, item)
+            return
+
+        while True:
+            try:
+                entrance.put_nowait(item)
+                return
+            except queue.Full:
+                if self.policy == "drop":
+                    self.dropped += 1
+                    return
+
+            try:
+                entrance.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+    def fail(self, exception: BaseException) -> None:
+        """
+        Pass an error raised by the source on to the consumer, after the frames already submitted.
+        """
+        self._put(self._queues[0], (self._next_index, _Failure(exception)))
+
+    def close(self) -> None:
+        """
+        Signal that no more frames will be submitted.
+        """
+        self._put(self._queues[0], _END)
+
+    def feed(self, frames) -> None:
+        """
+        Submit every frame of an iterable, then close the pipeline.
+        """
+        try:
+            for frame in frames:
+                if self._stop.is_set():
+                    return
+                self.submit(frame)
+        except Exception as exception:
+            self.fail(exception)
+        finally:
+            self.close()
+
+    def result(self) -> FrameResult or None:
+        """
+        Wait for the next result, returning None once every frame has been processed. Errors are raised here.
+        """
+        item = self._get(self._queues[-1])
+        if item is _END:
+            return None
+
+        index, payload = item
+        if isinstance(payload, _Failure):
+            raise payload.exception
+
+        return FrameResult(index, payload)
+
+    def stop(self) -> None:
+        """
+        Make every stage return, abandoning frames in flight.
+        """
+        self._stop.set()
+
+
+def detect_stream(frames, policy: str = "block", queue_size: int = 2, decode=decode_frame, min_threshold: int = 100,
+                  multiplier: float = 2, contour_accuracy: int = 3):
+    """
+    Detect the grouped rects of every frame of an iterable, yielding a FrameResult per frame in input order. Frames
+    can be BGR images, encoded image bytes or paths, or anything decode turns into a BGR image.
+
+    Decoding, grayscale_blur, edge and contour extraction, and grouping run in separate threads, so consecutive frames
+    overlap. Each stage holds at most queue_size frames waiting. When they fill up because the consumer falls behind,
+    policy decides what happens to new frames: "block" stops reading frames until there is room, "drop" skips new
+    frames and "latest" replaces the oldest waiting frame with the new one. Skipped frames leave a gap in the indices.
+    """
+    if hasattr(frames, "__aiter__"):
+        raise TypeError("detect_stream takes a plain iterable, use detect_stream_async for async iterables")
+
+    pipeline = _StagePipeline(policy, queue_size, decode, min_threshold, multiplier, contour_accuracy)
+    threading.Thread(target=pipeline.feed, args=(frames,), daemon=True).start()
+
+    try:
+        while True:
+            result = pipeline.result()
+            if result is None:
+                return
+            yield result
+    finally:
+        pipeline.stop()
+
+
+async def detect_stream_async(frames, policy: str = "block", queue_size: int = 2, decode=decode_frame,
+                              min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3):
+    """
+    Asynchronous version of detect_stream, taking an iterable or an async iterable of frames. Waiting on the
+    pipeline, and reading every frame of a plain iterable, which is typically a blocking capture, happens in the
+    default executor, so the event loop is never blocked.
+    """
+    loop = asyncio.get_running_loop()
+    pipeline = _StagePipeline(policy, queue_size, decode, min_threshold, multiplier, contour_accuracy)
+
+    async def feed() -> None:
+        try:
+            if hasattr(frames, "__aiter__"):
+                async for frame in frames:
+                    await loop.run_in_executor(None, pipeline.submit, frame)
+            else:
+                iterator = iter(frames)
+                end = object()
+                while True:
+                    frame = await loop.run_in_executor(None, next, iterator, end)
+                    if frame is end:
+                        break
+                    await loop.run_in_executor(None, pipeline.submit, frame)
+        except Exception as exception:
+            await loop.run_in_executor(None, pipeline.fail, exception)
+        finally:
+            await loop.run_in_executor(None, pipeline.close)
+
+    feeder = asyncio.ensure_future(feed())
+    try:
+        while True:
+            result = await loop.run_in_executor(None, pipeline.result)
+            if result is None:
+                return
+            yield result
+    finally:
+        pipeline.stop()
+        feeder.cancel()
@@ -0,0 +1,232 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+from typing import List
+
+from icondetection.box import (
+    approximate_bounding_rects,
+    canny_edges,
+    find_contours,
+    grayscale_blur,
+    group_rects,
+)
+from icondetection.rect_array import RectArray
+from icondetection.roi import merge_touching, translate
+
+# pixels next to a cut edge of a tile whose gradient is unreliable: one for the blur, one for Sobel and one for
+# non-maximum suppression
+_GUARD = 3
+
+
+def _seam_mask(lines, low, high) -> np.ndarray:
+    """
+    Return which of the spans [low, high) include a pixel on either side of one of the seam lines.
+    """
+    mask = np.zeros(len(low), dtype=bool)
+    for line in lines:
+        mask |= (low <= line) & (high >= line)
+
+    return mask
+
+
+def _extract(edges, left: int, top: int, contour_accuracy: int):
+    """
+    Extract contours from an edge map whose origin is (left, top). Returns the bounding rects of their approximated
+    polygons, which are the output, and of the contours themselves, which tell whether a contour reaches a seam.
+    """
+    contours, _ = find_contours(np.ascontiguousarray(edges), cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+    _, bound_rect = approximate_bounding_rects(contours, contour_accuracy)
+    contour_rect = [cv.boundingRect(contour) for contour in contours]
+
+    return (
+        translate(RectArray.from_cv(bound_rect), left, top),
+        translate(RectArray.from_cv(contour_rect), left, top),
+    )
+
+
+class _Tile:
+    """
+    One cell of the tile grid: the core it is responsible for, and the halo read around it for context.
+    """
+
+    def __init__(self, top: int, left: int, bottom: int, right: int, halo: int, shape):
+        self.top = top
+        self.left = left
+        self.bottom = bottom
+        self.right = right
+        self.read_top = max(top - halo, 0)
+        self.read_left = max(left - halo, 0)
+        self.read_bottom = min(bottom + halo, shape[0])
+        self.read_right = min(right + halo, shape[1])
+
+        # the part of the read area whose gradient matches the full image
+        self.valid_top = self.read_top + (_GUARD if self.read_top > 0 else 0)
+        self.valid_left = self.read_left + (_GUARD if self.read_left > 0 else 0)
+        self.valid_bottom = self.read_bottom - (_GUARD if self.read_bottom < shape[0] else 0)
+        self.valid_right = self.read_right - (_GUARD if self.read_right < shape[1] else 0)
+
+    def edges(self, image, min_threshold: int, multiplier: float):
+        """
+        Run Canny over the tile, resolving hysteresis only as far as the tile can see. Returns the edges of the core
+        along with the weak edge pixels whose fate depends on what lies beyond the tile.
+
+        A weak component (of the map Canny gives with both thresholds at min_threshold) that stays clear of the cut
+        sides of the valid area is whole, so the tile's own Canny is exact for it. A component reaching a cut side is
+        an edge if it holds a strong pixel, and otherwise undecided.
+        """
+        gray = grayscale_blur(image[self.read_top:self.read_bottom, self.read_left:self.read_right])
+        top = self.valid_top - self.read_top
+        left = self.valid_left - self.read_left
+        bottom = self.valid_bottom - self.read_top
+        right = self.valid_right - self.read_left
+        strong_threshold = int(min_threshold * multiplier)
+
+        edges = canny_edges(gray, min_threshold, multiplier)[top:bottom, left:right] > 0
+        weak = np.ascontiguousarray(canny_edges(gray, min_threshold, 1)[top:bottom, left:right])
+        undecided = np.zeros(weak.shape, dtype=bool)
+
+        height, width = weak.shape
+        seeds = []
+        if self.valid_top > 0:
+            seeds.extend((x, 0) for x in np.flatnonzero(weak[0]).tolist())
+        if self.valid_bottom < image.shape[0]:
+            seeds.extend((x, height - 1) for x in np.flatnonzero(weak[-1]).tolist())
+        if self.valid_left > 0:
+            seeds.extend((0, y) for y in np.flatnonzero(weak[:, 0]).tolist())
+        if self.valid_right < image.shape[1]:
+            seeds.extend((width - 1, y) for y in np.flatnonzero(weak[:, -1]).tolist())
+
+        # label each component reaching a cut side in turn, marking it done afterwards
+        for x, y in seeds:
+            if weak[y, x] != 255:
+                continue
+            _, _, _, (rect_x, rect_y, rect_w, rect_h) = cv.floodFill(weak, None, (x, y), 128, 0, 0, 8)
+            window = (slice(rect_y, rect_y + rect_h), slice(rect_x, rect_x + rect_w))
+            component = weak[window] == 128
+            weak[window][component] = 64
+
+            # the guard band keeps Canny exact on a crop reaching three pixels past the component
+            crop_top = max(rect_y + top - _GUARD, 0)
+            crop_left = max(rect_x + left - _GUARD, 0)
+            strong = canny_edges(
+                gray[crop_top:rect_y + rect_h + top + _GUARD, crop_left:rect_x + rect_w + left + _GUARD],
+                strong_threshold, 1,
+            )
+            strong = strong[rect_y + top - crop_top:, rect_x + left - crop_left:][:rect_h, :rect_w]
+            is_edge = bool(strong[component].any())
+
+            edges[window][component] = is_edge
+            undecided[window][component] = not is_edge
+
+        core = (
+            slice(self.top - self.valid_top, self.bottom - self.valid_top),
+            slice(self.left - self.valid_left, self.right - self.valid_left),
+        )
+
+        return edges[core], undecided[core]
+
+
+def _resolve_hysteresis(edges, undecided) -> None:
+    """
+    Turn on, in place, every undecided pixel connected to an edge pixel through other undecided pixels. A weak pixel
+    belonging to a true edge only ever has edge or undecided pixels in its weak component, so this completes
+    hysteresis across tile seams exactly.
+    """
+    contours, _ = find_contours(undecided.view(np.uint8), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    boxes = RectArray.from_cv([cv.boundingRect(contour) for contour in contours])
+
+    # one pixel more on every side, so edge pixels right next to an undecided component are seen
+    height, width = edges.shape
+    for region in merge_touching(RectArray(boxes.top - 1, boxes.left - 1, boxes.bottom + 1, boxes.right + 1)):
+        window = (
+            slice(max(region.top, 0), min(region.bottom, height)),
+            slice(max(region.left, 0), min(region.right, width)),
+        )
+        region_edges = edges[window]
+        region_undecided = undecided[window]
+
+        count, labels = cv.connectedComponents((region_edges | region_undecided).view(np.uint8), connectivity=8)
+        is_edge = np.zeros(count, dtype=bool)
+        is_edge[labels[region_edges]] = True
+        is_edge[0] = False
+        region_edges |= region_undecided & is_edge[labels]
+
+
+def tiled_bounding_rects(image, tile_size: int = 1024, halo: int = 16, workers: int = None,
+                         min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3) -> List[tuple]:
+    """
+    Tiled equivalent of grayscale_blur followed by canny_detection, returning the same bounding rects in a different
+    order.
+
+    The image is split into tile_size cores, each read with halo pixels of context. Blur, Canny and contour
+    extraction run per tile in a thread pool, since OpenCV releases the GIL, leaving two small serial steps: Canny
+    hysteresis is completed for the weak edges that cross a seam, and contours cut by a seam are extracted once more
+    from the stitched edge map, over the merged area of their pieces.
+    """
+    if tile_size < 1:
+        raise ValueError("tile_size must be positive, got {0}".format(tile_size))
+    if halo < _GUARD:
+        raise ValueError("halo must be at least {0}, got {1}".format(_GUARD, halo))
+
+    height, width = image.shape[:2]
+    seams_x = list(range(tile_size, width, tile_size))
+    seams_y = list(range(tile_size, height, tile_size))
+    tiles = [
+        _Tile(top, left, min(top + tile_size, height), min(left + tile_size, width), halo, image.shape)
+        for top in range(0, height, tile_size)
+        for left in range(0, width, tile_size)
+    ]
+
+    edges = np.zeros((height, width), dtype=bool)
+    undecided = np.zeros((height, width), dtype=bool)
+
+    def detect_edges(tile: _Tile) -> None:
+        core = (slice(tile.top, tile.bottom), slice(tile.left, tile.right))
+        edges[core], undecided[core] = tile.edges(image, min_threshold, multiplier)
+
+    def extract(tile: _Tile):
+        return _extract(edge_map[tile.top:tile.bottom, tile.left:tile.right], tile.left, tile.top, contour_accuracy)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(detect_edges, tiles))
+        if undecided.any():
+            _resolve_hysteresis(edges, undecided)
+
+        edge_map = edges.view(np.uint8) * np.uint8(255)
+        results = list(executor.map(extract, tiles))
+
+    found = RectArray.concatenate([result[0] for result in results])
+    extent = RectArray.concatenate([result[1] for result in results])
+
+    # a contour reaching the last pixel before a seam, or the first after it, may have been cut in two
+    on_seam = _seam_mask(seams_x, extent.left, extent.right) | _seam_mask(seams_y, extent.top, extent.bottom)
+    rects = [tuple(rect) for rect in found[~on_seam].to_cv().tolist()]
+    if not on_seam.any():
+        return rects
+
+    # every pixel of a cut contour lies within the pieces set aside, so their merged areas hold whole contours
+    for region in merge_touching(extent[on_seam]):
+        stitched, stitched_extent = _extract(
+            edge_map[region.top:region.bottom, region.left:region.right], region.left, region.top, contour_accuracy
+        )
+
+        # contours clear of every seam were already reported by their own tile
+        crossing = (
+                _seam_mask(seams_x, stitched_extent.left, stitched_extent.right)
+                | _seam_mask(seams_y, stitched_extent.top, stitched_extent.bottom)
+        )
+        rects.extend(tuple(rect) for rect in stitched[crossing].to_cv().tolist())
+
+    return rects
+
+
+def tiled_detect_rects(image, tile_size: int = 1024, halo: int = 16, workers: int = None,
+                       min_threshold: int = 100, multiplier: float = 2, contour_accuracy: int = 3) -> List[tuple]:
+    """
+    Tiled equivalent of box.detect_rects: tiled_bounding_rects followed by group_rects.
+    """
+    return group_rects(tiled_bounding_rects(
+        image, tile_size, halo, workers,
+        min_threshold=min_threshold, multiplier=multiplier, contour_accuracy=contour_accuracy,
+    ))
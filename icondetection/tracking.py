@@ -0,0 +1,272 @@
+import numpy as np
+
+from typing import NamedTuple
+
+from icondetection.rect_array import RectArray
+
+
+class TrackUpdate(NamedTuple):
+    """
+    The outcome of matching one frame's rects against the previous frame. ids holds the id of every rect of the new
+    frame, in its order; added, removed and moved hold the ids that appeared, disappeared, or were matched to a rect
+    with other bounds.
+    """
+
+    ids: np.ndarray
+    added: np.ndarray
+    removed: np.ndarray
+    moved: np.ndarray
+
+
+def exact_matches(previous: np.ndarray, current: np.ndarray):
+    """
+    Pair up identical rows of two (N, 4) arrays, the k-th copy of a row in previous with the k-th copy in current.
+    Returns the matched indices into previous and into current.
+    """
+    rows = np.concatenate([previous, current]).astype(np.int64)
+    if len(rows) > 0 and rows.min() >= 0 and rows.max() < 1 << 16:
+        # screen coordinates fit in 16 bits, so a whole rect packs into one integer, which sorts far faster
+        packed = (rows[:, 0] << 48) | (rows[:, 1] << 32) | (rows[:, 2] << 16) | rows[:, 3]
+        order = np.argsort(packed)
+        sorted_packed = packed[order]
+        first_copies = np.r_[True, sorted_packed[1:] != sorted_packed[:-1]]
+    else:
+        order = np.lexsort(rows.T[::-1])
+        sorted_rows = rows[order]
+        first_copies = np.r_[True, (sorted_rows[1:] != sorted_rows[:-1]).any(axis=1)]
+    keys = np.empty(len(rows), dtype=np.int64)
+    keys[order] = np.cumsum(first_copies) - 1
+
+    def occurrences(part_keys: np.ndarray) -> np.ndarray:
+        # number every copy of a row, so duplicates pair up in order rather than all with the first
+        order = np.argsort(part_keys, kind="stable")
+        sorted_keys = part_keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        ranks = np.empty(len(part_keys), dtype=np.int64)
+        ranks[order] = np.arange(len(part_keys)) - np.repeat(starts, np.diff(np.r_[starts, len(part_keys)]))
+        return part_keys * len(rows) + ranks
+
+    _, previous_indices, current_indices = np.intersect1d(
+        occurrences(keys[:len(previous)]), occurrences(keys[len(previous):]), assume_unique=True, return_indices=True
+    )
+
+    return previous_indices, current_indices
+
+
+def greedy_assignment(scores: np.ndarray, rows: np.ndarray, columns: np.ndarray, descending: bool = True):
+    """
+    Assign rows to columns given the scores of candidate (row, column) pairs, taking pairs best score first and
+    skipping any whose row or column is already taken. Ties go to the lowest row, then the lowest column. Returns the
+    assigned rows and columns, in the order they were taken.
+
+    A pair coming before every other remaining pair of its row and of its column is taken whatever happens to the
+    pairs before it, so rather than visiting pairs one by one, every round takes all such pairs at once and drops the
+    pairs they conflict with. Only chains of conflicting pairs need further rounds.
+    """
+    order = np.lexsort((columns, rows, -scores if descending else scores))
+    rows, columns = np.asarray(rows)[order], np.asarray(columns)[order]
+    row_count = int(rows.max()) + 1 if len(rows) > 0 else 0
+    column_count = int(columns.max()) + 1 if len(columns) > 0 else 0
+
+    # positions in order of the pairs still open, which stay sorted from round to round
+    remaining = np.arange(len(order))
+    assigned = []
+    while len(remaining) > 0:
+        remaining_rows, remaining_columns = rows[remaining], columns[remaining]
+        ranks = np.arange(len(remaining))
+        first_of_row = np.full(row_count, len(remaining))
+        np.minimum.at(first_of_row, remaining_rows, ranks)
+        first_of_column = np.full(column_count, len(remaining))
+        np.minimum.at(first_of_column, remaining_columns, ranks)
+
+        taken = (first_of_row[remaining_rows] == ranks) & (first_of_column[remaining_columns] == ranks)
+        assigned.append(remaining[taken])
+
+        open_rows = np.ones(row_count, dtype=bool)
+        open_rows[remaining_rows[taken]] = False
+        open_columns = np.ones(column_count, dtype=bool)
+        open_columns[remaining_columns[taken]] = False
+        remaining = remaining[open_rows[remaining_rows] & open_columns[remaining_columns]]
+
+    assigned = np.sort(np.concatenate(assigned)) if len(assigned) > 0 else np.empty(0, dtype=np.int64)
+    return rows[assigned], columns[assigned]
+
+
+def pair_iou(rects: RectArray, others: RectArray) -> np.ndarray:
+    """
+    Return the intersection over union of every rect with the rect at the same position of others.
+    """
+    height = np.minimum(rects.bottom, others.bottom) - np.maximum(rects.top, others.top)
+    width = np.minimum(rects.right, others.right) - np.maximum(rects.left, others.left)
+    intersection = np.clip(height, 0, None).astype(np.int64) * np.clip(width, 0, None)
+    union = rects.get_area() + others.get_area() - intersection
+
+    return intersection / np.maximum(union, 1)
+
+
+class RectTracker:
+    """
+    Tracks detected rects across frames, giving every rect an id that it keeps for as long as it is matched.
+
+    Every update first pairs up rects that did not change at all, which on a mostly static screen is nearly all of
+    them and costs a sort. Only the rest are compared, chunk_size current rects at a time, by intersection over union
+    with the unmatched previous rects overlapping them along x, which a sweep over the rects sorted by left edge
+    finds without building the full matrix. Pairs reaching min_iou are assigned greedily, best first. With
+    max_distance, rects still unmatched are then paired by the distance between their centres, for small icons that
+    moved further than their own size.
+    """
+
+    def __init__(self, min_iou: float = 0.3, max_distance: float = 0, chunk_size: int = 1024):
+        if not 0 < min_iou <= 1:
+            raise ValueError("min_iou must be in (0, 1], got {0}".format(min_iou))
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive, got {0}".format(chunk_size))
+
+        self.min_iou = min_iou
+        self.max_distance = max_distance
+        self.chunk_size = chunk_size
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget every track, so the next update reports all of its rects as added.
+        """
+        self._rects = np.empty((0, 4), dtype=np.int32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._next_id = 0
+
+    @property
+    def rects(self) -> np.ndarray:
+        """
+        The rects of the last frame, as an (N, 4) array in CV representation.
+        """
+        return self._rects
+
+    @property
+    def ids(self) -> np.ndarray:
+        """
+        The ids of the rects of the last frame.
+        """
+        return self._ids
+
+    def _pairs(self, candidates, current_count: int, keep):
+        """
+        Collect the (score, previous index, current index) of every pair keep accepts, taking chunk_size current
+        rects at a time from candidates(start, stop), which returns the previous and current index and the score of
+        every pair worth scoring.
+        """
+        scores, rows, columns = [np.empty(0)], [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for start in range(0, current_count, self.chunk_size):
+            chunk_rows, chunk_columns, chunk_scores = candidates(start, min(start + self.chunk_size, current_count))
+            kept = keep(chunk_scores)
+            scores.append(chunk_scores[kept])
+            rows.append(chunk_rows[kept])
+            columns.append(chunk_columns[kept])
+
+        return np.concatenate(scores), np.concatenate(rows), np.concatenate(columns)
+
+    def _overlap_pairs(self, previous: np.ndarray, current: np.ndarray):
+        previous, current = RectArray.from_cv(previous), RectArray.from_cv(current)
+
+        # only previous rects overlapping a current rect along x can reach min_iou: sorted by left edge, they form
+        # one run per current rect, from the widest previous rect's reach up to the current rect's right edge
+        order = np.argsort(previous.left, kind="stable")
+        ordered = previous[order]
+        widest = int((previous.right - previous.left).max())
+        first = np.searchsorted(ordered.left, current.left - widest, side="right")
+        counts = np.maximum(np.searchsorted(ordered.left, current.right, side="left") - first, 0)
+
+        def candidates(start: int, stop: int):
+            chunk_counts = counts[start:stop]
+            columns = np.repeat(np.arange(start, stop), chunk_counts)
+            # the position of every pair within the run of its current rect
+            offsets = np.arange(len(columns)) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            positions = first[columns] + offsets
+            # pairs that do not overlap at all score 0, so they are dropped before paying for their IoU; the runs are
+            # read from the sorted copy, where they lie next to each other
+            overlapping = (
+                    (ordered.right[positions] > current.left[columns])
+                    & (ordered.top[positions] < current.bottom[columns])
+                    & (ordered.bottom[positions] > current.top[columns])
+            )
+            positions, columns = positions[overlapping], columns[overlapping]
+            return order[positions], columns, pair_iou(ordered[positions], current[columns])
+
+        return self._pairs(candidates, len(current), lambda iou: iou >= self.min_iou)
+
+    def _distance_pairs(self, previous: np.ndarray, current: np.ndarray):
+        previous_centres = previous[:, :2] + previous[:, 2:] / 2
+        current_centres = current[:, :2] + current[:, 2:] / 2
+
+        def distances(start: int, stop: int):
+            offsets = previous_centres[:, None, :] - current_centres[None, start:stop, :]
+            rows, columns = np.indices(offsets.shape[:2])
+            return rows.ravel(), columns.ravel() + start, np.hypot(offsets[..., 0], offsets[..., 1]).ravel()
+
+        return self._pairs(distances, len(current), lambda distance: distance <= self.max_distance)
+
+    def _assign(self, current: np.ndarray, matched_previous: np.ndarray, matched_current: np.ndarray, pairs,
+                descending: bool):
+        """
+        Extend the matches with the pairs found among the rects left unmatched.
+        """
+        previous_left = np.setdiff1d(np.arange(len(self._rects)), matched_previous)
+        current_left = np.setdiff1d(np.arange(len(current)), matched_current)
+        if len(previous_left) == 0 or len(current_left) == 0:
+            return matched_previous, matched_current
+
+        scores, rows, columns = pairs(self._rects[previous_left], current[current_left])
+        rows, columns = greedy_assignment(scores, rows, columns, descending)
+
+        return (
+            np.concatenate([matched_previous, previous_left[rows]]),
+            np.concatenate([matched_current, current_left[columns]]),
+        )
+
+    def _match(self, current: np.ndarray):
+        """
+        Return the matched indices into the previous rects and into current.
+        """
+        if np.array_equal(self._rects, current):
+            everything = np.arange(len(current))
+            return everything, everything
+
+        matched_previous, matched_current = exact_matches(self._rects, current)
+        matched_previous, matched_current = self._assign(
+            current, matched_previous, matched_current, self._overlap_pairs, True
+        )
+        if self.max_distance > 0:
+            matched_previous, matched_current = self._assign(
+                current, matched_previous, matched_current, self._distance_pairs, False
+            )
+
+        return matched_previous, matched_current
+
+    def update(self, rects) -> TrackUpdate:
+        """
+        Match the rects of the next frame, in CV representation such as the output of box.group_rects, against those
+        of the previous one.
+        """
+        current = np.ascontiguousarray(np.asarray(rects, dtype=np.int32).reshape(-1, 4))
+        matched_previous, matched_current = self._match(current)
+
+        ids = np.full(len(current), -1, dtype=np.int64)
+        ids[matched_current] = self._ids[matched_previous]
+        fresh = ids < 0
+        ids[fresh] = np.arange(self._next_id, self._next_id + int(fresh.sum()))
+        self._next_id += int(fresh.sum())
+
+        kept = np.zeros(len(self._ids), dtype=bool)
+        kept[matched_previous] = True
+        changed = (self._rects[matched_previous] != current[matched_current]).any(axis=1)
+
+        update = TrackUpdate(
+            ids=ids,
+            added=ids[fresh],
+            removed=self._ids[~kept],
+            moved=ids[matched_current[changed]],
+        )
+        self._rects = current
+        self._ids = ids
+
+        return update
@@ -1,3 +1,9 @@
+import numpy as np
+
+from icondetection import instrumentation
+from icondetection.rect_array import RectArray
+
+
 class WeightedQuickUnionUF:
     """
     Weighted Quick Union UF is a Python conversion of the algorithm as implemented by Kevin Wayne and Robert Sedgewick
@@ -32,11 +38,16 @@ class WeightedQuickUnionUF:
         Returns the component identifier for the component containing site p.
         """
         self._validate(p)
+        steps = 0
         while p != self._parent[p][0]:
             # path compression (make every other node in path point to its grandparent)
             self._parent[p] = (self._parent[self._parent[p][0]][0], self._parent[p][1])
 
             p = self._parent[p][0]
+            steps += 1
+
+        if steps and instrumentation.active:
+            instrumentation.count("path_compression_steps", steps)
 
         return p
 
@@ -73,33 +84,184 @@ class WeightedQuickUnionUF:
             self._size[root_p] = self._size[root_p] + self._size[root_q]
 
         self._count = self._count - 1
+        if instrumentation.active:
+            instrumentation.count("unions")
         pass
 
     def get_unions(self):
         """
         Retrieves and returns all groups, according to their parent
         """
-        components = {}
-        for index_element in range(len(self._parent)):
-            # get parent component
-            index_parent = self.find(index_element)
-            parent = self._parent[index_parent][1]
-            child = self._parent[index_element][1]
-
-            # add it to the mapping, or add the current component to its list
-            if index_parent not in components:
-                if index_element == index_parent:
-                    components[index_parent] = [
-                        child,
-                    ]
+        with instrumentation.stage("get_unions"):
+            components = {}
+            for index_element in range(len(self._parent)):
+                # get parent component
+                index_parent = self.find(index_element)
+                parent = self._parent[index_parent][1]
+                child = self._parent[index_element][1]
+
+                # add it to the mapping, or add the current component to its list
+                if index_parent not in components:
+                    if index_element == index_parent:
+                        components[index_parent] = [
+                            child,
+                        ]
+                    else:
+                        components[index_parent] = [
+                            parent,
+                            child,
+                        ]
                 else:
-                    components[index_parent] = [
-                        parent,
-                        child,
-                    ]
-            else:
-                parent_list = components[index_parent]
-                parent_list.append(child)
-                components[index_parent] = parent_list
+                    parent_list = components[index_parent]
+                    parent_list.append(child)
+                    components[index_parent] = parent_list
 
         return components
+
+
+class QuickUnionArrayUF:
+    """
+    Union find over n sites backed by an int32 parent array, meant for merging many sites at once.
+
+    Rather than linking one pair at a time, union_many takes a whole edge list and links roots in vectorized
+    rounds, always hooking the larger root index below the smaller one and compressing every path between rounds.
+    The identifier of a component is therefore always its smallest site, which keeps labels deterministic.
+    """
+
+    def __init__(self, n: int):
+        """
+        Initializes an empty union–find data structure with n sites
+        0 through n-1. Each site is initially in its own
+        component.
+        """
+        self._parent = np.arange(n, dtype=np.int32)
+        self._count = n
+
+    def count(self):
+        """
+        Returns the number of components.
+        """
+        return self._count
+
+    def find(self, p: int):
+        """
+        Returns the component identifier for the component containing site p.
+        """
+        self._validate(p)
+        parent = self._parent
+        steps = 0
+        while p != parent[p]:
+            # path halving (make every other node in path point to its grandparent)
+            parent[p] = parent[parent[p]]
+            p = int(parent[p])
+            steps += 1
+
+        if steps and instrumentation.active:
+            instrumentation.count("path_compression_steps", steps)
+
+        return p
+
+    def _validate(self, p: int):
+        """
+        Validate that p is a valid index.
+        """
+        n = len(self._parent)
+        if p is None or p < 0 or p >= n:
+            raise ValueError("index {0} is not between 0 and {1}".format(p, n - 1))
+
+    def connected(self, p: int, q: int):
+        """
+        Returns true if the the two sites are in the same component.
+        """
+        return self.find(p) == self.find(q)
+
+    def union(self, p: int, q: int):
+        """
+        Merges the component containing site p with the component containing site q.
+        """
+        root_p = self.find(p)
+        root_q = self.find(q)
+        if root_p == root_q:
+            return
+
+        # make the larger root point to the smaller one
+        if root_p < root_q:
+            self._parent[root_q] = root_p
+        else:
+            self._parent[root_p] = root_q
+
+        self._count = self._count - 1
+        if instrumentation.active:
+            instrumentation.count("unions")
+
+    def _compress(self):
+        """
+        Point every site directly at its root.
+        """
+        parent = self._parent
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                return
+            if instrumentation.active:
+                instrumentation.count("path_compression_steps", int(np.count_nonzero(grandparent != parent)))
+            parent[:] = grandparent
+
+    def union_many(self, pairs):
+        """
+        Merges the components of every (p, q) pair in pairs, given as an (E, 2) array of site indexes.
+        """
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        n = len(self._parent)
+        if len(pairs) > 0 and (pairs.min() < 0 or pairs.max() >= n):
+            raise ValueError("pair indexes must be between 0 and {0}".format(n - 1))
+
+        parent = self._parent
+        p = pairs[:, 0]
+        q = pairs[:, 1]
+        while len(p) > 0:
+            self._compress()
+            root_p = parent[p]
+            root_q = parent[q]
+
+            # pairs already sharing a root are done and drop out of the next round
+            pending = root_p != root_q
+            p = p[pending]
+            q = q[pending]
+            root_p = root_p[pending]
+            root_q = root_q[pending]
+
+            np.minimum.at(parent, np.maximum(root_p, root_q), np.minimum(root_p, root_q))
+
+        count = int(np.count_nonzero(parent == np.arange(n)))
+        instrumentation.count("unions", self._count - count)
+        self._count = count
+
+    def labels(self) -> np.ndarray:
+        """
+        Returns a component id per site. Ids are dense, from 0 to count() - 1, and ordered by the smallest site of
+        every component.
+        """
+        self._compress()
+        return np.unique(self._parent, return_inverse=True)[1].astype(np.int32).reshape(-1)
+
+    def component_bounds(self, rects: RectArray) -> RectArray:
+        """
+        Returns the merged bounding rectangle of every component, in label order, where rects holds the rectangle
+        of every site. This is the vectorized counterpart of Rectangle.merge_rects over get_unions.
+        """
+        if len(rects) != len(self._parent):
+            raise ValueError("expected {0} rects, got {1}".format(len(self._parent), len(rects)))
+        if len(rects) == 0:
+            return RectArray.empty()
+
+        labels = self.labels()
+        order = np.argsort(labels, kind="stable")
+        starts = np.flatnonzero(np.diff(labels[order], prepend=-1))
+
+        return RectArray(
+            np.minimum.reduceat(rects.top[order], starts),
+            np.minimum.reduceat(rects.left[order], starts),
+            np.maximum.reduceat(rects.bottom[order], starts),
+            np.maximum.reduceat(rects.right[order], starts),
+        )
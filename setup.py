@@ -27,4 +27,5 @@ setup(
     packages=find_packages(exclude=["test", "*.test", "*.test.*", "test.*"]),
     include_package_data=True,
     install_requires=["Pillow", "opencv-contrib-python", "numpy"],
+    entry_points={"console_scripts": ["icondetection=icondetection.__main__:main"]},
 )
@@ -1,9 +1,67 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import tempfile
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2 as cv
+import numpy as np
+from PIL import Image
 
 import icondetection.rectangle as r
-from icondetection import box
+from icondetection import benchmark, box, engines, instrumentation, rect_format
+from icondetection.__main__ import main
+from icondetection.batch import completed_paths, export_rects, find_images, run_batch
+from icondetection.cache import DetectionCache
+from icondetection.containment import ContainmentTree, contour_depths
+from icondetection.features import FeatureExtractor, create_detector
+from icondetection.fingerprint import FingerprintIndex, fingerprint_rects, hamming_distances
+from icondetection.incremental import IncrementalDetector
+from icondetection.ingest import from_buffer, from_mmap, from_shared_memory
+from icondetection.helpers import run_sift
+from icondetection.navigation import NavigationGraph
+from icondetection.pipeline import DetectionPipeline
+from icondetection.interval_tree import IntervalTree
+from icondetection.pyramid import coarse_regions, pyramid_bounding_rects, pyramid_detect_rects
+from icondetection.rect_array import RectArray
+from icondetection.rect_index import RectIndex
+from icondetection.roi import detect_near
+from icondetection.service import DetectionClient, DetectionService
+from icondetection.stream import detect_stream, detect_stream_async
+from icondetection.tiling import tiled_bounding_rects, tiled_detect_rects
+from icondetection.tracking import RectTracker, exact_matches, greedy_assignment
+from icondetection.weighted_quick_unionUF import QuickUnionArrayUF
 from icondetection.weighted_quick_unionUF import WeightedQuickUnionUF as uf
 
+TEST_IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-images")
+
+
+def own_shared_memory(image, connection):
+    """
+    Hold a copy of image in a shared memory block, sending its name over connection and releasing it once told to.
+    """
+    block = shared_memory.SharedMemory(create=True, size=image.nbytes)
+    np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)[:] = image
+    connection.send(block.name)
+    connection.recv()
+    block.close()
+    block.unlink()
+
+
+def full_detection(image, **kwargs):
+    """
+    Reference result: the whole pipeline run over the whole image.
+    """
+    _, bound_rect = box.canny_detection(box.grayscale_blur(image), **kwargs)
+    return box.group_rects(bound_rect)
+
 
 class TestSIFT(unittest.TestCase):
     def test_invalid_datatype(self):
@@ -12,6 +70,20 @@ class TestSIFT(unittest.TestCase):
         """
         self.assertEqual(1, 1)
 
+    def test_channel_orders(self):
+        image = cv.imread(os.path.join(TEST_IMAGES, "google_small.png"))
+        inputs = [image, Image.fromarray(cv.cvtColor(image, cv.COLOR_BGR2RGB)), cv.cvtColor(image, cv.COLOR_BGR2GRAY)]
+
+        # keypoints are drawn in random colors
+        results = []
+        for img in inputs:
+            cv.setRNGSeed(0)
+            results.append(run_sift(img))
+
+        self.assertEqual(image.shape, results[0].shape)
+        for result in results[1:]:
+            np.testing.assert_array_equal(results[0], result)
+
 
 class TestUF(unittest.TestCase):
     """
@@ -79,6 +151,57 @@ class TestUF(unittest.TestCase):
         self.assertCountEqual([0], unions_t.keys())
 
 
+class TestArrayUF(unittest.TestCase):
+    """
+    Test the array backed Union Find.
+    """
+
+    def setUp(self):
+        self.u = QuickUnionArrayUF(10)
+
+    def test_union_many(self):
+        self.u.union_many([(0, 9), (1, 8), (2, 7), (3, 6), (4, 5), (9, 4)])
+
+        self.assertEqual(4, self.u.count())
+        self.assertTrue(self.u.connected(5, 0))
+        self.assertFalse(self.u.connected(1, 2))
+        self.assertEqual([0, 1, 2, 3, 0, 0, 3, 2, 1, 0], self.u.labels().tolist())
+
+    def test_matches_weighted_quick_union(self):
+        rng = random.Random(3)
+        pairs = [(rng.randrange(200), rng.randrange(200)) for _ in range(150)]
+        weighted = uf(200, list(range(200)))
+        for p, q in pairs:
+            weighted.union(p, q)
+
+        array_uf = QuickUnionArrayUF(200)
+        array_uf.union_many(pairs)
+        scalar_uf = QuickUnionArrayUF(200)
+        for p, q in pairs:
+            scalar_uf.union(p, q)
+
+        self.assertEqual(weighted.count(), array_uf.count())
+        self.assertEqual(array_uf.labels().tolist(), scalar_uf.labels().tolist())
+        for p, q in rng.sample(pairs, 50):
+            self.assertEqual(weighted.connected(p, q), array_uf.connected(p, q))
+
+    def test_component_bounds(self):
+        rects = RectArray.from_rectangles([r.Rectangle(2, 2, 8, 8),
+                                           r.Rectangle(10, 10, 16, 16),
+                                           r.Rectangle(15, 15, 16, 16),
+                                           r.Rectangle(4, 4, 9, 9),
+                                           ])
+        self.u = QuickUnionArrayUF(4)
+        self.u.union_many([(0, 3), (2, 1)])
+
+        self.assertEqual([r.Rectangle(2, 2, 9, 9), r.Rectangle(10, 10, 16, 16)],
+                         self.u.component_bounds(rects).to_rectangles())
+
+    def test_invalid_pairs(self):
+        self.assertRaises(ValueError, self.u.union_many, [(0, 10)])
+        self.assertRaises(ValueError, self.u.find, -1)
+
+
 class TestRectangle(unittest.TestCase):
     """
     Test Rectangle Methods
@@ -296,8 +419,1645 @@ class TestBox(unittest.TestCase):
         self.assertEqual(self.e_red, box.closest_rectangle(self.google_rectangles_small, point_under_e_red))
 
     def test_candidate_rectangle(self):
-        # TODO: Complete this integration test.
-        pass
+        point_in_o_red = (100, 63)
+        point_under_g_blue = (193, 110)
+
+        self.assertEqual(self.o_red, box.candidate_rectangle(self.google_rectangles_small, point_in_o_red))
+        self.assertEqual(self.g_blue, box.candidate_rectangle(self.google_rectangles_small, point_under_g_blue))
+
+    def test_candidate_rectangles(self):
+        rng = random.Random(11)
+        points = [(rng.randint(0, 600), rng.randint(0, 400)) for _ in range(200)]
+        indices, distances = box.candidate_rectangles(self.google_rectangles, points)
+
+        for point, index, distance in zip(points, indices, distances):
+            expected = box.candidate_rectangle(self.google_rectangles, point)
+            self.assertIs(expected, self.google_rectangles[index])
+            self.assertEqual(expected.distance_to_point(point), distance)
+
+    def test_candidate_rectangles_cv_order(self):
+        # a point given as (x, y) lands in the rect whose cv tuple is (x, y, width, height)
+        grouped = [(100, 10, 20, 20), (10, 100, 20, 20)]
+        indices, distances = box.candidate_rectangles(RectArray.from_cv(grouped), [(110, 20), (20, 110), (20, 20)])
+
+        self.assertEqual([0, 1, 0], indices.tolist())
+        self.assertEqual([0.0, 0.0], distances[:2].tolist())
+        self.assertRaises(ValueError, box.candidate_rectangles, [], [(0, 0)])
+
+    def test_canny_rects(self):
+        gray = box.grayscale_blur(cv.imread(os.path.join(TEST_IMAGES, "google.png")))
+        contours, _ = cv.findContours(box.canny_edges(gray), cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
+
+        rects = box.canny_rects(gray)
+        self.assertEqual((len(contours), 4), rects.shape)
+        self.assertEqual(np.int32, rects.dtype)
+        self.assertEqual([cv.boundingRect(contour) for contour in contours], [tuple(rect) for rect in rects.tolist()])
+
+        external = box.canny_rects(gray, external=True)
+        self.assertTrue(0 < len(external) < len(rects))
+        self.assertTrue({tuple(rect) for rect in external.tolist()} <= {tuple(rect) for rect in rects.tolist()})
+
+        self.assertEqual((0, 4), box.contour_bounding_rects([]).shape)
+        self.assertEqual((0, 4), box.canny_rects(np.zeros((20, 20), dtype=np.uint8)).shape)
+
+    def test_canny_detection_contour_accuracy(self):
+        gray = box.grayscale_blur(cv.imread(os.path.join(TEST_IMAGES, "google.png")))
+
+        # contour_accuracy used to be ignored unless multiplier was given too
+        coarse = box.canny_detection(gray, contour_accuracy=8)
+        self.assertEqual(box.canny_detection(gray, multiplier=2, contour_accuracy=8)[1], coarse[1])
+        self.assertLess(sum(map(len, coarse[0])), sum(map(len, box.canny_detection(gray)[0])))
+
+
+class TestRectIndex(unittest.TestCase):
+    """
+    Test the spatial index against the brute force implementations in Box
+    """
+
+    def setUp(self):
+        rng = random.Random(1234)
+        self.rects = []
+        for _ in range(500):
+            top = rng.randint(0, 900)
+            left = rng.randint(0, 1500)
+            self.rects.append(r.Rectangle(top, left, top + rng.randint(0, 60), left + rng.randint(0, 60)))
+        self.points = [(rng.randint(-50, 1600), rng.randint(-50, 1000)) for _ in range(300)]
+        self.index = RectIndex(self.rects, node_capacity=4)
+
+    def test_matches_brute_force(self):
+        for point in self.points:
+            self.assertIs(box.containing_rectangle(self.rects, point), self.index.containing_rectangle(point))
+            self.assertIs(box.closest_rectangle(self.rects, point), self.index.closest_rectangle(point))
+            self.assertIs(box.candidate_rectangle(self.rects, point), self.index.candidate_rectangle(point))
+
+    def test_nearest_and_within_match_brute_force(self):
+        for point in self.points[:50]:
+            ranked = sorted((rect.distance_to_point(point), i) for i, rect in enumerate(self.rects))
+
+            self.assertEqual([i for _, i in ranked[:7]], self.index.nearest_indices(point, 7))
+            within = [i for distance, i in ranked if distance <= 30]
+            self.assertEqual(within, self.index.within_distance_indices(point, 30))
+
+        self.assertEqual([], self.index.nearest_indices((0, 0), 0))
+        self.assertEqual(500, len(self.index.nearest_indices((0, 0), 1000)))
+        self.assertRaises(ValueError, self.index.nearest_indices, (0, 0), -1)
+        self.assertEqual([], RectIndex([]).rectangles_within((0, 0), 10))
+
+    def test_ties_prefer_first_rectangle(self):
+        duplicates = [r.Rectangle(0, 0, 10, 10), r.Rectangle(20, 0, 30, 10), r.Rectangle(0, 0, 10, 10)]
+        index = RectIndex(duplicates, node_capacity=2)
+
+        self.assertEqual(0, index.containing_index((5, 5)))
+        self.assertEqual(0, index.closest_index((5, 15)))
+        self.assertEqual(1, index.closest_index((5, 25)))
+
+    def test_empty_index(self):
+        index = RectIndex([])
+
+        self.assertIsNone(index.containing_rectangle((1, 1)))
+        self.assertRaises(ValueError, index.closest_rectangle, (1, 1))
+
+    def test_from_cv(self):
+        index = RectIndex.from_cv([(0, 0, 10, 10), (40, 40, 5, 5)])
+
+        self.assertEqual(r.Rectangle(40, 40, 45, 45), index.candidate_rectangle((60, 60)))
+
+
+class TestRectArray(unittest.TestCase):
+    """
+    Test the vectorized rectangle array against the Rectangle API
+    """
+
+    def setUp(self):
+        # top, left, bottom, right
+        self.rects = [r.Rectangle(2, 2, 8, 8),
+                      r.Rectangle(4, 4, 8, 8),
+                      r.Rectangle(10, 10, 16, 16),
+                      r.Rectangle(2, 8, 8, 12),
+                      r.Rectangle(8, 8, 16, 16),
+                      ]
+        self.array = RectArray.from_rectangles(self.rects)
+
+    def test_round_trip(self):
+        self.assertEqual(self.rects, self.array.to_rectangles())
+        self.assertEqual(self.rects[2], self.array[2])
+        self.assertEqual(self.rects[1:3], self.array[1:3].to_rectangles())
+
+        cv_rects = [r.Rectangle.rect_cartesian_to_cv(rect) for rect in self.rects]
+        self.assertEqual(cv_rects, [tuple(row) for row in self.array.to_cv().tolist()])
+        self.assertEqual(self.rects, RectArray.from_cv(cv_rects).to_rectangles())
+        self.assertEqual(np.int32, self.array.top.dtype)
+
+    def test_intersect_matrix(self):
+        matrix = self.array.intersect_matrix()
+
+        for i, rect_a in enumerate(self.rects):
+            for j, rect_b in enumerate(self.rects):
+                self.assertEqual(r.Rectangle.intersect(rect_a, rect_b), matrix[i, j])
+
+    def test_iou_matrix(self):
+        matrix = self.array.iou_matrix()
+
+        np.testing.assert_array_equal(np.ones(len(self.rects)), np.diag(matrix))
+        self.assertAlmostEqual(16 / 36, matrix[0, 1])
+        self.assertEqual(0, matrix[0, 3])
+        np.testing.assert_array_equal(matrix, matrix.T)
+        np.testing.assert_array_equal(matrix > 0, self.array.intersect_matrix())
+
+    def test_distance_and_containment(self):
+        points = [(4, 4), (1, 4), (10, 3), (3, 90), (9, -1), (12, 12)]
+        distances = self.array.distance_to_points(points)
+        contains = self.array.contains_points(points)
+
+        for p, point in enumerate(points):
+            for i, rect in enumerate(self.rects):
+                self.assertEqual(rect.distance_to_point(point), distances[p, i])
+                self.assertEqual(rect.contains_point(point), contains[p, i])
+
+    def test_area_and_merge(self):
+        self.assertEqual([rect.get_area() for rect in self.rects], self.array.get_area().tolist())
+        self.assertEqual(r.Rectangle.merge_rects(self.rects), self.array.merge())
+        self.assertRaises(ValueError, RectArray.empty().merge)
+
+
+class TestIntervalTree(unittest.TestCase):
+    """
+    Test the interval tree against a brute force scan
+    """
+
+    def test_overlapping(self):
+        rng = random.Random(42)
+        lows = [rng.randint(0, 100) for _ in range(60)]
+        highs = [low + rng.randint(0, 20) for low in lows]
+        tree = IntervalTree(lows, highs)
+        active = set()
+
+        for _ in range(300):
+            i = rng.randrange(len(lows))
+            if i in active:
+                tree.remove(i)
+                active.discard(i)
+            else:
+                tree.insert(i)
+                active.add(i)
+
+            low = rng.randint(-10, 110)
+            high = low + rng.randint(0, 30)
+            expected = [j for j in active if lows[j] < high and highs[j] > low]
+            self.assertCountEqual(expected, list(tree.overlapping(low, high)))
+
+
+class TestGroupRects(unittest.TestCase):
+    """
+    Test grouping of overlapping rects
+    """
+
+    @staticmethod
+    def brute_force_groups(cv_rects):
+        rects = [r.Rectangle.rect_cv_to_cartesian(rect) for rect in cv_rects]
+        unified = uf(len(rects), rects)
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                if r.Rectangle.intersect(rects[i], rects[j]):
+                    unified.union(i, j)
+
+        return [r.Rectangle.rect_cartesian_to_cv(r.Rectangle.merge_rects(group))
+                for group in unified.get_unions().values()]
+
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        for _ in range(50):
+            cv_rects = [(rng.randint(0, 200), rng.randint(0, 200), rng.randint(0, 30), rng.randint(0, 30))
+                        for _ in range(rng.randint(0, 60))]
+            self.assertEqual(self.brute_force_groups(cv_rects), box.group_rects(cv_rects))
+
+    def test_same_left_edge(self):
+        # rects sharing a left edge must still be compared against each other
+        cv_rects = [(1, 53, 24, 6), (14, 53, 30, 16)]
+        self.assertEqual([(1, 53, 43, 16)], box.group_rects(cv_rects, 0, 300))
+
+    def test_scanning_range(self):
+        cv_rects = [(0, 0, 10, 10), (5, 5, 10, 10), (100, 0, 10, 10), (105, 5, 10, 10)]
+        self.assertEqual([(0, 0, 15, 15), (100, 0, 10, 10), (105, 5, 10, 10)], box.group_rects(cv_rects, 0, 50))
+
+
+class TestIncrementalDetector(unittest.TestCase):
+    """
+    Test that incremental re-detection agrees with detection over the whole frame
+    """
+
+    def setUp(self):
+        self.image = cv.imread(os.path.join(TEST_IMAGES, "vscode.png"))
+        self.detector = IncrementalDetector()
+
+    def test_changed_frames(self):
+        self.assertCountEqual(full_detection(self.image), self.detector.update(self.image))
+
+        rng = random.Random(2)
+        frame = self.image
+        height, width = frame.shape[:2]
+        for _ in range(5):
+            frame = frame.copy()
+            x = rng.randint(0, width - 40)
+            y = rng.randint(0, height - 30)
+            cv.rectangle(frame, (x, y), (x + rng.randint(5, 40), y + rng.randint(5, 30)), (255, 255, 255), 2)
+
+            self.assertCountEqual(full_detection(frame), self.detector.update(frame))
+            self.assertGreater(len(self.detector.last_regions), 0)
+
+    def test_unchanged_frame(self):
+        grouped = self.detector.update(self.image)
+
+        self.assertEqual(grouped, self.detector.update(self.image.copy()))
+        self.assertEqual(0, len(self.detector.last_regions))
+
+    def test_new_frame_size(self):
+        self.detector.update(self.image)
+        smaller = self.image[:100, :200].copy()
+
+        self.assertCountEqual(full_detection(smaller), self.detector.update(smaller))
+
+
+class TestDetectionCache(unittest.TestCase):
+    """
+    Test the content addressed detection cache
+    """
+
+    def setUp(self):
+        self.image = cv.imread(os.path.join(TEST_IMAGES, "google_small.png"))
+        self.other = cv.imread(os.path.join(TEST_IMAGES, "header.png"))
+
+    def test_hits_and_misses(self):
+        cache = DetectionCache()
+
+        self.assertEqual(box.detect_rects(self.image), cache.detect(self.image))
+        self.assertEqual(box.detect_rects(self.image), cache.detect(self.image.copy()))
+        cache.detect(self.image, min_threshold=50)
+
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(2, cache.misses)
+        self.assertNotEqual(cache.key(self.image), cache.key(self.image, min_threshold=50))
+
+    def test_strided_views(self):
+        cache = DetectionCache()
+
+        # views are hashed without copying them, yet keyed as their contiguous copies would be
+        for view in (self.image[10:40, 20:60], self.image[::2, ::3], self.image[:, :, 0]):
+            self.assertFalse(view.flags.c_contiguous)
+            self.assertEqual(cache.key(view.copy()), cache.key(view))
+
+    def test_eviction(self):
+        cache = DetectionCache(max_entries=1)
+        cache.detect(self.image)
+        cache.detect(self.other)
+        cache.detect(self.image)
+
+        self.assertEqual(2, cache.evictions)
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(1, len(cache))
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            expected = DetectionCache(directory=directory).detect(self.image)
+
+            restarted = DetectionCache(directory=directory)
+            self.assertEqual(expected, restarted.detect(self.image))
+            self.assertEqual(1, restarted.disk_hits)
+            self.assertEqual(0, restarted.misses)
+
+            rect_file = os.path.join(directory, restarted.key(self.image) + ".rects")
+            self.assertEqual(expected, rect_format.load_rects(rect_file).to_list())
+
+    def test_concurrent_writes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DetectionCache(directory=directory)
+            rects = [(i, i, 10, 10) for i in range(2000)]
+            with ThreadPoolExecutor(8) as executor:
+                list(executor.map(lambda _: cache.put("same", rects), range(32)))
+
+            self.assertEqual(["same.rects"], os.listdir(directory))
+            self.assertEqual(rects, rect_format.load_rects(os.path.join(directory, "same.rects")).to_list())
+
+
+class TestDetectionPipeline(unittest.TestCase):
+    """
+    Test that pipeline stages are memoized and invalidated by their own inputs only
+    """
+
+    def setUp(self):
+        self.image = cv.imread(os.path.join(TEST_IMAGES, "google.png"))
+        self.pipeline = DetectionPipeline(self.image)
+
+    def test_matches_box(self):
+        _, bound_rect = box.canny_detection(box.grayscale_blur(self.image), min_threshold=100)
+
+        self.assertEqual(bound_rect, self.pipeline.rects())
+        self.assertEqual(box.group_rects(bound_rect), self.pipeline.grouped())
+
+    def test_threshold_change_keeps_blur(self):
+        self.pipeline.index()
+        self.pipeline.index()
+        self.assertEqual(1, self.pipeline.runs["gray"])
+        self.assertEqual(1, self.pipeline.runs["index"])
+
+        self.pipeline.min_threshold = 50
+        self.pipeline.grouped()
+        self.assertEqual(1, self.pipeline.runs["gray"])
+        self.assertEqual(2, self.pipeline.runs["edges"])
+        self.assertEqual(2, self.pipeline.runs["grouped"])
+
+    def test_contour_accuracy_change_keeps_contours(self):
+        self.pipeline.grouped()
+        self.pipeline.contour_accuracy = 6
+        self.pipeline.grouped()
+
+        self.assertEqual(1, self.pipeline.runs["contours"])
+        self.assertEqual(2, self.pipeline.runs["rects"])
+
+    def test_new_image(self):
+        self.pipeline.grouped()
+        self.pipeline.image = self.image[:100]
+        self.pipeline.grouped()
+
+        self.assertEqual(2, self.pipeline.runs["gray"])
+        self.assertRaises(ValueError, DetectionPipeline().grouped)
+
+    def test_rects_only(self):
+        gray = box.grayscale_blur(self.image)
+        self.pipeline.rects_only = True
+
+        np.testing.assert_array_equal(box.canny_rects(gray), self.pipeline.rects())
+        self.assertEqual(box.group_rects(box.canny_rects(gray)), self.pipeline.grouped())
+        self.assertRaises(ValueError, self.pipeline.polygons_and_rects)
+
+        self.pipeline.external = True
+        np.testing.assert_array_equal(box.canny_rects(gray, external=True), self.pipeline.rects())
+        self.assertEqual(1, self.pipeline.runs["edges"])
+        self.assertEqual(2, self.pipeline.runs["contours"])
+
+
+class TestTiling(unittest.TestCase):
+    """
+    Tests for tiled detection
+    """
+
+    def assertSameRects(self, image, **kwargs):
+        _, bound_rect = box.canny_detection(box.grayscale_blur(image))
+        tiled = tiled_bounding_rects(image, **kwargs)
+
+        self.assertEqual(sorted(tuple(rect) for rect in bound_rect), sorted(tiled))
+
+    def test_matches_single_shot(self):
+        image = cv.imread(os.path.join(TEST_IMAGES, "vscode.png"))
+        for tile_size in (64, 100, 257, 1024):
+            self.assertSameRects(image, tile_size=tile_size)
+
+    def test_long_edges_across_seams(self):
+        # edges on this capture run across many tiles, so hysteresis has to be completed across seams
+        image = cv.imread(os.path.join(TEST_IMAGES, "popular.png"))
+        self.assertSameRects(image, tile_size=64, workers=4)
+
+    def test_grouped(self):
+        image = cv.imread(os.path.join(TEST_IMAGES, "google.png"))
+        self.assertEqual(
+            sorted(box.detect_rects(image)), sorted(tiled_detect_rects(image, tile_size=100))
+        )
+
+    def test_invalid(self):
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+        self.assertRaises(ValueError, tiled_bounding_rects, image, tile_size=0)
+        self.assertRaises(ValueError, tiled_bounding_rects, image, halo=2)
+
+
+class TestBatch(unittest.TestCase):
+    """
+    Tests for batch detection
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, "rects.jsonl")
+        self.paths = find_images([os.path.join(TEST_IMAGES, "google*.png"), os.path.join(TEST_IMAGES, "*vscode.png")])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_records(self) -> dict:
+        with open(self.output) as output_file:
+            return {record["path"]: record for record in map(json.loads, output_file)}
+
+    def test_find_images(self):
+        self.assertEqual(4, len(self.paths))
+        self.assertEqual(sorted(self.paths), self.paths)
+        self.assertEqual(7, len(find_images([TEST_IMAGES, os.path.join(TEST_IMAGES, "header.png")])))
+
+    def test_records(self):
+        self.assertEqual(4, run_batch(self.paths, self.output, workers=2, chunksize=1))
+
+        records = self.read_records()
+        self.assertEqual(set(self.paths), set(records))
+        for path, record in records.items():
+            expected = box.detect_rects(cv.imread(path))
+            self.assertEqual([list(rect) for rect in expected], record["rects"])
+            self.assertIn("edges", record["timings"])
+
+    def test_resume(self):
+        run_batch(self.paths[:2], self.output, workers=1)
+
+        # simulate a run interrupted halfway through writing a record
+        with open(self.output, "a") as output_file:
+            output_file.write('{"path": "')
+
+        self.assertEqual(set(self.paths[:2]), completed_paths(self.output))
+        self.assertEqual(2, run_batch(self.paths, self.output, workers=1))
+        self.assertEqual(set(self.paths), set(self.read_records()))
+        self.assertEqual(4, run_batch(self.paths, self.output, workers=1, resume=False))
+
+    def test_resume_after_error(self):
+        # a first run failing on every image, as it would on a transient error
+        run_batch(self.paths[:2], self.output, workers=1, multiplier="x")
+        self.assertEqual(set(), completed_paths(self.output))
+
+        self.assertEqual(4, run_batch(self.paths, self.output, workers=1))
+        with open(self.output) as output_file:
+            records = [json.loads(line) for line in output_file]
+        self.assertEqual(sorted(self.paths), sorted(record["path"] for record in records))
+        self.assertTrue(all("rects" in record for record in records))
+
+    def test_unreadable(self):
+        path = os.path.join(self.directory.name, "broken.png")
+        with open(path, "w") as broken:
+            broken.write("not an image")
+
+        run_batch([path], self.output, workers=1)
+        self.assertIn("error", self.read_records()[path])
+
+    def test_failing_stage(self):
+        # a threshold the pipeline cannot work with fails inside the worker, for every image
+        self.assertEqual(4, run_batch(self.paths, self.output, workers=2, multiplier="x"))
+
+        records = self.read_records()
+        self.assertEqual(set(self.paths), set(records))
+        for record in records.values():
+            self.assertTrue(record["error"].startswith("ValueError: "))
+
+    def test_export_rects(self):
+        run_batch(self.paths, self.output, workers=1)
+        rects_path = os.path.join(self.directory.name, "rects.rects")
+        self.assertEqual(4, export_rects(self.output, rects_path))
+
+        rect_set = rect_format.load_rects(rects_path)
+        with open(self.output) as output_file:
+            for image, record in enumerate(map(json.loads, output_file)):
+                self.assertEqual(record["rects"], rect_set.image_rects(image).tolist())
+
+    def test_command_line(self):
+        self.assertEqual(0, main(["batch", self.paths[0], "-o", self.output, "-j", "1", "--min-threshold", "50"]))
+        self.assertEqual(
+            [list(rect) for rect in box.detect_rects(cv.imread(self.paths[0]), min_threshold=50)],
+            self.read_records()[self.paths[0]]["rects"],
+        )
+
+
+class TestStream(unittest.TestCase):
+    """
+    Tests for streaming detection
+    """
+
+    def setUp(self):
+        self.images = [
+            cv.imread(os.path.join(TEST_IMAGES, name))
+            for name in ("google_small.png", "small_vscode.png", "vscode.png")
+        ]
+        self.expected = [box.detect_rects(image) for image in self.images]
+
+    def test_in_order(self):
+        frames = self.images * 3
+        results = list(detect_stream(frames, queue_size=1))
+
+        self.assertEqual(list(range(len(frames))), [result.index for result in results])
+        self.assertEqual(self.expected * 3, [result.rects for result in results])
+
+    def test_encoded_frames(self):
+        frames = [cv.imencode(".png", self.images[0])[1].tobytes(), os.path.join(TEST_IMAGES, "small_vscode.png")]
+        self.assertEqual(self.expected[:2], [result.rects for result in detect_stream(frames)])
+
+    def test_slow_consumer(self):
+        frames = self.images * 10
+        for policy in ("drop", "latest"):
+            results = []
+            for result in detect_stream(frames, policy=policy, queue_size=1):
+                results.append(result)
+                time.sleep(0.01)
+
+            indices = [result.index for result in results]
+            self.assertEqual(sorted(set(indices)), indices)
+            for result in results:
+                self.assertEqual(self.expected[result.index % 3], result.rects)
+
+        # the newest frame always replaces an older one, so the last frame is never lost
+        self.assertEqual(len(frames) - 1, indices[-1])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            list(detect_stream([self.images[0], b"not an image"]))
+        self.assertRaises(ValueError, list, detect_stream(self.images, policy="newest"))
+
+    def test_early_exit(self):
+        def endless():
+            while True:
+                yield self.images[0]
+
+        for result in detect_stream(endless()):
+            if result.index == 5:
+                break
+        self.assertEqual(5, result.index)
+
+    def test_async(self):
+        async def frames():
+            for image in self.images:
+                yield image
+
+        async def collect(source):
+            return [result async for result in detect_stream_async(source)]
+
+        self.assertEqual(self.expected, [result.rects for result in asyncio.run(collect(frames()))])
+        self.assertEqual(self.expected, [result.rects for result in asyncio.run(collect(self.images))])
+        self.assertRaises(TypeError, list, detect_stream(frames()))
+
+    def test_async_blocking_source(self):
+        def capture():
+            # a capture blocking until every frame is ready
+            for image in self.images:
+                time.sleep(0.1)
+                yield image
+
+        async def collect():
+            ticks = []
+
+            async def tick():
+                while True:
+                    ticks.append(time.perf_counter())
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.ensure_future(tick())
+            results = [result async for result in detect_stream_async(capture())]
+            ticker.cancel()
+            return results, np.diff(ticks)
+
+        results, gaps = asyncio.run(collect())
+        self.assertEqual(self.expected, [result.rects for result in results])
+        # the loop kept running while the capture slept
+        self.assertLess(gaps.max(), 0.09)
+
+
+class TestService(unittest.TestCase):
+    """
+    Tests for the detection service, with blocking clients running in threads next to the service
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "detection.sock")
+        self.image = cv.imread(os.path.join(TEST_IMAGES, "google.png"))
+        self.expected = [list(rect) for rect in box.detect_rects(self.image)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def serve(self, clients, **kwargs):
+        """
+        Run the service while every client function is called with its own connection, returning their results.
+        The statistics of the service once every client is done are kept in self.stats.
+        """
+
+        self.loop_errors = []
+
+        async def run():
+            service = DetectionService(**kwargs)
+            await service.start(path=self.path)
+            loop = asyncio.get_running_loop()
+            loop.set_exception_handler(lambda _, context: self.loop_errors.append(context))
+
+            def connect_and_run(client):
+                with DetectionClient(path=self.path, timeout=10) as connection:
+                    return client(connection)
+
+            with ThreadPoolExecutor(len(clients)) as executor:
+                try:
+                    results = await asyncio.gather(
+                        *(loop.run_in_executor(executor, connect_and_run, client) for client in clients)
+                    )
+                    self.stats = service.stats()
+                    return results
+                finally:
+                    await service.close()
+
+        return asyncio.run(run())
+
+    def test_image_sources(self):
+        # the shared memory block belongs to another process, as it would for a real client
+        connection, child_connection = multiprocessing.Pipe()
+        owner = multiprocessing.Process(target=own_shared_memory, args=(self.image, child_connection))
+        owner.start()
+        name = connection.recv()
+
+        def detect(client):
+            return [
+                client.detect(self.image),
+                client.detect(cv.cvtColor(self.image, cv.COLOR_BGR2RGB), channel_order="rgb"),
+                client.detect(encoded=cv.imencode(".png", self.image)[1].tobytes()),
+                client.detect(shm=name, width=self.image.shape[1], height=self.image.shape[0]),
+            ]
+
+        try:
+            responses = self.serve([detect])[0]
+        finally:
+            connection.send(None)
+            owner.join()
+
+        for response in responses:
+            self.assertEqual(self.expected, response["rects"])
+
+    def test_candidates(self):
+        points = [(10, 10), (300, 200), (600, 340)]
+        response = self.serve([lambda client: client.detect(self.image, points=points, min_threshold=50)])[0]
+
+        rects = box.detect_rects(self.image, min_threshold=50)
+        indices, distances = box.candidate_rectangles(RectArray.from_cv(rects), points)
+        self.assertEqual(indices.tolist(), [candidate["index"] for candidate in response["candidates"]])
+        self.assertEqual(distances.tolist(), [candidate["distance"] for candidate in response["candidates"]])
+
+    def test_batching(self):
+        for response in self.serve([lambda client: client.detect(self.image)] * 6, batch_window=0.05):
+            self.assertEqual(self.expected, response["rects"])
+
+        # identical images are detected once, whether they share a batch or come later
+        self.assertEqual(6, self.stats["requests"])
+        self.assertEqual(1, self.stats["detections"])
+        self.assertLessEqual(self.stats["batches"], 6)
+        self.assertIn("p99", self.stats["latency"])
+
+        stats = self.serve([lambda client: client.stats()])[0]
+        self.assertEqual(0, stats["queue_depth"])
+
+    def test_errors(self):
+        def bad_requests(client):
+            self.assertRaises(RuntimeError, client.request, {"op": "unknown"})
+            self.assertRaises(RuntimeError, client.detect, encoded=b"not an image")
+            return client.detect(self.image)
+
+        self.assertEqual(self.expected, self.serve([bad_requests])[0]["rects"])
+
+    def test_binary_rects(self):
+        points = [(300, 200)]
+        response = self.serve([lambda client: client.detect(self.image, points=points, binary=True)])[0]
+
+        self.assertEqual(np.int32, response["rects"].dtype)
+        self.assertEqual(self.expected, response["rects"].tolist())
+        self.assertEqual(1, len(response["candidates"]))
+
+    def test_malformed_messages(self):
+        def send(data: bytes):
+            def client(connection):
+                connection._socket.sendall(data)
+                connection._socket.shutdown(socket.SHUT_WR)
+                try:
+                    body_length, _ = struct.unpack(">II", connection._receive_exactly(8))
+                    return json.loads(connection._receive_exactly(body_length))["error"]
+                except ConnectionError:
+                    return None
+
+            return client
+
+        detect = json.dumps({"op": "detect", "width": 2, "height": 2}).encode()
+        errors = self.serve([
+            # cut short within the document and within the payload
+            send(struct.pack(">II", 40, 0) + b'{"op": '),
+            send(struct.pack(">II", len(detect), 12) + detect + b"\0" * 5),
+            send(struct.pack(">II", 5, 0) + b"nope!"),
+            send(struct.pack(">II", 2, 0) + b"[]"),
+            send(struct.pack(">II", 2, 1 << 22) + b"{}"),
+            lambda client: client.detect(self.image)["rects"],
+        ], max_payload=1 << 21)
+
+        self.assertEqual([None, None], errors[:2])
+        self.assertTrue(errors[2].startswith("JSONDecodeError: "))
+        self.assertTrue(errors[3].startswith("ValueError: "))
+        self.assertTrue(errors[4].startswith("ValueError: a payload of 4194304 bytes"))
+        self.assertEqual(self.expected, errors[5])
+        self.assertEqual([], self.loop_errors)
+
+    def test_close_fails_waiting_requests(self):
+        async def run():
+            service = DetectionService(batch_window=10)
+            await service.start(path=self.path)
+            # the first request is taken into a batch that waits for more, the second is left in the queue
+            waiting = [asyncio.ensure_future(service.detect(self.image)) for _ in range(2)]
+            await asyncio.sleep(0.2)
+            await service.close()
+            return await asyncio.wait_for(asyncio.gather(*waiting, return_exceptions=True), 5)
+
+        for outcome in asyncio.run(run()):
+            self.assertIsInstance(outcome, RuntimeError)
+
+    def test_cancelled_shared_memory(self):
+        connection, child_connection = multiprocessing.Pipe()
+        owner = multiprocessing.Process(target=own_shared_memory, args=(self.image, child_connection))
+        owner.start()
+        name = connection.recv()
+        height, width = self.image.shape[:2]
+
+        async def run():
+            service = DetectionService(batch_window=0.2)
+            await service.start(path=self.path)
+            try:
+                # given up on while it waits for its batch, as when its client disconnects
+                document = {"op": "detect", "shm": name, "width": width, "height": height, "min_threshold": 50}
+                cancelled = asyncio.ensure_future(service._handle_request(document, b""))
+                await asyncio.sleep(0.05)
+                cancelled.cancel()
+
+                response = await service.detect(self.image)
+                return cancelled.cancelled(), response, service.stats()
+            finally:
+                await service.close()
+
+        try:
+            cancelled, response, stats = asyncio.run(run())
+        finally:
+            connection.send(None)
+            owner.join()
+
+        self.assertTrue(cancelled)
+        self.assertEqual(self.expected, [list(rect) for rect in response["rects"]])
+        # the cancelled request is dropped from its batch rather than detected for no one
+        self.assertEqual(1, stats["detections"])
+
+
+class TestIngest(unittest.TestCase):
+    """
+    Tests for zero copy ingestion of raw pixels
+    """
+
+    def setUp(self):
+        self.image = cv.imread(os.path.join(TEST_IMAGES, "small_vscode.png"))
+        self.height, self.width = self.image.shape[:2]
+        self.expected = box.grayscale_blur(self.image)
+
+    def padded(self, image, padding: int) -> bytes:
+        """
+        Lay the rows of image out with padding bytes after each one, after a header of 16 bytes.
+        """
+        rows = image.reshape(self.height, -1)
+        return b"\xff" * 16 + b"".join(row.tobytes() + b"\0" * padding for row in rows)
+
+    def test_channel_orders(self):
+        conversions = {
+            "gray": cv.COLOR_BGR2GRAY,
+            "rgb": cv.COLOR_BGR2RGB,
+            "bgra": cv.COLOR_BGR2BGRA,
+            "rgba": cv.COLOR_BGR2RGBA,
+        }
+        for channel_order, conversion in conversions.items():
+            converted = cv.cvtColor(self.image, conversion)
+            stride = converted[0].nbytes + 12
+            image = from_buffer(self.padded(converted, 12), self.width, self.height, channel_order, stride, 16)
+
+            np.testing.assert_array_equal(converted, image)
+            np.testing.assert_array_equal(self.expected, box.grayscale_blur(image, channel_order))
+            self.assertEqual(box.detect_rects(self.image), box.detect_rects(image, channel_order=channel_order))
+
+    def test_zero_copy(self):
+        buffer = bytearray(self.image.tobytes())
+        image = from_buffer(buffer, self.width, self.height)
+        buffer[0] = 255 - buffer[0]
+
+        self.assertEqual(255 - self.image[0, 0, 0], image[0, 0, 0])
+
+    def test_mmap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "frame.raw")
+            with open(path, "wb") as raw:
+                raw.write(self.padded(self.image, 4))
+
+            image = from_mmap(path, self.width, self.height, stride=self.width * 3 + 4, offset=16)
+            np.testing.assert_array_equal(self.image, image)
+            del image
+
+    def test_shared_memory(self):
+        block = shared_memory.SharedMemory(create=True, size=self.image.nbytes)
+        try:
+            image = from_shared_memory(block, self.width, self.height)
+            image[:] = self.image
+            np.testing.assert_array_equal(self.expected, box.grayscale_blur(image))
+            del image
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_invalid(self):
+        buffer = self.image.tobytes()
+        self.assertRaises(ValueError, from_buffer, buffer, self.width, self.height + 1)
+        self.assertRaises(ValueError, from_buffer, buffer, self.width, self.height, stride=self.width)
+        self.assertRaises(ValueError, from_buffer, buffer, self.width, self.height, "bgr565")
+        self.assertRaises(ValueError, box.grayscale_blur, self.image, "rgba")
+
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Tests for the benchmark suite, on the smallest inputs
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.baseline = os.path.join(self.directory.name, "baseline.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_cases(self):
+        names = [case.name for case in benchmark.build_cases(TEST_IMAGES, (10, 100))]
+        self.assertIn("grayscale_blur[fullSize]", names)
+        self.assertIn("canny_detection[vscode]", names)
+        self.assertIn("WeightedQuickUnionUF[100]", names)
+        self.assertIn("candidate_rectangle[10]", names)
+
+        names = [case.name for case in benchmark.build_cases(TEST_IMAGES, (10, 100), pattern="group_rects[[]1*")]
+        self.assertEqual(["group_rects[10]", "group_rects[100]"], names)
+
+    def test_synthetic_rects(self):
+        rects = benchmark.synthetic_cv_rects(1000, seed=3)
+        self.assertEqual((1000, 4), rects.shape)
+        np.testing.assert_array_equal(rects, benchmark.synthetic_cv_rects(1000, seed=3))
+
+    def test_results_and_baseline(self):
+        cases = benchmark.build_cases(TEST_IMAGES, (10,), pattern="*[[]10]")
+        results = benchmark.run_benchmarks(cases, repeat=3)
+
+        self.assertEqual({case.name for case in cases}, set(results))
+        for result in results.values():
+            self.assertEqual(3, result["runs"])
+            self.assertLessEqual(result["min"], result["p50"])
+            self.assertLessEqual(result["p50"], result["p99"])
+
+        benchmark.save_baseline(results, self.baseline)
+        self.assertEqual(results, benchmark.load_baseline(self.baseline))
+
+    def test_regressions(self):
+        baseline = {"fast": {"p50": 1.0}, "slow": {"p50": 1.0}, "gone": {"p50": 1.0}}
+        results = {"fast": {"p50": 1.05}, "slow": {"p50": 1.5}, "new": {"p50": 1.0}}
+
+        found = benchmark.regressions(results, baseline, tolerance=0.1)
+        self.assertEqual(1, len(found))
+        self.assertTrue(found[0].startswith("slow"))
+        self.assertEqual([], benchmark.regressions(results, baseline, tolerance=0.6))
+
+    def test_command_line(self):
+        arguments = ["benchmark", "-k", "grayscale_blur[[]google_small]", "--max-rects", "10", "--repeat", "3"]
+        self.assertEqual(0, main(arguments + ["--save", self.baseline]))
+
+        benchmark.save_baseline({"grayscale_blur[google_small]": {"p50": 1e-9}}, self.baseline)
+        self.assertEqual(1, main(arguments + ["--baseline", self.baseline]))
+
+
+class TestInstrumentation(unittest.TestCase):
+    """
+    Tests for stage timings and counters
+    """
+
+    def setUp(self):
+        self.image = cv.imread(os.path.join(TEST_IMAGES, "google.png"))
+
+    def test_disabled(self):
+        self.assertFalse(instrumentation.active)
+        events = []
+        with instrumentation.instrumented(events.append):
+            self.assertTrue(instrumentation.active)
+        box.detect_rects(self.image)
+
+        self.assertFalse(instrumentation.active)
+        self.assertEqual([], events)
+
+    def test_pipeline(self):
+        sink = instrumentation.HistogramSink()
+        events = []
+        with instrumentation.instrumented(sink, events.append):
+            grouped_rects = box.detect_rects(self.image)
+
+        snapshot = sink.snapshot()
+        for name in ("grayscale_blur", "canny", "find_contours", "approx_poly", "group_rects", "union_find"):
+            self.assertEqual(1, snapshot["stages"][name]["count"], name)
+            self.assertGreaterEqual(snapshot["stages"][name]["wall_seconds"], 0)
+
+        _, bound_rect = box.canny_detection(box.grayscale_blur(self.image))
+        counters = snapshot["counters"]
+        self.assertEqual(len(bound_rect), counters["contours"])
+        self.assertEqual(len(bound_rect), counters["rects"])
+        self.assertEqual(len(bound_rect), counters["rects_grouped"])
+        self.assertEqual(len(grouped_rects), counters["groups"])
+        self.assertEqual(len(bound_rect) - len(grouped_rects), counters["unions"])
+
+        self.assertEqual(
+            {"stage", "count"}, {event.kind for event in events}
+        )
+        self.assertTrue(all(event.cpu is not None for event in events if event.kind == "stage"))
+
+    def test_union_find(self):
+        sink = instrumentation.HistogramSink()
+        with instrumentation.instrumented(sink):
+            union_find = uf(6, list(range(6)))
+            for p, q in ((0, 1), (2, 3), (1, 3), (4, 5), (0, 3)):
+                union_find.union(p, q)
+            union_find.find(3)
+            union_find.get_unions()
+
+        snapshot = sink.snapshot()
+        self.assertEqual(4, snapshot["counters"]["unions"])
+        self.assertGreater(snapshot["counters"]["path_compression_steps"], 0)
+        self.assertEqual(1, snapshot["stages"]["get_unions"]["count"])
+
+    def test_histogram(self):
+        sink = instrumentation.HistogramSink(buckets=(0.001, 0.01))
+        for value in (0.0005, 0.001, 0.005, 0.5):
+            sink(instrumentation.Event("stage", "canny", value, value / 2))
+        sink(instrumentation.Event("count", "contours", 7))
+        sink(instrumentation.Event("count", "contours", 3))
+
+        snapshot = sink.snapshot()
+        self.assertEqual([(0.001, 2), (0.01, 3), (float("inf"), 4)], snapshot["stages"]["canny"]["buckets"])
+        self.assertAlmostEqual(0.5065, snapshot["stages"]["canny"]["wall_seconds"])
+        self.assertEqual(10, snapshot["counters"]["contours"])
+
+        text = sink.prometheus_text()
+        self.assertIn("# TYPE icondetection_stage_wall_seconds histogram", text)
+        self.assertIn('icondetection_stage_wall_seconds_bucket{stage="canny",le="0.01"} 3', text)
+        self.assertIn('icondetection_stage_wall_seconds_bucket{stage="canny",le="+Inf"} 4', text)
+        self.assertIn('icondetection_stage_wall_seconds_count{stage="canny"} 4', text)
+        self.assertIn("icondetection_contours_total 10", text)
+
+        sink.reset()
+        self.assertEqual({"stages": {}, "counters": {}}, sink.snapshot())
+
+class TestEngines(unittest.TestCase):
+    """
+    Tests for the detection engine registry and the engine comparison
+    """
+
+    def setUp(self):
+        self.gray = box.grayscale_blur(cv.imread(os.path.join(TEST_IMAGES, "google.png")))
+
+    def test_engines(self):
+        for name in ("canny", "canny_rects", "pyramid", "components", "gradient", "mser"):
+            rects = engines.detect_rects(self.gray, name)
+            self.assertEqual(2, rects.ndim)
+            self.assertEqual(4, rects.shape[1])
+            self.assertEqual(np.int32, rects.dtype)
+
+        np.testing.assert_array_equal(
+            np.asarray(box.canny_detection(self.gray)[1], dtype=np.int32), engines.detect_rects(self.gray)
+        )
+        self.assertRaises(ValueError, engines.detect_rects, self.gray, "unknown")
+
+    def test_components(self):
+        image = np.zeros((60, 80), dtype=np.uint8)
+        image[10:20, 10:30] = 255
+        image[40:50, 50:70] = 255
+
+        for name in ("components", "gradient"):
+            found = sorted(tuple(rect) for rect in engines.detect_rects(image, name).tolist())
+            self.assertEqual(2, len(found))
+            self.assertEqual(1.0, engines.recall(found, [(10, 10, 20, 10), (50, 40, 20, 10)], min_iou=0.6))
+
+    def test_register_and_report(self):
+        engines.register_engine("empty", lambda image, min_threshold, multiplier: np.empty((0, 4), dtype=np.int32))
+        sink = instrumentation.HistogramSink()
+        try:
+            with instrumentation.instrumented(sink):
+                self.assertEqual(0, len(engines.detect_rects(self.gray, "empty")))
+        finally:
+            del engines.ENGINES["empty"]
+
+        self.assertEqual(1, sink.snapshot()["stages"]["engine.empty"]["count"])
+
+    def test_recall(self):
+        reference = [(0, 0, 10, 10), (20, 20, 10, 10), (40, 40, 10, 10), (60, 60, 10, 10)]
+        found = [(0, 0, 10, 10), (21, 21, 10, 10), (40, 40, 2, 2)]
+
+        self.assertEqual(0.5, engines.recall(found, reference))
+        self.assertEqual(0.5, engines.recall(found, reference, chunk_size=1))
+        self.assertEqual(0.25, engines.recall(found, reference, min_iou=0.9))
+        self.assertEqual(1.0, engines.recall(found, []))
+        self.assertEqual(0.0, engines.recall([], reference))
+
+    def test_compare_engines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cv.imwrite(os.path.join(directory, "google.png"), cv.imread(os.path.join(TEST_IMAGES, "google.png")))
+            comparison = benchmark.compare_engines(directory, ["canny", "components", "gradient"], repeat=3)
+
+            self.assertEqual(1.0, comparison["canny"]["recall"])
+            self.assertGreater(comparison["canny"]["recall"], comparison["gradient"]["recall"])
+            self.assertEqual(0, main(["engines", "--images", directory, "--engines", "canny", "--repeat", "1"]))
+            self.assertEqual(1, main([
+                "engines", "--images", directory, "--engines", "mser", "--min-recall", "1", "--repeat", "1"
+            ]))
+
+        self.assertRaises(ValueError, benchmark.compare_engines, os.path.join(TEST_IMAGES, "missing"))
+
+        comparison = {"slow": {"p50": 2.0, "recall": 1.0}, "fast": {"p50": 1.0, "recall": 0.9}}
+        self.assertEqual("fast", benchmark.fastest_engine(comparison, 0.9))
+        self.assertEqual("slow", benchmark.fastest_engine(comparison, 0.95))
+        self.assertIsNone(benchmark.fastest_engine(comparison, 1.1))
+
+
+class TestPyramid(unittest.TestCase):
+    """
+    Test that coarse to fine detection matches a full detection inside the regions it refines
+    """
+
+    def setUp(self):
+        self.image = cv.imread(os.path.join(TEST_IMAGES, "popular.png"))
+        # a large and mostly empty frame, where most of the image is never refined
+        self.sparse = np.full((1600, 2400, 3), 240, dtype=np.uint8)
+        self.sparse[300:300 + self.image.shape[0], 500:500 + self.image.shape[1]] = self.image
+
+    def test_matches_full_detection(self):
+        for image in (self.image, self.sparse, cv.imread(os.path.join(TEST_IMAGES, "google.png"))):
+            self.assertEqual(box.detect_rects(image), pyramid_detect_rects(image))
+
+    def test_overlapping_regions(self):
+        # the region of the icon lies within the bounding box of the L shaped region around it
+        image = np.full((600, 600, 3), 240, dtype=np.uint8)
+        cv.line(image, (100, 100), (500, 100), (0, 0, 0), 2)
+        cv.line(image, (100, 100), (100, 500), (0, 0, 0), 2)
+        cv.rectangle(image, (300, 300), (340, 340), (0, 0, 0), -1)
+        self.assertEqual(2, len(coarse_regions(box.grayscale_blur(image))))
+
+        sink = instrumentation.HistogramSink()
+        with instrumentation.instrumented(sink):
+            grouped = pyramid_detect_rects(image)
+
+        self.assertEqual(box.detect_rects(image), grouped)
+        self.assertEqual(1, sink.snapshot()["counters"]["pyramid_regions"])
+
+    def test_refines_regions_only(self):
+        sink = instrumentation.HistogramSink()
+        with instrumentation.instrumented(sink):
+            bound_rect = pyramid_bounding_rects(self.sparse, scale=0.25)
+
+        snapshot = sink.snapshot()
+        self.assertIn("pyramid_refine", snapshot["stages"])
+        self.assertGreater(snapshot["counters"]["pyramid_regions"], 0)
+        self.assertEqual(sorted(box.canny_detection(box.grayscale_blur(self.sparse))[1]), sorted(bound_rect))
+
+        regions = coarse_regions(box.grayscale_blur(self.sparse), scale=0.25)
+        self.assertLess(int(regions.get_area().sum()), self.sparse.shape[0] * self.sparse.shape[1] // 2)
+        self.assertTrue((regions.top >= 300 - 16).all() and (regions.left >= 500 - 16).all())
+
+    def test_full_frame_fallback(self):
+        sink = instrumentation.HistogramSink()
+        with instrumentation.instrumented(sink):
+            grouped = pyramid_detect_rects(self.image, full_frame_ratio=0)
+
+        self.assertEqual(box.detect_rects(self.image), grouped)
+        self.assertNotIn("pyramid_refine", sink.snapshot()["stages"])
+
+    def test_edge_cases(self):
+        self.assertEqual([], pyramid_detect_rects(np.zeros((64, 64, 3), dtype=np.uint8)))
+        self.assertEqual(0, len(coarse_regions(np.zeros((64, 64), dtype=np.uint8))))
+        self.assertRaises(ValueError, coarse_regions, np.zeros((64, 64), dtype=np.uint8), 0)
+        self.assertRaises(ValueError, coarse_regions, np.zeros((64, 64), dtype=np.uint8), 1.5)
+
+
+class TestDetectNear(unittest.TestCase):
+    """
+    Test that detection around a point settles on the candidate rectangle of a full detection
+    """
+
+    def test_matches_full_detection(self):
+        rng = random.Random(5)
+        for name in ("google.png", "popular.png", "header.png"):
+            image = cv.imread(os.path.join(TEST_IMAGES, name))
+            groups = [r.Rectangle.rect_cv_to_cartesian(rect) for rect in box.detect_rects(image)]
+
+            for _ in range(40):
+                point = (rng.randrange(image.shape[1]), rng.randrange(image.shape[0]))
+                expected = box.candidate_rectangle(groups, point)
+                found = detect_near(image, point)
+                # ties may settle on another group at the same distance
+                self.assertIn(found, groups)
+                self.assertEqual(expected.distance_to_point(point), found.distance_to_point(point))
+
+    def test_small_window(self):
+        image = cv.imread(os.path.join(TEST_IMAGES, "popular.png"))
+        point = (1000, 500)
+        groups = [r.Rectangle.rect_cv_to_cartesian(rect) for rect in box.detect_rects(image)]
+
+        sink = instrumentation.HistogramSink()
+        with instrumentation.instrumented(sink):
+            found = detect_near(image, point, full_frame_ratio=1)
+
+        self.assertEqual(box.candidate_rectangle(groups, point), found)
+        self.assertLess(sink.snapshot()["counters"]["detect_near_windows"], 4)
+
+    def test_edge_cases(self):
+        blank = np.zeros((50, 80, 3), dtype=np.uint8)
+        self.assertIsNone(detect_near(blank, (10, 10)))
+
+        blank[20:30, 50:70] = 255
+        self.assertEqual(r.Rectangle.rect_cv_to_cartesian(box.detect_rects(blank)[0]), detect_near(blank, (0, 0), 8))
+
+        self.assertRaises(ValueError, detect_near, blank, (80, 10))
+        self.assertRaises(ValueError, detect_near, blank, (10, 10), growth=1)
+
+    def test_full_frame(self):
+        image = cv.imread(os.path.join(TEST_IMAGES, "popular.png"))
+        groups = [r.Rectangle.rect_cv_to_cartesian(rect) for rect in box.detect_rects(image)]
+
+        sink = instrumentation.HistogramSink()
+        with instrumentation.instrumented(sink):
+            found = detect_near(image, (100, 100), full_frame_ratio=0)
+
+        # a window covering the whole image costs a single Canny pass, as a full detection does
+        self.assertEqual(box.candidate_rectangle(groups, (100, 100)), found)
+        self.assertEqual(1, sink.snapshot()["stages"]["canny"]["count"])
+
+    def test_slow_growth(self):
+        # growths rounding a small window back down to its own size must still widen it
+        image = np.zeros((400, 400, 3), dtype=np.uint8)
+        image[40:60, 40:80] = 255
+        expected = r.Rectangle.rect_cv_to_cartesian(box.detect_rects(image)[0])
+        for growth in (1.01, 1.5):
+            self.assertEqual(expected, detect_near(image, (200, 200), window=2, growth=growth))
+
+
+class TestRectFormat(unittest.TestCase):
+    """
+    Tests for the binary rect file format
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "rects.rects")
+
+        gray = box.grayscale_blur(cv.imread(os.path.join(TEST_IMAGES, "google.png")))
+        contours, self.hierarchy = cv.findContours(box.canny_edges(gray), cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+        self.rects = box.approximate_bounding_rects(contours)[1]
+        self.labels, _ = box.group_rect_array(RectArray.from_cv(self.rects))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        index = rect_format.index_from_counts([len(self.rects) - 10, 0, 10])
+        rect_format.write_rects(self.path, self.rects, self.labels, self.hierarchy, index)
+
+        for rect_set in (rect_format.load_rects(self.path), rect_format.load_rects(self.path, mmap=False)):
+            self.assertEqual(self.rects, rect_set.to_list())
+            np.testing.assert_array_equal(self.labels, rect_set.labels)
+            np.testing.assert_array_equal(self.hierarchy.reshape(-1, 4), rect_set.hierarchy)
+            self.assertEqual(3, rect_set.image_count)
+            self.assertEqual(0, len(rect_set.image_rects(1)))
+            self.assertEqual(self.rects[-10:], rect_set.to_list(2))
+            self.assertEqual([r.Rectangle.rect_cv_to_cartesian(rect) for rect in self.rects], rect_set.to_rectangles())
+            self.assertFalse(rect_set.rects.flags.writeable)
+
+        # the sections are views of the mapped file
+        base = rect_format.load_rects(self.path).rects
+        while isinstance(base, np.ndarray) and not isinstance(base, np.memmap):
+            base = base.base
+        self.assertIsInstance(base, np.memmap)
+
+    def test_layout(self):
+        rects = RectArray.from_cv([(1, 2, 3, 4), (-5, 6, 7, 8)])
+        data = rect_format.to_bytes(rects)
+
+        self.assertEqual(rect_format.HEADER.size + 2 * 4 * 4, len(data))
+        self.assertEqual(b"ICRS", data[:4])
+        self.assertEqual((1, 2, 3, 4, -5, 6, 7, 8), struct.unpack_from("<8i", data, rect_format.HEADER.size))
+
+        rect_set = rect_format.from_bytes(data)
+        self.assertIsNone(rect_set.labels)
+        self.assertEqual(1, rect_set.image_count)
+        self.assertEqual(rects.to_rectangles(), rect_set.to_rect_array().to_rectangles())
+        self.assertEqual((0, 4), rect_format.from_bytes(rect_format.to_bytes([])).rects.shape)
+
+    def test_invalid(self):
+        data = rect_format.to_bytes(self.rects, self.labels)
+
+        self.assertRaises(ValueError, rect_format.from_bytes, data[:10])
+        self.assertRaises(ValueError, rect_format.from_bytes, data[:-4])
+        self.assertRaises(ValueError, rect_format.from_bytes, b"XXXX" + data[4:])
+        self.assertRaises(ValueError, rect_format.from_bytes, data[:4] + struct.pack("<H", 99) + data[6:])
+        self.assertRaises(ValueError, rect_format.to_bytes, self.rects, self.labels[:-1])
+        self.assertRaises(ValueError, rect_format.to_bytes, [(0, 0, 1, 2 ** 31)])
+        self.assertRaises(ValueError, rect_format.to_bytes, self.rects, index=[0, 5])
+
+        # refused from the shape alone, as the index could not address that many rects
+        too_many = np.broadcast_to(np.zeros(4, dtype=np.int32), (rect_format.MAX_RECTS + 1, 4))
+        self.assertRaises(ValueError, rect_format.to_bytes, too_many)
+
+
+class TestContainment(unittest.TestCase):
+    """
+    Test the containment tree built from the contour hierarchy
+    """
+
+    def setUp(self):
+        # a window holding a panel holding a button, and a separate icon
+        self.image = np.zeros((200, 300), dtype=np.uint8)
+        cv.rectangle(self.image, (10, 10), (190, 190), 80, -1)
+        cv.rectangle(self.image, (30, 30), (170, 170), 160, -1)
+        cv.rectangle(self.image, (60, 60), (100, 100), 255, -1)
+        cv.rectangle(self.image, (220, 40), (260, 80), 255, -1)
+        self.tree = ContainmentTree.from_image(self.image)
+
+    def test_contour_depths(self):
+        self.assertEqual([0, 1, 2, 1, 0], contour_depths([-1, 0, 1, 0, -1]).tolist())
+        self.assertEqual([], contour_depths([]).tolist())
+
+    def test_levels(self):
+        self.assertEqual(4, len(self.tree))
+        self.assertEqual(2, len(self.tree.roots()))
+
+        point = (80, 80)
+        self.assertEqual(3, len(self.tree.path(point)))
+        outermost = self.tree.outermost(point)
+        innermost = self.tree.innermost(point)
+        middle = self.tree.at_level(point, 1)
+        self.assertTrue(outermost.get_area() > middle.get_area() > innermost.get_area())
+        self.assertTrue(innermost.contains_point(point))
+        self.assertEqual(middle, self.tree.at_level(point, -2))
+        self.assertIsNone(self.tree.at_level(point, 3))
+
+        self.assertEqual(self.tree.outermost((240, 60)), self.tree.innermost((240, 60)))
+        self.assertIsNone(self.tree.innermost((280, 180)))
+
+    def test_overlapping_roots(self):
+        # a toolbar and an icon whose bounding rect overlaps it without being nested in it
+        tree = ContainmentTree(RectArray.from_cv([(40, 40, 10, 10), (0, 0, 100, 100)]), [-1, -1])
+
+        self.assertEqual(r.Rectangle.rect_cv_to_cartesian((0, 0, 100, 100)), tree.outermost((45, 45)))
+        self.assertEqual(r.Rectangle.rect_cv_to_cartesian((40, 40, 10, 10)), tree.innermost((45, 45)))
+        self.assertEqual([0], tree.path((45, 45)))
+        self.assertEqual([1], tree.path((80, 80)))
+        self.assertIsNone(tree.outermost((200, 200)))
+
+    def test_matches_canny_detection(self):
+        image = cv.imread(os.path.join(TEST_IMAGES, "google.png"))
+        _, bound_rect = box.canny_detection(box.grayscale_blur(image))
+        tree = DetectionPipeline(image).containment()
+
+        rects = {tuple(rect) for rect in tree.rects.to_cv().tolist()}
+        self.assertTrue(rects <= set(bound_rect))
+
+        # every node lies within its parent
+        children = tree.parents >= 0
+        parents = tree.rects[tree.parents[children]]
+        nodes = tree.rects[children]
+        self.assertTrue((nodes.top >= parents.top).all() and (nodes.bottom <= parents.bottom).all())
+        self.assertTrue((nodes.left >= parents.left).all() and (nodes.right <= parents.right).all())
+
+    def test_many_siblings(self):
+        # 100 overlapping roots of 50 children each, enough for both levels to be searched through an index
+        rng = np.random.default_rng(3)
+        roots = np.column_stack([rng.integers(0, 900, (100, 2)), rng.integers(40, 120, (100, 2))])
+        children = np.repeat(roots, 50, axis=0)
+        children[:, :2] += rng.integers(0, 20, (5000, 2))
+        children[:, 2:] = rng.integers(1, 20, (5000, 2))
+        rects = RectArray.from_cv(np.concatenate([roots, children]))
+        parents = np.concatenate([np.full(100, -1), np.repeat(np.arange(100), 50)])
+        tree = ContainmentTree(rects, parents)
+
+        def scanned_path(point):
+            path, candidates = [], tree.roots()
+            while True:
+                inside = [node for node in candidates.tolist() if tree.rect(node).contains_point(point)]
+                if len(inside) == 0:
+                    return path
+                path.append(min(inside, key=lambda node: tree.areas[node]))
+                candidates = tree.children(path[-1])
+
+        for point in rng.integers(0, 1000, (300, 2)).tolist():
+            self.assertEqual(scanned_path(tuple(point)), tree.path(tuple(point)))
+
+    def test_invalid_parents(self):
+        with self.assertRaises(ValueError):
+            ContainmentTree(RectArray.from_cv([(0, 0, 1, 1)]), [3])
+
+    def test_rects_only_pipeline(self):
+        with self.assertRaises(ValueError):
+            DetectionPipeline(self.image, rects_only=True).containment()
+
+
+class TestNavigation(unittest.TestCase):
+    """
+    Test directional and nearest neighbour navigation over detected rects
+    """
+
+    def setUp(self):
+        # a 3 by 3 grid of icons, with the middle row shifted slightly right
+        self.grid = [(col * 100 + row * 5, row * 100, 40, 40) for row in range(3) for col in range(3)]
+        self.graph = NavigationGraph.from_cv(self.grid)
+
+    def test_grid(self):
+        self.assertEqual(5, self.graph.neighbour(4, "right"))
+        self.assertEqual(3, self.graph.neighbour(4, "left"))
+        self.assertEqual(1, self.graph.neighbour(4, "up"))
+        self.assertEqual(7, self.graph.neighbour(4, "down"))
+        self.assertIsNone(self.graph.neighbour(0, "left"))
+        self.assertIsNone(self.graph.neighbour(8, "down"))
+        self.assertRaises(ValueError, self.graph.neighbour, 0, "forward")
+
+        self.assertEqual(8, self.graph.walk(0, ["right", "right", "right", "down", "down"]))
+
+    def test_beam_preferred(self):
+        # a far icon in the same row wins over a close one diagonally off it
+        graph = NavigationGraph.from_cv([(0, 0, 40, 40), (300, 0, 40, 40), (60, 60, 40, 40)])
+
+        self.assertEqual(1, graph.neighbour(0, "right"))
+        self.assertEqual(2, graph.neighbour(0, "down"))
+
+    def test_point_queries(self):
+        start = self.graph.start((120, 20))
+        self.assertEqual(1, start)
+        # the two neighbours of the middle icon are equally far, so the first one listed comes first
+        self.assertEqual([1, 0, 2], self.graph.nearest((120, 20), 3))
+        self.assertEqual([1], self.graph.within((120, 20), 10))
+
+    def test_detected(self):
+        grouped = box.detect_rects(cv.imread(os.path.join(TEST_IMAGES, "google.png")))
+        graph = NavigationGraph.from_cv(grouped)
+        rects = graph.rects
+
+        self.assertEqual(len(grouped), len(graph))
+        for index in range(len(graph)):
+            right = graph.neighbour(index, "right")
+            if right is not None:
+                self.assertGreater(rects[right].right, rects[index].right)
+            down = graph.neighbour(index, "down")
+            if down is not None:
+                self.assertGreater(rects[down].bottom, rects[index].bottom)
+
+
+class TestTracking(unittest.TestCase):
+    """
+    Test that rects keep their ids across frames
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        self.rects = np.c_[
+            rng.randint(0, 1800, 400), rng.randint(0, 1000, 400), rng.randint(8, 48, 400), rng.randint(8, 48, 400)
+        ]
+        self.tracker = RectTracker()
+
+    def test_static_frames(self):
+        first = self.tracker.update(self.rects)
+        self.assertEqual(list(range(400)), first.ids.tolist())
+        self.assertEqual(400, len(first.added))
+
+        second = self.tracker.update(self.rects)
+        self.assertEqual(first.ids.tolist(), second.ids.tolist())
+        self.assertEqual(0, len(second.added) + len(second.removed) + len(second.moved))
+
+    def test_moved_removed_added(self):
+        ids = self.tracker.update(self.rects).ids
+
+        frame = self.rects.copy()
+        frame[:20, :2] += 2
+        frame = np.concatenate([frame[10:], [(1900, 1100, 20, 20)]])[::-1]
+        update = self.tracker.update(frame)
+
+        self.assertEqual(ids[10:].tolist(), update.ids[:0:-1].tolist())
+        self.assertEqual([400], update.added.tolist())
+        self.assertEqual(list(range(10)), sorted(update.removed.tolist()))
+        self.assertEqual(list(range(10, 20)), sorted(update.moved.tolist()))
+
+    def test_max_distance(self):
+        icon = [(100, 100, 10, 10)]
+        self.tracker.update(icon)
+        self.assertEqual([1], self.tracker.update([(130, 100, 10, 10)]).ids.tolist())
+
+        tracker = RectTracker(max_distance=40)
+        tracker.update(icon)
+        update = tracker.update([(130, 100, 10, 10)])
+        self.assertEqual([0], update.ids.tolist())
+        self.assertEqual([0], update.moved.tolist())
+
+    def test_matches_dense_assignment(self):
+        rng = np.random.RandomState(8)
+        frame = self.rects + rng.randint(-6, 7, self.rects.shape)
+        tracker = RectTracker(min_iou=0.5)
+        tracker.update(self.rects)
+        update = tracker.update(frame)
+
+        iou = RectArray.from_cv(self.rects).iou_matrix(RectArray.from_cv(frame))
+        rows, columns = np.nonzero(iou >= 0.5)
+        rows, columns = greedy_assignment(iou[rows, columns], rows, columns)
+        self.assertEqual(sorted(columns.tolist()), np.flatnonzero(update.ids < 400).tolist())
+        self.assertEqual(rows.tolist(), update.ids[columns].tolist())
+
+    def test_greedy_assignment(self):
+        def sequential(scores, rows, columns, descending):
+            taken_rows, taken_columns, assigned = set(), set(), []
+            for pair in np.lexsort((columns, rows, -scores if descending else scores)).tolist():
+                if rows[pair] not in taken_rows and columns[pair] not in taken_columns:
+                    taken_rows.add(rows[pair])
+                    taken_columns.add(columns[pair])
+                    assigned.append((rows[pair], columns[pair]))
+            return assigned
+
+        # few distinct scores, so ties and chains of conflicts abound
+        rng = np.random.RandomState(9)
+        for descending in (True, False):
+            for _ in range(50):
+                rows, columns = rng.randint(0, 20, 150), rng.randint(0, 20, 150)
+                scores = rng.randint(0, 4, 150) / 4
+                assigned_rows, assigned_columns = greedy_assignment(scores, rows, columns, descending)
+                self.assertEqual(
+                    sequential(scores, rows, columns, descending),
+                    list(zip(assigned_rows.tolist(), assigned_columns.tolist())),
+                )
+
+        empty = np.empty(0, dtype=np.int64)
+        self.assertEqual(0, len(greedy_assignment(np.empty(0), empty, empty)[0]))
+
+    def test_exact_matches_duplicates(self):
+        previous = np.array([(0, 0, 5, 5), (0, 0, 5, 5), (9, 9, 1, 1)])
+        current = np.array([(9, 9, 1, 1), (0, 0, 5, 5)])
+        previous_indices, current_indices = exact_matches(previous, current)
+
+        self.assertEqual([(0, 1), (2, 0)], sorted(zip(previous_indices.tolist(), current_indices.tolist())))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, RectTracker, min_iou=0)
+        self.assertRaises(ValueError, RectTracker, chunk_size=0)
+
+
+class TestFingerprint(unittest.TestCase):
+    """
+    Test perceptual hashing of icons and the Hamming distance index
+    """
+
+    def setUp(self):
+        self.image = cv.imread(os.path.join(TEST_IMAGES, "google.png"))
+        grouped = np.array(box.detect_rects(self.image)).reshape(-1, 4)
+        self.rects = grouped[(grouped[:, 2] >= 8) & (grouped[:, 3] >= 8)][:20]
+        self.labels = ["icon{0}".format(i) for i in range(len(self.rects))]
+
+    def test_hashes(self):
+        for method in ("dhash", "phash"):
+            hashes = fingerprint_rects(self.image, self.rects, method)
+            self.assertEqual(np.uint64, hashes.dtype)
+            self.assertEqual(len(self.rects), len(hashes))
+
+            # the same icon elsewhere, or in another channel order, hashes the same
+            rgb = np.ascontiguousarray(self.image[:, :, ::-1])
+            self.assertEqual(hashes.tolist(), fingerprint_rects(rgb, self.rects, method, "rgb").tolist())
+
+        self.assertRaises(ValueError, fingerprint_rects, self.image, self.rects, "ahash")
+        self.assertRaises(ValueError, fingerprint_rects, self.image, [(0, 0, 0, 5)])
+
+    def test_hamming_distances(self):
+        self.assertEqual([0, 1, 64], hamming_distances([0, 4, 2 ** 64 - 1], 0).tolist())
+        self.assertEqual([2, 0], hamming_distances([0b1010, 0b1111], 0b1111).tolist())
+
+    def test_matches_brute_force(self):
+        rng = np.random.RandomState(3)
+        hashes = rng.randint(0, 2 ** 62, 2000, dtype=np.int64).astype(np.uint64)
+        index = FingerprintIndex(hashes, [str(i) for i in range(len(hashes))])
+
+        for query in (hashes[:30] ^ np.uint64(0b100100101)).tolist():
+            distances = hamming_distances(hashes, query)
+            expected = sorted((int(distance), str(i)) for i, distance in enumerate(distances) if distance <= 10)
+            self.assertEqual(expected, [(distance, label) for label, distance in index.query(query, 10)])
+
+    def test_wide_distances(self):
+        rng = np.random.RandomState(4)
+        hashes = rng.randint(0, 2 ** 62, 300, dtype=np.int64).astype(np.uint64)
+        labels = [str(i) for i in range(len(hashes))]
+
+        # 2 parts 12 bits apart would mean some 2 * 32 choose 6 probes, so the library is scanned instead
+        index = FingerprintIndex(hashes, labels, parts=2)
+        for query in (hashes[:10] ^ np.uint64(0b111111111111)).tolist():
+            distances = hamming_distances(hashes, query)
+            expected = sorted((int(distance), str(i)) for i, distance in enumerate(distances) if distance <= 12)
+            self.assertEqual(expected, [(distance, label) for label, distance in index.query(query, 12)])
+
+        whole = FingerprintIndex(hashes, labels, parts=1)
+        self.assertEqual([("0", 2)], whole.query(int(hashes[0] ^ np.uint64(0b11)), 2))
+        self.assertRaises(ValueError, whole.query, int(hashes[0]), 8)
+
+    def test_library(self):
+        index = FingerprintIndex(method="phash")
+        self.assertEqual([None], index.match([0]))
+        index.add_rects(self.image, self.rects, self.labels)
+
+        matches = index.match_rects(self.image, self.rects, max_distance=0)
+        self.assertTrue(all(match is not None and match[1] == 0 for match in matches))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "library.npz")
+            index.save(path)
+            loaded = FingerprintIndex.load(path)
+
+        self.assertEqual("phash", loaded.method)
+        self.assertEqual(index.hashes.tolist(), loaded.hashes.tolist())
+        self.assertEqual(self.labels, loaded.labels.tolist())
+        self.assertEqual(matches, loaded.match_rects(self.image, self.rects, max_distance=0))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, FingerprintIndex, [1, 2], ["one"])
+        self.assertRaises(ValueError, FingerprintIndex, parts=3)
+        self.assertRaises(ValueError, FingerprintIndex, method="ahash")
+
+
+class TestFeatures(unittest.TestCase):
+    """
+    Test ROI scoped feature extraction and its descriptor cache
+    """
+
+    def setUp(self):
+        self.image = cv.imread(os.path.join(TEST_IMAGES, "google.png"))
+        grouped = np.array(box.detect_rects(self.image)).reshape(-1, 4)
+        self.rects = grouped[(grouped[:, 2] >= 16) & (grouped[:, 3] >= 16)]
+
+    def test_whole_image_matches_detector(self):
+        gray = cv.cvtColor(self.image, cv.COLOR_BGR2GRAY)
+        keypoints, descriptors = cv.SIFT_create().detectAndCompute(gray, None)
+        features = FeatureExtractor("sift").extract(self.image)
+
+        self.assertEqual([keypoint.pt for keypoint in keypoints], [tuple(point) for point in features.keypoints[:, :2]])
+        self.assertTrue(np.array_equal(descriptors, features.descriptors))
+        self.assertEqual({0}, set(features.rect_indices.tolist()))
+
+    def test_detect(self):
+        keypoints = cv.SIFT_create().detect(cv.cvtColor(self.image, cv.COLOR_BGR2GRAY), None)
+        extractor = FeatureExtractor("sift")
+        detected = extractor.detect(self.image)
+
+        def fields(points):
+            return [(point.pt, point.size, point.angle, point.response, point.octave) for point in points]
+
+        self.assertEqual(fields(keypoints), fields(detected))
+        self.assertEqual({"entries": 0, "hits": 0, "misses": 0}, extractor.stats())
+
+    def test_rects(self):
+        extractor = FeatureExtractor("orb", margin=8)
+        features = extractor.extract(self.image, self.rects)
+
+        self.assertEqual(len(features.keypoints), len(features.descriptors))
+        self.assertEqual(np.uint8, features.descriptors.dtype)
+        rects = self.rects[features.rect_indices]
+        points = features.keypoints
+        self.assertTrue(((points[:, 0] >= rects[:, 0]) & (points[:, 0] < rects[:, 0] + rects[:, 2])).all())
+        self.assertTrue(((points[:, 1] >= rects[:, 1]) & (points[:, 1] < rects[:, 1] + rects[:, 3])).all())
+
+    def test_detected_rects(self):
+        image = cv.imread(os.path.join(TEST_IMAGES, "popular.png"))
+        gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+        # straight from Canny, so thin rects, some a single pixel wide, are among them
+        rects = np.array(box.group_rects(box.canny_detection(gray)[1])).reshape(-1, 4)
+        self.assertTrue(((rects[:, 2] == 1) | (rects[:, 3] == 1)).any())
+
+        for method in ("orb", "akaze"):
+            features = FeatureExtractor(method).extract(image, rects)
+            # the default margin gives the detectors the context they need to find keypoints in most icons
+            self.assertGreater(len(set(features.rect_indices.tolist())), len(rects) // 2)
+            FeatureExtractor(method, margin=0).extract(image, rects)
+
+    def test_empty_rects(self):
+        extractor = FeatureExtractor("sift", margin=8)
+        features = extractor.extract(self.image, [(5, 5, 0, 3), (5, 5, 3, 0)])
+
+        self.assertEqual(0, len(features.keypoints))
+        self.assertEqual(0, extractor.stats()["misses"])
+
+    def test_cache(self):
+        extractor = FeatureExtractor("sift")
+        first = extractor.extract(self.image, self.rects)
+        misses = extractor.misses
+
+        # the same icons moved elsewhere are served from the cache, in their new place
+        shifted = np.zeros((self.image.shape[0] + 10, self.image.shape[1] + 20, 3), dtype=np.uint8)
+        shifted[10:, 20:] = self.image
+        moved = extractor.extract(shifted, self.rects + [20, 10, 0, 0])
+
+        self.assertEqual(misses, extractor.misses)
+        self.assertTrue(np.allclose(first.keypoints[:, :2] + [20, 10], moved.keypoints[:, :2]))
+        self.assertTrue(np.array_equal(first.descriptors, moved.descriptors))
+
+    def test_empty(self):
+        features = FeatureExtractor("sift").extract(self.image, np.empty((0, 4)))
+
+        self.assertEqual((0, 4), features.keypoints.shape)
+        self.assertEqual((0, 128), features.descriptors.shape)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, create_detector, "surf")
+        self.assertRaises(ValueError, FeatureExtractor, max_entries=-1)
+
 
     if __name__ == "__main__":
         unittest.main()